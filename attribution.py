@@ -0,0 +1,80 @@
+# FILE: attribution.py
+
+import threading
+from collections import OrderedDict
+import pandas as pd
+import streamlit as st
+from config import get_config
+
+CLASSIFICATION_COLUMNS = ["core_title", "symbol", "marketer", "product_symbol"]
+
+class TitleClassifier:
+    """
+    Thành phần attribution dùng chung cho cả process:
+    title -> (core_title, symbol, marketer, product_symbol).
+    Đường realtime, marker trên trend chart và báo cáo lịch sử đều đi qua đây.
+    Chỉ các tiêu đề duy nhất mới được phân loại, kết quả được map ngược lại
+    theo vector. Cache tự xoá khi marketer_mapping.json thay đổi.
+    """
+    def __init__(self, config, max_size: int = 50000):
+        self.config = config
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._mapping_version = config.mapping_version
+
+    def _ensure_fresh(self):
+        self.config.reload_mappings_if_changed()
+
+    def _classify_uncached(self, title: str, mappings) -> tuple:
+        core_title, symbol = mappings.symbol_matcher.extract_core_and_symbol(title)
+        marketer = mappings.page_title_map[symbol] if symbol else ""
+        return core_title, symbol, marketer, mappings.product_symbol_index.find_symbol(title)
+
+    def classify(self, title, mappings=None) -> tuple:
+        """
+        Phân loại một tiêu đề theo snapshot `mappings` (mặc định: snapshot hiện tại của config).
+        Cache chỉ chứa kết quả của version mới nhất; caller còn giữ snapshot cũ thì tính
+        trực tiếp mà không đọc/ghi cache, nên kết quả của mapping cũ không lọt vào cache mới.
+        """
+        title = str(title)
+        mappings = mappings or self.config.mappings
+        with self._lock:
+            if mappings.version > self._mapping_version:
+                self._cache.clear()
+                self._mapping_version = mappings.version
+            if mappings.version == self._mapping_version:
+                result = self._cache.get(title)
+                if result is not None:
+                    self._cache.move_to_end(title)
+                    return result
+        result = self._classify_uncached(title, mappings)
+        with self._lock:
+            if mappings.version == self._mapping_version:
+                self._cache[title] = result
+                if len(self._cache) > self.max_size:
+                    self._cache.popitem(last=False)
+        return result
+
+    def classify_series(self, titles: pd.Series) -> pd.DataFrame:
+        """
+        Phân loại cả một cột tiêu đề. Trả về DataFrame có các cột
+        CLASSIFICATION_COLUMNS, cùng index với `titles`.
+        """
+        self._ensure_fresh()
+        # Một snapshot cho cả cột: mọi dòng được phân loại theo cùng một mapping
+        mappings = self.config.mappings
+        codes, uniques = pd.factorize(titles.astype(str))
+        table = pd.DataFrame([self.classify(title, mappings) for title in uniques], columns=CLASSIFICATION_COLUMNS)
+        if table.empty:
+            return pd.DataFrame(columns=CLASSIFICATION_COLUMNS, index=titles.index)
+        result = table.take(codes)
+        result.index = titles.index
+        return result
+
+@st.cache_resource
+def get_title_classifier():
+    """
+    Trả về TitleClassifier dùng chung, tồn tại qua các lần rerun.
+    """
+    return TitleClassifier(get_config())
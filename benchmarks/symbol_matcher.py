@@ -0,0 +1,89 @@
+# FILE: benchmarks/symbol_matcher.py
+"""
+So sánh SymbolMatcher với cách quét tuyến tính trước đây trên 100k dòng tổng hợp
+từ marketer_mapping.json (tách core title + symbol, rồi tra marketer), với hai tập:
+100k tiêu đề khác nhau (trường hợp xấu nhất, không có gì để nhớ) và 100k dòng lấy từ
+2.000 tiêu đề như dữ liệu GA thật, nơi cùng trang lặp lại qua các lượt poll.
+Mỗi lần lặp dựng matcher mới để bộ nhớ đệm không mang sang lần đo sau.
+Chạy từ thư mục gốc: python benchmarks/symbol_matcher.py
+"""
+
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import SymbolMatcher
+
+TITLE_COUNT = 100_000
+UNIQUE_TITLE_COUNT = 2_000
+REPEATS = 7
+
+def linear_extract_core_and_symbol(title, symbols):
+    found_symbol = ""
+    title_str = str(title)
+    for s in symbols:
+        if s in title_str:
+            found_symbol = s
+            break
+    cleaned_text = title_str.lower().split('–')[0].split(' - ')[0]
+    for s in symbols:
+        cleaned_text = cleaned_text.replace(s, '')
+    cleaned_text = re.sub(r'[^\w\s]', '', cleaned_text, flags=re.UNICODE).strip()
+    return cleaned_text, found_symbol
+
+def linear_marketer(title, symbols, page_title_map):
+    for symbol in symbols:
+        if symbol in title:
+            return page_title_map[symbol]
+    return ""
+
+def make_titles(symbols, count, unique_count=None):
+    rng = random.Random(42)
+    products = ["Hidden Camera Detector", "128 Hz Healing Instrument", "Resistance Breathing Necklace", "Yoga Mat Pro", "Smart Bottle"]
+    titles = []
+    for i in range(unique_count or count):
+        symbol = rng.choice(symbols) if rng.random() < 0.9 else ""
+        titles.append(f"{rng.choice(products)} {symbol} – Limited Edition #{i}")
+    if unique_count:
+        titles = [rng.choice(titles) for _ in range(count)]
+    return titles
+
+def best_of(make_func, titles):
+    best = float("inf")
+    for _ in range(REPEATS):
+        func = make_func()
+        started = time.perf_counter()
+        result = [func(title) for title in titles]
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+def main():
+    with open("marketer_mapping.json", encoding="utf-8") as f:
+        page_title_map = json.load(f)["page_title_mapping"]
+    symbols = sorted(page_title_map, key=len, reverse=True)
+
+    def make_linear():
+        return lambda title: (linear_extract_core_and_symbol(title, symbols), linear_marketer(title, symbols, page_title_map))
+
+    def make_matcher():
+        matcher = SymbolMatcher(symbols, page_title_map)
+        return lambda title: (matcher.extract_core_and_symbol(title), matcher.find_marketer(title))
+
+    print(f"{TITLE_COUNT} rows, best of {REPEATS}")
+    for label, titles in (
+        ("all titles unique", make_titles(symbols, TITLE_COUNT)),
+        (f"{UNIQUE_TITLE_COUNT} unique titles", make_titles(symbols, TITLE_COUNT, UNIQUE_TITLE_COUNT))
+    ):
+        linear_s, linear_result = best_of(make_linear, titles)
+        matcher_s, matcher_result = best_of(make_matcher, titles)
+        assert matcher_result == linear_result, "SymbolMatcher khác kết quả quét tuyến tính"
+        print(f"  {label}:")
+        print(f"    linear scan:   {linear_s:.3f} s")
+        print(f"    SymbolMatcher: {matcher_s:.3f} s ({linear_s / matcher_s:.2f}x)")
+
+if __name__ == "__main__":
+    main()
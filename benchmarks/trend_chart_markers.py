@@ -0,0 +1,84 @@
+# FILE: benchmarks/trend_chart_markers.py
+"""
+Đo chi phí marker mua hàng trên trend chart với 10/100/1000 đơn: cách cũ (mỗi đơn một
+go.Scatter, tra màu tuyến tính) so với _add_purchase_markers (mỗi marketer một trace).
+Thời gian gồm dựng figure và serialize JSON như st.plotly_chart làm trước khi gửi cho trình duyệt.
+Chạy từ thư mục gốc: python benchmarks/trend_chart_markers.py
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from interface import _add_purchase_markers
+
+EVENT_COUNTS = (10, 100, 1000)
+MARKETERS = [f"MKT{i}" for i in range(1, 9)]
+WINDOW_HOURS = 3
+REPEATS = 5
+
+def make_history(rng):
+    timestamps = pd.date_range(end=pd.Timestamp.now(tz="Asia/Ho_Chi_Minh").floor("min"), periods=WINDOW_HOURS * 60, freq="min")
+    return pd.DataFrame({
+        "timestamp": np.tile(timestamps, len(MARKETERS)),
+        "Marketer": np.repeat(MARKETERS, len(timestamps)),
+        "Active Users": rng.integers(0, 200, len(timestamps) * len(MARKETERS))
+    })
+
+def make_events(rng, history_df, count):
+    events = pd.DataFrame({
+        "created_at_local": history_df["timestamp"].sample(count, replace=True, random_state=int(rng.integers(1 << 31))).to_numpy(),
+        "Marketer": rng.choice(MARKETERS, count),
+        "product_symbol": rng.choice(["🌱", "📹", "🧪", "🛒"], count)
+    }).sort_values("created_at_local")
+    return pd.merge_asof(events, history_df.sort_values("timestamp"), left_on="created_at_local", right_on="timestamp", by="Marketer", direction="nearest")
+
+def add_markers_per_event(fig_trend, merged_events):
+    # Cách làm trước đây: mỗi đơn một trace, màu tra tuyến tính trong fig.data
+    for _, event in merged_events.iterrows():
+        try:
+            marker_color = fig_trend.data[[trace.name for trace in fig_trend.data].index(event['Marketer'])].line.color
+            fig_trend.add_trace(go.Scatter(
+                x=[event['created_at_local']],
+                y=[event['Active Users']],
+                mode='text',
+                text=[f"<b>{event['product_symbol']}{event['Marketer']}</b>"],
+                textposition='top center',
+                textfont=dict(size=12, color=marker_color),
+                hoverinfo='none',
+                showlegend=False
+            ))
+        except (ValueError, IndexError):
+            pass
+
+def measure(base_fig, merged_events, add_markers):
+    best_build = best_json = float("inf")
+    for _ in range(REPEATS):
+        fig = go.Figure(base_fig)
+        started = time.perf_counter()
+        add_markers(fig, merged_events)
+        built = time.perf_counter()
+        payload = fig.to_json()
+        best_build = min(best_build, built - started)
+        best_json = min(best_json, time.perf_counter() - built)
+    return len(fig.data) - len(base_fig.data), best_build, best_json, len(payload)
+
+def main():
+    rng = np.random.default_rng(15)
+    history_df = make_history(rng)
+    base_fig = px.line(history_df, x="timestamp", y="Active Users", color="Marketer", color_discrete_sequence=px.colors.qualitative.Plotly)
+    print(f"{len(MARKETERS)} marketers, {WINDOW_HOURS}h of minute points, best of {REPEATS}")
+    print(f"{'events':>6} {'method':<12} {'traces':>6} {'build ms':>9} {'to_json ms':>10} {'json KB':>8}")
+    for count in EVENT_COUNTS:
+        merged_events = make_events(rng, history_df, count)
+        for method, add_markers in (("per event", add_markers_per_event), ("per marketer", _add_purchase_markers)):
+            traces, build_s, json_s, size = measure(base_fig, merged_events, add_markers)
+            print(f"{count:>6} {method:<12} {traces:>6} {build_s * 1000:>9.1f} {json_s * 1000:>10.1f} {size / 1024:>8.0f}")
+
+if __name__ == "__main__":
+    main()
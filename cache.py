@@ -0,0 +1,140 @@
+# FILE: cache.py
+
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+import streamlit as st
+
+# Kết quả trả về cho caller: value là giá trị tốt gần nhất (None nếu chưa từng lấy được),
+# age_seconds là tuổi của giá trị đó, error là lỗi của lần refresh gần nhất (nếu có).
+CacheResult = namedtuple("CacheResult", ["value", "fetched_at", "age_seconds", "error", "refreshing"])
+
+# Các namespace cache có thể xoá theo tag. Mỗi thay đổi chỉ xoá những gì phụ thuộc vào nó
+# thay vì st.cache_data.clear() cho toàn bộ app.
+CACHE_TAG_SETTINGS = "settings"
+CACHE_TAG_REALTIME_GA = "realtime_ga"
+CACHE_TAG_HISTORICAL = "historical"
+CACHE_TAG_SHOPIFY = "shopify"
+CACHE_TAG_HISTORY = "history"
+
+_tag_invalidators = {}
+_tag_lock = threading.Lock()
+
+def register_cache_tag(tag: str, name: str, invalidator):
+    """
+    Đăng ký hàm xoá cache cho `tag`. `invalidator(scope)` nhận scope=None (xoá hết)
+    hoặc một giá trị cụ thể (vd: property_id). Đăng ký lại cùng `name` sẽ ghi đè.
+    """
+    with _tag_lock:
+        _tag_invalidators.setdefault(tag, {})[name] = invalidator
+
+def invalidate_cache_tags(*tags: str, scope=None):
+    with _tag_lock:
+        invalidators = [(tag, name, fn) for tag in tags for name, fn in _tag_invalidators.get(tag, {}).items()]
+    for tag, name, invalidator in invalidators:
+        try:
+            invalidator(scope)
+        except Exception as e:
+            print(f"[cache] Could not invalidate '{name}' for tag '{tag}': {e}")
+
+class _Entry:
+    __slots__ = ("value", "fetched_at", "fetched_monotonic", "error", "future", "expired")
+
+    def __init__(self):
+        self.value = None
+        self.fetched_at = None
+        self.fetched_monotonic = None
+        self.error = None
+        self.future = None
+        self.expired = False
+
+class StaleWhileRevalidateCache:
+    """
+    Cache stale-while-revalidate, single-flight theo key cho các lời gọi upstream (GA, Shopify).
+    - Giá trị còn hạn: trả ngay.
+    - Hết hạn: chạy đúng một lần refresh nền cho key đó, caller nhận giá trị cũ kèm tuổi
+      (hoặc chờ tối đa `wait_timeout` giây để lấy giá trị mới).
+    - Chưa có giá trị: các caller cùng lúc dùng chung một request đang chạy.
+    - Refresh lỗi: giữ nguyên giá trị tốt trước đó và ghi lại lỗi.
+    """
+    def __init__(self, max_workers: int = 8):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="swr-refresh")
+
+    def _run_loader(self, key, entry: _Entry, loader):
+        try:
+            value = loader()
+        except Exception as e:
+            print(f"[cache] Refresh failed for {key!r}, keeping last good value. Error: {e}")
+            with self._lock:
+                entry.error = e
+                entry.future = None
+            return
+        with self._lock:
+            entry.value = value
+            entry.fetched_at = time.time()
+            entry.fetched_monotonic = time.monotonic()
+            entry.error = None
+            entry.future = None
+            entry.expired = False
+
+    def invalidate(self, predicate):
+        """Đánh dấu hết hạn các key thoả `predicate`; giá trị cũ vẫn được trả trong lúc refresh."""
+        with self._lock:
+            for key, entry in self._entries.items():
+                if predicate(key):
+                    entry.expired = True
+
+    def _ensure_refresh(self, key, loader, ttl_seconds: float):
+        """Khởi động refresh nếu key đã hết hạn và chưa có refresh nào đang chạy; trả về future đang chạy (nếu có)."""
+        with self._lock:
+            entry = self._entries.setdefault(key, _Entry())
+            fresh = not entry.expired and entry.fetched_monotonic is not None and time.monotonic() - entry.fetched_monotonic < ttl_seconds
+            if not fresh and entry.future is None:
+                entry.future = self._executor.submit(self._run_loader, key, entry, loader)
+            return entry.future
+
+    def _result(self, key) -> CacheResult:
+        with self._lock:
+            entry = self._entries[key]
+            age = time.monotonic() - entry.fetched_monotonic if entry.fetched_monotonic is not None else None
+            return CacheResult(entry.value, entry.fetched_at, age, entry.error, entry.future is not None)
+
+    def get_many(self, loaders: dict, ttl_seconds: float, wait_timeout: float = 0, miss_timeout: float = 30) -> dict:
+        """
+        `loaders` là {key: hàm không tham số}. Các key hết hạn được refresh song song.
+        Key đã có giá trị chỉ chờ tối đa `wait_timeout`; key chưa có giá trị chờ tối đa `miss_timeout`.
+        Trả về {key: CacheResult}.
+        """
+        futures = {key: self._ensure_refresh(key, loader, ttl_seconds) for key, loader in loaders.items()}
+        with self._lock:
+            has_value = {key: self._entries[key].fetched_monotonic is not None for key in loaders}
+        pending_misses = [future for key, future in futures.items() if future is not None and not has_value[key]]
+        pending_stale = [future for key, future in futures.items() if future is not None and has_value[key]]
+        deadline = time.monotonic() + max(wait_timeout, miss_timeout if pending_misses else 0)
+        if pending_misses:
+            wait(pending_misses, timeout=miss_timeout)
+        if pending_stale and wait_timeout > 0:
+            wait(pending_stale, timeout=max(0, min(wait_timeout, deadline - time.monotonic())))
+        return {key: self._result(key) for key in loaders}
+
+    def get(self, key, loader, ttl_seconds: float, wait_timeout: float = 0, miss_timeout: float = 30) -> CacheResult:
+        return self.get_many({key: loader}, ttl_seconds, wait_timeout, miss_timeout)[key]
+
+@st.cache_resource
+def get_upstream_cache():
+    """
+    Trả về cache SWR dùng chung cho các lời gọi upstream của toàn bộ process.
+    """
+    upstream_cache = StaleWhileRevalidateCache()
+    register_cache_tag(
+        CACHE_TAG_REALTIME_GA, "upstream.ga_realtime",
+        lambda scope: upstream_cache.invalidate(lambda key: key[0] == "ga_realtime" and (scope is None or key[1] == scope))
+    )
+    register_cache_tag(
+        CACHE_TAG_SHOPIFY, "upstream.shopify_realtime",
+        lambda scope: upstream_cache.invalidate(lambda key: key[0] == "shopify_realtime")
+    )
+    return upstream_cache
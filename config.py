@@ -2,11 +2,133 @@
 
 import json
 import os
+import re
+import threading
+from collections import namedtuple
+from functools import lru_cache
 import streamlit as st
 from google.oauth2 import service_account
 from supabase import create_client, Client
 import toml
 import copy
+from resources import ManagedResource
+
+def _build_trie_regex(words):
+    """Gộp các chuỗi thành một regex dạng trie; nhánh dài hơn luôn được thử trước."""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            body = f"(?:{body})?"
+        return body
+
+    return build(trie)
+
+class SymbolMatcher:
+    """
+    Chỉ mục symbol marketer được compile một lần từ marketer_mapping.json.
+    Tìm và loại bỏ toàn bộ symbol trong một lần quét, giữ nguyên quy tắc
+    "symbol dài nhất được ưu tiên" của cách quét tuyến tính trước đây.
+    `symbols` xếp theo độ dài giảm dần (như AppConfig.SYMBOLS): regex trie lấy match dài
+    nhất tại một vị trí, và lần tìm sau bắt đầu ngay sau điểm đầu của match trước nên
+    không bỏ sót các match chồng lên nhau.
+    Tiêu đề GA lặp lại ở mỗi lượt poll, nên kết quả (core title, symbol) được nhớ theo
+    tiêu đề: mỗi tiêu đề chỉ quét một lần cho cả tách core, tìm symbol và tra marketer.
+    Matcher được dựng lại khi mapping đổi nên bộ nhớ đệm tự làm mới theo.
+    """
+    SCAN_CACHE_SIZE = 65536
+
+    def __init__(self, symbols: list, page_title_map: dict):
+        self.symbols = symbols
+        self.page_title_map = page_title_map
+        self._rank = {symbol: i for i, symbol in enumerate(symbols)}
+        self._find_pattern = re.compile(_build_trie_regex(symbols)) if symbols else None
+        # Tiêu đề đã lower() nên symbol có chữ hoa không bao giờ khớp; symbol chỉ gồm
+        # ký tự không phải chữ/khoảng trắng thì đã bị [^\w\s] loại bỏ. Chỉ những symbol
+        # còn lại mới cần nhánh riêng, gộp chung với bước xoá dấu câu.
+        strip_symbols = [s for s in symbols if s == s.lower() and re.search(r'[\w\s]', s)]
+        strip_prefix = _build_trie_regex(strip_symbols) + "|" if strip_symbols else ""
+        self._clean_pattern = re.compile(strip_prefix + r'[^\w\s]', flags=re.UNICODE)
+        self._scan = lru_cache(maxsize=self.SCAN_CACHE_SIZE)(self._scan_uncached)
+
+    def _scan_uncached(self, title: str) -> tuple:
+        cleaned_text = title.lower().split('–')[0].split(' - ')[0]
+        cleaned_text = self._clean_pattern.sub('', cleaned_text).strip()
+        return cleaned_text, self._search_symbol(title)
+
+    def _search_symbol(self, title: str) -> str:
+        if self._find_pattern is None:
+            return ""
+        best_rank = len(self.symbols)
+        # Không dùng findall/lookahead: findall bỏ qua match chồng lên nhau ("ab" che "bcd" trong "abcd"),
+        # còn lookahead làm regex mất bước quét nhanh theo ký tự đầu
+        search = self._find_pattern.search
+        match = search(title)
+        while match:
+            rank = self._rank[match.group()]
+            if rank < best_rank:
+                best_rank = rank
+            match = search(title, match.start() + 1)
+        return self.symbols[best_rank] if best_rank < len(self.symbols) else ""
+
+    def find_symbol(self, title: str) -> str:
+        return self._scan(str(title))[1]
+
+    def find_marketer(self, title: str) -> str:
+        symbol = self.find_symbol(title)
+        return self.page_title_map[symbol] if symbol else ""
+
+    def extract_core_and_symbol(self, title):
+        return self._scan(str(title))
+
+class ProductSymbolIndex:
+    """
+    Chỉ mục keyword sản phẩm -> biểu tượng, chuẩn hoá chữ thường một lần.
+    Một regex lookahead kiểm tra mọi vị trí trong tiêu đề; thứ tự nhánh theo
+    thứ tự trong product_to_symbol_mapping nên keyword khai báo trước vẫn thắng.
+    """
+    DEFAULT_SYMBOL = "🛒"
+
+    def __init__(self, product_to_symbol_map: dict):
+        self.keywords = [product_name.lower() for product_name in product_to_symbol_map]
+        self.symbols = list(product_to_symbol_map.values())
+        self._rank = {keyword: i for i, keyword in reversed(list(enumerate(self.keywords)))}
+        alternation = "|".join(re.escape(keyword) for keyword in self.keywords)
+        self._pattern = re.compile(f"(?=({alternation}))") if self.keywords else None
+
+    def find_symbol(self, product_title: str) -> str:
+        if self._pattern is None:
+            return self.DEFAULT_SYMBOL
+        best_rank = len(self.keywords)
+        for keyword in self._pattern.findall(str(product_title).lower()):
+            rank = self._rank[keyword]
+            if rank < best_rank:
+                best_rank = rank
+        return self.symbols[best_rank] if best_rank < len(self.keywords) else self.DEFAULT_SYMBOL
+
+# Toàn bộ dữ liệu dựng từ marketer_mapping.json. Khi nạp lại, một MappingState mới được dựng
+# xong rồi mới gán vào AppConfig.mappings trong một lần, nên luồng đang đọc luôn thấy
+# map, matcher và version khớp nhau.
+MappingState = namedtuple("MappingState", [
+    "version", "page_title_map", "landing_page_map", "product_to_symbol_map", "symbols",
+    "symbol_matcher", "product_symbol_index"
+])
+
+def _supabase_health_check(client) -> bool:
+    client.table("app_settings").select("id").limit(1).execute()
+    return True
+
+def _close_supabase_client(client):
+    client.postgrest.session.close()
 
 class AppConfig:
     def _deep_merge(self, base: dict, override: dict):
@@ -53,15 +175,38 @@ class AppConfig:
         self.supabase_url = supa_config.get("url")
         self.supabase_anon_key = supa_config.get("anon_key")
 
-        self.supabase = None
+        if self.supabase_resource is not None:
+            self.supabase_resource.close()
+        self.supabase_resource = None
         service_role_key = supa_config.get("service_role_key")
+        if self.supabase_url and service_role_key:
+            supabase_url = self.supabase_url
+            # Client server dùng chung cho cả process; được health check và tạo lại khi lỗi liên tiếp
+            self.supabase_resource = ManagedResource(
+                "supabase", lambda: create_client(supabase_url, service_role_key),
+                health_check=_supabase_health_check, closer=_close_supabase_client
+            )
+        
+        print(f"[config_refresh] Supabase URL present: {bool(self.supabase_url)}, anon key present: {bool(self.supabase_anon_key)}, server client: {self.supabase_resource is not None}")
+
+    def record_supabase_result(self, error=None):
+        """Báo kết quả một lời gọi Supabase cho health check của client dùng chung."""
+        if self.supabase_resource is None:
+            return
+        if error is None:
+            self.supabase_resource.record_success()
+        else:
+            self.supabase_resource.record_failure(error)
+
+    @property
+    def supabase(self):
+        if self.supabase_resource is None:
+            return None
         try:
-            if self.supabase_url and service_role_key:
-                self.supabase = create_client(self.supabase_url, service_role_key)
+            return self.supabase_resource.get()
         except Exception as e:
             print(f"[config_refresh] WARNING: Supabase server client creation failed, but preserving URL/anon for UI. Error: {e}")
-        
-        print(f"[config_refresh] Supabase URL present: {bool(self.supabase_url)}, anon key present: {bool(self.supabase_anon_key)}, server client: {bool(self.supabase)}")
+            return None
         
     def __init__(self) -> None:
         self.secrets = self._load_secrets()
@@ -69,6 +214,35 @@ class AppConfig:
         self.DEFAULT_PROPERTY_NAME = "PropeLify"
         self.HOURLY_TOKEN_QUOTA = 5000
         self.DAILY_TOKEN_QUOTA = 25000
+        # Governor quota GA: chu kỳ poll realtime của từng property nằm trong [MIN, MAX] và được giãn ra
+        # để quota giờ/ngày không cạn; luôn chừa GA_HISTORICAL_RESERVE_RATIO quota cho báo cáo lịch sử.
+        # Ước lượng token chỉ dùng khi sổ quota chưa có số liệu thật. Quota ngày của GA hồi lại lúc 0h giờ Pacific.
+        self.GA_QUOTA_STORE_PATH = os.path.join(".cache", "ga_quota.sqlite")
+        self.GA_POLL_MIN_INTERVAL_SECONDS = 60
+        self.GA_POLL_MAX_INTERVAL_SECONDS = 900
+        self.GA_HISTORICAL_RESERVE_RATIO = 0.2
+        self.GA_REALTIME_TOKENS_PER_POLL_ESTIMATE = 15
+        self.GA_HISTORICAL_TOKENS_PER_CALL_ESTIMATE = 50
+        self.GA_QUOTA_DAY_TIMEZONE = "America/Los_Angeles"
+        # Timeout (giây) cho mỗi request GA Data API
+        self.GA_REQUEST_TIMEOUT = 10
+        # Kết quả realtime GA/Shopify còn hạn trong chừng này giây; quá hạn thì refresh nền (stale-while-revalidate)
+        self.REALTIME_CACHE_TTL_SECONDS = 30
+        # Deadline chung (giây) cho một lần refresh: đường render và mỗi chu kỳ của poller.
+        # Nguồn chưa xong được thay bằng giá trị tốt gần nhất kèm nhãn stale.
+        self.REFRESH_DEADLINE_SECONDS = 2.0
+        self.POLL_DEADLINE_SECONDS = 8.0
+        # Subscriber sales_events (Supabase Realtime) phía server: đơn hàng mới vào cửa sổ trong vài giây.
+        # Khi subscriber sẵn sàng và SHOPIFY_REALTIME_POLLING_ENABLED=False thì poller không gọi Shopify REST nữa.
+        self.SALES_EVENTS_SUBSCRIBER_ENABLED = True
+        self.SHOPIFY_REALTIME_POLLING_ENABLED = False
+        # Cache báo cáo lịch sử GA theo ngày; ngày chưa chốt chỉ được dùng lại trong TTL này.
+        # Một ngày chỉ chốt khi đã qua thời điểm kết thúc ngày + GA_HISTORY_FINALIZE_LAG_SECONDS (GA còn xử lý 24-48 giờ).
+        self.GA_HISTORY_CACHE_PATH = os.path.join(".cache", "ga_daily_pages.sqlite")
+        self.GA_HISTORY_OPEN_DAY_TTL_SECONDS = 300
+        self.GA_HISTORY_FINALIZE_LAG_SECONDS = 48 * 3600
+        # Múi giờ dùng cho ranh giới ngày khi GA chưa trả về múi giờ của property (metadata.time_zone)
+        self.GA_DEFAULT_PROPERTY_TIMEZONE = "Asia/Ho_Chi_Minh"
         
         # --- CẤU HÌNH MỤC TIÊU (TARGETS) ---
         self.TARGET_USERS_5MIN = 50
@@ -77,22 +251,39 @@ class AppConfig:
         # Thêm mục tiêu cho Checkout
         self.TARGET_CHECKOUTS_30MIN = 15
         
+        # Độ dài bucket (giây) của realtime_history: mỗi bucket chỉ có một snapshot
+        self.SNAPSHOT_BUCKET_SECONDS = 60
+        # Chuỗi lịch sử cho trend chart được giữ trong bộ nhớ tối đa bằng cửa sổ lớn nhất (giờ)
+        # và chỉ hỏi Supabase phần đuôi mới sau mỗi HISTORY_REFRESH_SECONDS
+        self.HISTORY_MAX_WINDOW_HOURS = 24
+        self.HISTORY_REFRESH_SECONDS = 30
+        # Các tầng lưu trữ của realtime_history: (tên tầng, độ dài bucket giây, thời gian lưu).
+        # Thời gian lưu được truyền vào compact_realtime_history nên đây là nguồn cấu hình duy nhất.
+        self.HISTORY_TIERS = [("raw", 60, "26 hours"), ("5m", 300, "14 days"), ("1h", 3600, "180 days")]
+        # Trend chart dùng tầng thô nhất mà vẫn có ít nhất chừng này điểm cho mỗi marketer
+        self.HISTORY_MIN_CHART_POINTS = 144
+        # Chu kỳ (giây) poller gọi compaction: gộp bucket mới lên các tầng và xoá dữ liệu hết hạn
+        self.HISTORY_COMPACTION_INTERVAL_SECONDS = 60
+        self.HISTORY_COMPACTION_BATCH_SIZE = 5000
+        # Số điểm tối đa mỗi marketer gửi xuống trend chart (downsampling min/max theo bucket thời gian)
+        self.TREND_CHART_MAX_POINTS_PER_SERIES = 400
+        # Hàng đợi ghi Supabase chạy nền (write-behind): gom các thao tác ghi trong WRITE_QUEUE_LINGER_SECONDS
+        # thành request hàng loạt, thử lại với backoff tối đa WRITE_QUEUE_MAX_ATTEMPTS lần rồi mới bỏ
+        self.WRITE_QUEUE_BATCH_SIZE = 500
+        self.WRITE_QUEUE_LINGER_SECONDS = 1.0
+        self.WRITE_QUEUE_MAX_ATTEMPTS = 5
+        self.WRITE_QUEUE_MAX_BACKOFF_SECONDS = 30
+        self.WRITE_QUEUE_MAX_DEPTH = 10000
+        self.WRITE_QUEUE_SHUTDOWN_TIMEOUT_SECONDS = 10
+
         self.COLOR_COLD = (40, 40, 60)
         self.COLOR_HOT = (255, 190, 0)
         self.TIMEZONE_MAPPINGS = { "Viet Nam (UTC+7)": "Asia/Ho_Chi_Minh", "New York (UTC-4)": "America/New_York", "Chicago (UTC-5)": "America/Chicago", "Denver (UTC-6)": "America/Denver", "Los Angeles (UTC-7)": "America/Los_Angeles", "Anchorage (UTC-8)": "America/Anchorage", "Honolulu (UTC-10)": "Pacific/Honolulu" }
-        self.page_title_map = {}
-        self.landing_page_map = {}
-        self.SYMBOLS = []
-        self.product_to_symbol_map = {}
-        try:
-            with open("marketer_mapping.json", "r", encoding="utf-8") as f:
-                full_mapping = json.load(f)
-            self.page_title_map = full_mapping.get("page_title_mapping", {})
-            self.landing_page_map = full_mapping.get("landing_page_mapping", {})
-            self.product_to_symbol_map = full_mapping.get("product_to_symbol_mapping", {})
-            self.SYMBOLS = sorted(list(self.page_title_map.keys()), key=len, reverse=True)
-        except Exception:
-            pass
+        self.MARKETER_MAPPING_PATH = "marketer_mapping.json"
+        self.mapping_mtime = None
+        self.mappings = None
+        self._mapping_lock = threading.Lock()
+        self._load_marketer_mapping()
         self.default_avatar_url = "https://raw.githubusercontent.com/mediaecomx/dashboard-project/refs/heads/main/profile.jpg"
         
         self.ga_credentials = None
@@ -108,15 +299,90 @@ class AppConfig:
             self.ga_credentials = None
         
         self.shopify_stores_config = self.secrets.get("shopify_stores", [])
+        # Kho SQLite cục bộ chứa dòng sản phẩm Shopify cho báo cáo lịch sử
+        self.ORDER_STORE_PATH = os.path.join(".cache", "shopify_orders.sqlite")
         self.cloudinary_cloud_name = self.secrets.get("cloudinary", {}).get("cloud_name")
         self.cloudinary_upload_preset = self.secrets.get("cloudinary", {}).get("upload_preset")
         self.users_details = self.secrets.get("users", {})
         self.auth_config = self.prepare_auth_config()
-        self.supabase = None
+        self.supabase_resource = None
         self.supabase_url = None
         self.supabase_anon_key = None
         self.refresh_supabase_from_secrets()
 
+    def _load_marketer_mapping(self):
+        page_title_map = {}
+        landing_page_map = {}
+        product_to_symbol_map = {}
+        try:
+            self.mapping_mtime = os.path.getmtime(self.MARKETER_MAPPING_PATH)
+            with open(self.MARKETER_MAPPING_PATH, "r", encoding="utf-8") as f:
+                full_mapping = json.load(f)
+            page_title_map = full_mapping.get("page_title_mapping", {})
+            landing_page_map = full_mapping.get("landing_page_mapping", {})
+            product_to_symbol_map = full_mapping.get("product_to_symbol_mapping", {})
+        except Exception:
+            pass
+        symbols = sorted(list(page_title_map.keys()), key=len, reverse=True)
+        self.mappings = MappingState(
+            version=self.mapping_version + 1,
+            page_title_map=page_title_map,
+            landing_page_map=landing_page_map,
+            product_to_symbol_map=product_to_symbol_map,
+            symbols=symbols,
+            symbol_matcher=SymbolMatcher(symbols, page_title_map),
+            product_symbol_index=ProductSymbolIndex(product_to_symbol_map)
+        )
+
+    def reload_mappings_if_changed(self) -> bool:
+        """
+        Nạp lại marketer_mapping.json nếu file đã thay đổi kể từ lần nạp trước.
+        Trả về True nếu mapping được nạp lại (mapping_version tăng lên).
+        """
+        try:
+            current_mtime = os.path.getmtime(self.MARKETER_MAPPING_PATH)
+        except OSError:
+            return False
+        if current_mtime == self.mapping_mtime:
+            return False
+        with self._mapping_lock:
+            # Luồng khác có thể vừa nạp xong trong lúc chờ khoá
+            if current_mtime == self.mapping_mtime:
+                return False
+            print("--- marketer_mapping.json changed, reloading mappings ---")
+            self._load_marketer_mapping()
+        return True
+
+    # Các thuộc tính cũ đọc từ snapshot hiện tại. Code cần nhiều trường cùng lúc nên đọc
+    # `mappings` một lần thay vì gọi lần lượt từng thuộc tính.
+    @property
+    def mapping_version(self) -> int:
+        return self.mappings.version if self.mappings is not None else 0
+
+    @property
+    def page_title_map(self) -> dict:
+        return self.mappings.page_title_map
+
+    @property
+    def landing_page_map(self) -> dict:
+        return self.mappings.landing_page_map
+
+    @property
+    def product_to_symbol_map(self) -> dict:
+        return self.mappings.product_to_symbol_map
+
+    @property
+    def SYMBOLS(self) -> list:
+        return self.mappings.symbols
+
+    @property
+    def symbol_matcher(self) -> SymbolMatcher:
+        return self.mappings.symbol_matcher
+
+    @property
+    def product_symbol_index(self) -> ProductSymbolIndex:
+        return self.mappings.product_symbol_index
+
     def prepare_auth_config(self):
         users_from_secrets = self.secrets.get("users", {})
         credentials = {"usernames": {}}
@@ -0,0 +1,131 @@
+# FILE: ga_cache.py
+
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+import streamlit as st
+from config import get_config
+from cache import register_cache_tag, CACHE_TAG_HISTORICAL
+
+class GADailyReportCache:
+    """
+    Cache báo cáo lịch sử GA theo từng property và từng ngày (SQLite trên đĩa).
+    GA còn xử lý dữ liệu của một ngày trong 24-48 giờ sau khi ngày đó kết thúc, nên một partition
+    chỉ được coi là chốt khi nó được lấy sau thời điểm kết thúc ngày + `finalize_lag_seconds`;
+    trước đó (kể cả ngày hôm qua) partition chỉ dùng được trong `open_day_ttl_seconds`.
+    Múi giờ của property (GA trả về trong metadata của report) cũng được lưu ở đây để tính ranh giới ngày.
+    """
+    def __init__(self, db_path: str, open_day_ttl_seconds: int, finalize_lag_seconds: int):
+        self.db_path = db_path
+        self.open_day_ttl_seconds = open_day_ttl_seconds
+        self.finalize_lag_seconds = finalize_lag_seconds
+        self._lock = threading.Lock()
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS ga_daily_pages (
+                property_id TEXT NOT NULL,
+                date TEXT NOT NULL,
+                page_title TEXT NOT NULL,
+                sessions INTEGER NOT NULL,
+                users INTEGER NOT NULL,
+                PRIMARY KEY (property_id, date, page_title)
+            );
+            CREATE TABLE IF NOT EXISTS ga_daily_partitions (
+                property_id TEXT NOT NULL,
+                date TEXT NOT NULL,
+                fetched_at TEXT NOT NULL,
+                PRIMARY KEY (property_id, date)
+            );
+            CREATE TABLE IF NOT EXISTS ga_property_meta (
+                property_id TEXT PRIMARY KEY,
+                time_zone TEXT NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    def stale_dates(self, property_id: str, dates: list, day_end_times: dict, now: datetime) -> list:
+        """
+        Trả về các ngày (YYYY-MM-DD) cần lấy lại từ GA.
+        `day_end_times` map mỗi ngày sang thời điểm kết thúc ngày đó (UTC) theo múi giờ của property.
+        """
+        if not dates:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT date, fetched_at FROM ga_daily_partitions WHERE property_id = ? AND date IN ({','.join('?' * len(dates))})",
+                (property_id, *dates)
+            ).fetchall()
+        fetched_at_by_date = {date: datetime.fromisoformat(fetched_at) for date, fetched_at in rows}
+        stale = []
+        for date in dates:
+            fetched_at = fetched_at_by_date.get(date)
+            if fetched_at is None:
+                stale.append(date)
+            elif fetched_at < day_end_times[date] + timedelta(seconds=self.finalize_lag_seconds) and (now - fetched_at).total_seconds() >= self.open_day_ttl_seconds:
+                stale.append(date)
+        return stale
+
+    def get_time_zone(self, property_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT time_zone FROM ga_property_meta WHERE property_id = ?", (property_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_time_zone(self, property_id: str, time_zone: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO ga_property_meta (property_id, time_zone) VALUES (?, ?)", (property_id, time_zone))
+            self._conn.commit()
+
+    def replace_partitions(self, property_id: str, dates: list, rows_df: pd.DataFrame, fetched_at: datetime):
+        """Ghi đè toàn bộ các partition trong `dates` bằng dữ liệu vừa lấy (kể cả ngày không có dòng nào)."""
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM ga_daily_pages WHERE property_id = ? AND date = ?",
+                [(property_id, date) for date in dates]
+            )
+            if not rows_df.empty:
+                self._conn.executemany(
+                    "INSERT INTO ga_daily_pages (property_id, date, page_title, sessions, users) VALUES (?, ?, ?, ?, ?)",
+                    [(property_id, row.Date, row.Title, int(row.Sessions), int(row.Users))
+                     for row in rows_df.rename(columns={"Page Title": "Title"}).itertuples(index=False)]
+                )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO ga_daily_partitions (property_id, date, fetched_at) VALUES (?, ?, ?)",
+                [(property_id, date, fetched_at.astimezone(timezone.utc).isoformat()) for date in dates]
+            )
+            self._conn.commit()
+
+    def invalidate(self, property_id: str = None):
+        """Xoá partition của một property (hoặc tất cả) để lần đọc sau lấy lại từ GA."""
+        with self._lock:
+            if property_id is None:
+                self._conn.execute("DELETE FROM ga_daily_pages")
+                self._conn.execute("DELETE FROM ga_daily_partitions")
+            else:
+                self._conn.execute("DELETE FROM ga_daily_pages WHERE property_id = ?", (property_id,))
+                self._conn.execute("DELETE FROM ga_daily_partitions WHERE property_id = ?", (property_id,))
+            self._conn.commit()
+
+    def load(self, property_id: str, start_date: str, end_date: str) -> pd.DataFrame:
+        with self._lock:
+            return pd.read_sql_query(
+                'SELECT page_title AS "Page Title", date AS "Date", sessions AS "Sessions", users AS "Users" '
+                "FROM ga_daily_pages WHERE property_id = ? AND date >= ? AND date <= ?",
+                self._conn,
+                params=(property_id, start_date, end_date)
+            )
+
+@st.cache_resource
+def get_ga_daily_cache():
+    """
+    Trả về cache báo cáo GA theo ngày dùng chung cho toàn bộ process.
+    """
+    config = get_config()
+    daily_cache = GADailyReportCache(config.GA_HISTORY_CACHE_PATH, config.GA_HISTORY_OPEN_DAY_TTL_SECONDS, config.GA_HISTORY_FINALIZE_LAG_SECONDS)
+    register_cache_tag(CACHE_TAG_HISTORICAL, "ga_cache.daily_partitions", daily_cache.invalidate)
+    return daily_cache
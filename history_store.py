@@ -0,0 +1,164 @@
+# FILE: history_store.py
+
+import threading
+import time
+import streamlit as st
+import pandas as pd
+from datetime import datetime, timedelta, timezone
+from config import get_config
+from cache import register_cache_tag, CACHE_TAG_HISTORY
+from timeseries import MarketerSeriesStore
+from write_queue import get_write_queue
+
+HISTORY_COLUMNS = ['timestamp', 'Marketer', 'Active Users']
+
+def _fetch_history_columns(config, since: datetime, tier: str = "raw") -> pd.DataFrame:
+    """
+    Gọi RPC get_realtime_history_columns: trả về các điểm của tầng `tier` có bucket > since
+    dưới dạng mảng theo cột (bucket, marketer, active_users), parse một lần bằng vector.
+    """
+    response = config.supabase.rpc("get_realtime_history_columns", {"since": since.isoformat(), "tier": tier}).execute()
+    columns = response.data[0] if response.data else {}
+    buckets = columns.get("buckets") or []
+    if not buckets:
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(buckets, utc=True),
+        'Marketer': columns.get("marketers") or [],
+        'Active Users': columns.get("active_users") or []
+    })
+
+class HistorySeriesCache:
+    """
+    Chuỗi lịch sử active users theo marketer của một tầng, dùng chung cho cả process.
+    Lần đầu nạp đủ `max_window_hours`; các lần sau chỉ lấy lại từ bucket cuối cùng
+    đã có (bucket này có thể vẫn đang được compaction cộng dồn) rồi nối vào.
+    """
+    def __init__(self, tier: str, max_window_hours: int, min_refresh_seconds: int):
+        self.tier = tier
+        self.max_window_hours = max_window_hours
+        self.min_refresh_seconds = min_refresh_seconds
+        self._series = pd.DataFrame(columns=HISTORY_COLUMNS)
+        self._last_bucket = None
+        self._last_fetch_monotonic = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        config = get_config()
+        now = datetime.now(timezone.utc)
+        window_start = now - timedelta(hours=self.max_window_hours)
+        since = self._last_bucket - timedelta(microseconds=1) if self._last_bucket is not None else window_start
+        tail_df = _fetch_history_columns(config, since, self.tier)
+        self._last_fetch_monotonic = time.monotonic()
+        if not tail_df.empty:
+            if self._last_bucket is not None:
+                self._series = self._series[self._series['timestamp'] < self._last_bucket]
+            self._series = pd.concat([self._series, tail_df], ignore_index=True) if not self._series.empty else tail_df
+            self._last_bucket = tail_df['timestamp'].max().to_pydatetime()
+        self._series = self._series[self._series['timestamp'] >= window_start].reset_index(drop=True)
+
+    def reset(self):
+        """Bỏ chuỗi đang giữ; lần đọc sau nạp lại đủ cửa sổ."""
+        with self._lock:
+            self._series = pd.DataFrame(columns=HISTORY_COLUMNS)
+            self._last_bucket = None
+            self._last_fetch_monotonic = None
+
+    def get_window(self, time_window_hours: int) -> pd.DataFrame:
+        with self._lock:
+            due = self._last_fetch_monotonic is None or time.monotonic() - self._last_fetch_monotonic >= self.min_refresh_seconds
+            if due:
+                try:
+                    self._refresh()
+                except Exception as e:
+                    get_config().record_supabase_result(e)
+                    print(f"Error loading history from Supabase: {e}")
+            cutoff = datetime.now(timezone.utc) - timedelta(hours=time_window_hours)
+            # Trả bản sao vì trend chart sẽ đổi múi giờ tại chỗ
+            return self._series[self._series['timestamp'] >= cutoff].copy()
+
+@st.cache_resource
+def get_history_series_cache(tier: str = "raw"):
+    config = get_config()
+    series_cache = HistorySeriesCache(tier, config.HISTORY_MAX_WINDOW_HOURS, config.HISTORY_REFRESH_SECONDS)
+    register_cache_tag(CACHE_TAG_HISTORY, f"history_store.series.{tier}", lambda scope: series_cache.reset())
+    return series_cache
+
+def select_history_tier(config, time_window_hours) -> str:
+    """
+    Chọn tầng thô nhất còn giữ đủ cửa sổ và vẫn cho ít nhất HISTORY_MIN_CHART_POINTS
+    điểm mỗi marketer; nếu không tầng nào đạt thì dùng tầng chi tiết nhất.
+    """
+    window_seconds = time_window_hours * 3600
+    selected = config.HISTORY_TIERS[0][0]
+    for tier, bucket_seconds, retention in config.HISTORY_TIERS:
+        retention_seconds = pd.Timedelta(retention).total_seconds()
+        if retention_seconds >= window_seconds and window_seconds / bucket_seconds >= config.HISTORY_MIN_CHART_POINTS:
+            selected = tier
+    return selected
+
+@st.cache_resource
+def get_marketer_series_store():
+    """
+    Ring buffer active users theo marketer cho cả process. RealtimePoller ghi vào sau mỗi
+    snapshot và nạp sẵn từ realtime_history khi khởi động; trend chart đọc thẳng từ đây.
+    """
+    config = get_config()
+    return MarketerSeriesStore(config.HISTORY_MAX_WINDOW_HOURS, config.SNAPSHOT_BUCKET_SECONDS)
+
+def warm_start_marketer_series(store: MarketerSeriesStore) -> bool:
+    """Nạp tầng thô của realtime_history (đủ cửa sổ lớn nhất) vào ring buffer; False nếu Supabase lỗi."""
+    config = get_config()
+    if not config.supabase:
+        return False
+    try:
+        since = datetime.now(timezone.utc) - timedelta(hours=config.HISTORY_MAX_WINDOW_HOURS)
+        store.warm_start(_fetch_history_columns(config, since, "raw"))
+        return True
+    except Exception as e:
+        config.record_supabase_result(e)
+        print(f"Error warm-starting history series from Supabase: {e}")
+        return False
+
+def load_history_from_supabase(time_window_hours):
+    """
+    Chuỗi lịch sử cho trend chart. Khi ring buffer đã được nạp, cửa sổ được cắt từ bộ nhớ
+    mà không cần gọi mạng; ngược lại đọc từ tầng phù hợp trên Supabase.
+    """
+    series_store = get_marketer_series_store()
+    if series_store.warm and time_window_hours <= get_config().HISTORY_MAX_WINDOW_HOURS:
+        history_df = series_store.get_window(time_window_hours)
+        return history_df if not history_df.empty else pd.DataFrame()
+    tier = select_history_tier(get_config(), time_window_hours)
+    history_df = get_history_series_cache(tier).get_window(time_window_hours)
+    return history_df if not history_df.empty else pd.DataFrame()
+
+def snapshot_bucket(timestamp: datetime, bucket_seconds: int) -> datetime:
+    """Làm tròn xuống theo bucket (mặc định 1 phút) để mọi writer cùng bucket ghi vào một khoá."""
+    epoch_seconds = int(timestamp.timestamp())
+    return datetime.fromtimestamp(epoch_seconds - epoch_seconds % bucket_seconds, tz=timezone.utc)
+
+def save_snapshot_to_supabase(snapshot_data, timestamp):
+    """
+    Xếp snapshot cho bucket chứa `timestamp` vào hàng đợi ghi, mỗi marketer một dòng trong
+    realtime_history_points. Upsert bỏ qua trùng lặp theo (bucket, marketer) nên dù
+    có nhiều process cùng ghi, mỗi bucket chỉ có đúng một giá trị cho mỗi marketer.
+    """
+    config = get_config()
+    bucket = snapshot_bucket(timestamp, config.SNAPSHOT_BUCKET_SECONDS).isoformat()
+    rows = [{"bucket": bucket, "marketer": marketer, "active_users": int(users)} for marketer, users in snapshot_data.items()]
+    get_write_queue().upsert("realtime_history_points", rows, on_conflict="bucket,marketer", ignore_duplicates=True)
+
+def compact_history_supabase():
+    """
+    Xếp lời gọi compact_realtime_history vào hàng đợi ghi: gộp các bucket gần đây lên tầng
+    5 phút / 1 giờ và xoá dữ liệu hết hạn theo từng lô. Được RealtimePoller gọi định kỳ.
+    """
+    config = get_config()
+    retentions = {tier: retention for tier, _, retention in config.HISTORY_TIERS}
+    return get_write_queue().rpc("compact_realtime_history", {
+        "raw_retention": retentions["raw"],
+        "five_minute_retention": retentions["5m"],
+        "hourly_retention": retentions["1h"],
+        "batch_size": config.HISTORY_COMPACTION_BATCH_SIZE
+    })
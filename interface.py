@@ -4,73 +4,87 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-import time
 import pytz
 import requests
 from datetime import datetime, timedelta, timezone
 from config import get_config
+from history_store import load_history_from_supabase, get_marketer_series_store
+from timeseries import downsample_minmax
+from resources import get_resource_status
+from orchestrator import get_render_orchestrator
+from sales_subscriber import get_sales_event_subscriber
+from write_queue import get_write_queue
+from quota_governor import get_quota_governor
+from cache import register_cache_tag, invalidate_cache_tags, CACHE_TAG_SETTINGS, CACHE_TAG_SHOPIFY, CACHE_TAG_REALTIME_GA
 from streamlit.components.v1 import html
 import json
-import random
 
-@st.cache_data(ttl=60)
-def load_history_from_supabase(time_window_hours):
-    try:
-        config = get_config()
-        start_time = datetime.now(timezone.utc) - timedelta(hours=time_window_hours)
-        
-        response = config.supabase.table("realtime_history").select("timestamp, snapshot_data") \
-            .gte("timestamp", start_time.isoformat()) \
-            .order("timestamp", desc=False) \
-            .limit(5000) \
-            .execute()
-
-        if not response.data:
-            return pd.DataFrame()
-
-        records = []
-        for row in response.data:
-            ts = pd.to_datetime(row['timestamp'])
-            snapshot = row['snapshot_data']
-            if snapshot:
-                for marketer, users in snapshot.items():
-                    records.append({
-                        'timestamp': ts,
-                        'Marketer': marketer,
-                        'Active Users': users
-                    })
-        
-        return pd.DataFrame(records)
-
-    except Exception as e:
-        print(f"Error loading history from Supabase: {e}")
-        return pd.DataFrame()
-
-def save_snapshot_to_supabase(snapshot_data, timestamp):
-    try:
-        config = get_config()
-        config.supabase.table("realtime_history").insert({
-            "timestamp": timestamp.isoformat(),
-            "snapshot_data": snapshot_data
-        }).execute()
-    except Exception as e:
-        print(f"Error saving snapshot to Supabase: {e}")
-
-def cleanup_old_history_supabase():
-    try:
-        config = get_config()
-        cutoff_time = datetime.now(timezone.utc) - timedelta(hours=25)
-        config.supabase.table("realtime_history").delete().lt("created_at", cutoff_time.isoformat()).execute()
-        print("Successfully cleaned up old history records.")
-    except Exception as e:
-        print(f"Error during history cleanup: {e}")
+# Cột cờ tính sẵn thay cho highlight từng ô của Styler
+HIGHLIGHT_FLAG_COLUMN = "Has Sales"
+TABLE_TOP_N_OPTIONS = ["All", 50, 100, 500, 1000]
+TABLE_PAGE_SIZE = 100
+
+def compute_highlight_flags(df: pd.DataFrame, highlight_columns) -> pd.Series:
+    """True cho các dòng có ít nhất một cột số > 0 hoặc cột chữ không rỗng trong highlight_columns."""
+    flags = pd.Series(False, index=df.index)
+    for column in highlight_columns:
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if pd.api.types.is_numeric_dtype(values):
+            flags |= values.fillna(0) > 0
+        else:
+            flags |= values.fillna("").astype(str) != ""
+    return flags
 
-def highlight_metrics(val):
-    if isinstance(val, (int, float)) and val > 0:
-        return 'background-color: #023020; color: #23d123; font-weight: bold;'
-    if isinstance(val, str) and val != "":
-        return 'background-color: #023020; color: #23d123; font-weight: bold;'
-    return ''
+def render_fast_table(df: pd.DataFrame, key: str, column_config: dict = None, highlight_columns=(), page_size: int = TABLE_PAGE_SIZE):
+    """
+    Hiển thị bảng bằng st.dataframe với cột giữ nguyên kiểu dữ liệu và định dạng qua column_config,
+    thay cho Styler (render từng ô thành HTML trong Python). Top-N và phân trang cắt dữ liệu
+    ở server nên mỗi lần chỉ gửi một trang xuống trình duyệt.
+    """
+    column_config = dict(column_config or {})
+    if highlight_columns:
+        flags = compute_highlight_flags(df, highlight_columns)
+        df = df.assign(**{HIGHLIGHT_FLAG_COLUMN: flags})[[HIGHLIGHT_FLAG_COLUMN, *df.columns]]
+        column_config[HIGHLIGHT_FLAG_COLUMN] = st.column_config.CheckboxColumn("🛒", width="small")
+
+    total_rows = len(df)
+    if total_rows > page_size:
+        top_n_col, page_col, info_col = st.columns([1, 1, 2])
+        with top_n_col:
+            top_n = st.selectbox("Top rows", TABLE_TOP_N_OPTIONS, key=f"{key}_top_n")
+        if top_n != "All":
+            df = df.head(top_n)
+        shown_rows = len(df)
+        page_count = max(1, -(-shown_rows // page_size))
+        page_key = f"{key}_page"
+        # Trang hiện tại chỉ nằm trong session_state (không truyền value=) để clamp ở đây
+        # không xung đột với giá trị mặc định của widget
+        st.session_state[page_key] = min(st.session_state.get(page_key, 1), page_count)
+        with page_col:
+            page = st.number_input("Page", min_value=1, max_value=page_count, step=1, key=page_key)
+        start = (page - 1) * page_size
+        df = df.iloc[start:start + page_size]
+        with info_col:
+            st.caption(f"Rows {start + 1}–{start + len(df)} of {shown_rows} (total {total_rows})")
+
+    st.dataframe(df, use_container_width=True, column_config=column_config)
+
+def render_source_badges(source_status: dict, stale_after_seconds: float):
+    """Một dòng nhãn cho từng nguồn dữ liệu: 🟢 mới, 🟠 đang dùng giá trị cũ (kèm tuổi), ⚪ chưa có dữ liệu."""
+    badges = []
+    for name, status in source_status.items():
+        if status is None:
+            continue
+        if status.age_seconds is None:
+            badges.append(f"⚪ {name}: loading")
+        elif status.error is None and (status.fresh or status.age_seconds <= stale_after_seconds):
+            badges.append(f"🟢 {name}")
+        else:
+            badges.append(f"🟠 {name}: {int(status.age_seconds)}s old{' (last refresh failed)' if status.error is not None else ''}")
+    if badges:
+        st.caption(" · ".join(badges))
 
 def get_heatmap_color_and_text(value, target, cold_color, hot_color):
     if target == 0:
@@ -106,8 +120,10 @@ def render_progress_bar(value, total):
         </style>""", unsafe_allow_html=True)
     st.progress(percentage / 100)
     
+APP_SETTINGS_MATCH = {"id": 1}
+
 @st.cache_data(ttl=60)
-def get_app_settings():
+def _load_app_settings():
     try:
         config = get_config()
         response = config.supabase.table("app_settings").select("*").eq("id", 1).single().execute()
@@ -128,6 +144,13 @@ def get_app_settings():
         "selected_ga_properties": ["PropeLify"]
     }
 
+def get_app_settings():
+    """
+    Settings toàn cục, cộng thêm các thay đổi còn nằm trong hàng đợi ghi
+    để admin vừa lưu thấy ngay giá trị mới ở lần rerun kế tiếp.
+    """
+    return {**_load_app_settings(), **get_write_queue().pending_update("app_settings", APP_SETTINGS_MATCH)}
+
 
 @st.cache_data(ttl=300) # Cache trong 5 phút
 def load_purchase_events_from_supabase(time_window_hours):
@@ -160,6 +183,31 @@ def load_purchase_events_from_supabase(time_window_hours):
 
 
 
+def _render_settings_write_status():
+    """
+    Trạng thái ghi app_settings qua hàng đợi nền, hiển thị ở lần rerun sau khi lưu:
+    báo đã xếp hàng, đang ghi, hoặc lỗi (update thất bại vẫn được giữ và thử lại).
+    """
+    saved_notice = st.session_state.pop("app_settings_saved_notice", None)
+    write_queue = get_write_queue()
+    failure = write_queue.update_failure("app_settings", APP_SETTINGS_MATCH)
+    if failure:
+        st.error(
+            f"Saving settings failed after {failure['failed_attempts']} attempts and is being retried; "
+            f"the values shown are not saved yet. Last error: {failure['error']}"
+        )
+    elif write_queue.pending_update("app_settings", APP_SETTINGS_MATCH):
+        st.info(f"{saved_notice or 'Settings'} — saving in the background...")
+    elif saved_notice:
+        st.success(saved_notice)
+
+def _queue_settings_update(values: dict, saved_notice: str, on_success) -> bool:
+    """Xếp update app_settings vào hàng đợi ghi; lần rerun sau _render_settings_write_status báo kết quả."""
+    if not get_write_queue().update("app_settings", values, APP_SETTINGS_MATCH, on_success=on_success):
+        return False
+    st.session_state["app_settings_saved_notice"] = saved_notice
+    return True
+
 def admin_settings_ui(current_settings):
     st.divider()
     st.subheader("⚙️ App Settings")
@@ -244,17 +292,20 @@ def admin_settings_ui(current_settings):
                 "toast_duration_ms": confetti_duration * 1000,
                 "updated_at": datetime.now().isoformat()
             }
-            try:
-                config = get_config()
-                config.supabase.table("app_settings").update(new_settings).eq("id", 1).execute()
-                st.success("Global settings updated successfully!")
-                st.cache_data.clear()
-                time.sleep(1)
+            # Ghi qua hàng đợi nền; khi ghi xong thì đọc lại settings (chỉ settings thay đổi,
+            # dữ liệu GA/Shopify/lịch sử không phụ thuộc vào các tuỳ chọn này)
+            if _queue_settings_update(new_settings, "Global settings updated.",
+                                      on_success=lambda: invalidate_cache_tags(CACHE_TAG_SETTINGS)):
                 st.rerun()
-            except Exception as e:
-                st.error(f"Failed to save settings: {e}")
+            else:
+                st.error("Failed to save settings: write queue is unavailable.")
 
 def render_realtime_sales_listener(settings):
+    """
+    Gắn listener thông báo bán hàng vào trang cha một lần cho mỗi tab trình duyệt.
+    Các lần rerun sau chỉ gửi settings mới cho listener đang chạy (updateSettings),
+    nên supabase-js, canvas-confetti và websocket Realtime không bị tạo lại.
+    """
     config = get_config()
     supabase_url = config.supabase_url
     supabase_anon_key = config.supabase_anon_key
@@ -267,69 +318,70 @@ def render_realtime_sales_listener(settings):
     
     settings_json = json.dumps(settings)
 
-    listener_html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-    <meta charset="utf-8" />
-    <style>
-      #toast-container {{
-        position: fixed;
-        bottom: 24px;
-        right: 24px;
-        z-index: 1000000;
-        display: flex;
-        flex-direction: column-reverse;
-        gap: 12px;
-        align-items: flex-end;
-      }}
-      .sale-toast {{
-        background-image: linear-gradient(145deg, #00b084, #028a68);
-        color: #fff;
-        padding: 20px 28px;
-        border-radius: 12px;
-        box-shadow: 0 12px 35px rgba(0,0,0,0.3);
-        font: 18px/1.4 system-ui, -apple-system, Segoe UI, Roboto, sans-serif;
-        pointer-events: auto;
-        border: 1px solid rgba(255, 255, 255, 0.2);
-        animation: slideInUp 300ms ease-out forwards;
-      }}
-      @keyframes slideInUp {{ from {{ transform: translateY(100%); opacity: 0; }} to {{ transform: translateY(0); opacity: 1; }} }}
-      @keyframes fadeOut {{ from {{ opacity: 1; }} to {{ opacity: 0; visibility: hidden; }} }}
-      .sale-toast strong {{ font-weight: 700; font-size: 20px; }}
-      .sale-toast span {{ display: block; font-size: 15px; opacity: 0.85; margin-top: 5px; }}
-    </style>
-    </head>
-    <body>
-    <script>
-      try {{
-        const frame = window.frameElement;
-        if (frame) {{
-          frame.style.position = "fixed"; frame.style.inset = "0";
-          frame.style.width = "100vw"; frame.style.height = "100vh";
-          frame.style.border = "none"; frame.style.pointerEvents = "none";
-          frame.style.zIndex = "100000";
-        }}
-      }} catch (e) {{}}
-    </script>
-    <script src="https://cdn.jsdelivr.net/npm/@supabase/supabase-js@2"></script>
-    <script src="https://cdn.jsdelivr.net/npm/canvas-confetti@1.9.2/dist/confetti.browser.min.js"></script>
-    <script>
-      const APP_SETTINGS = {settings_json};
+    # Mã listener chạy trong chính trang cha (thẻ <script> chèn vào window.parent.document), nên mọi
+    # closure, timer và websocket thuộc về trang cha, không giữ tham chiếu tới iframe của component
+    listener_js = f"""
+    (function() {{
+      if (window.__salesListener) return;
       const SUPABASE_URL = {supabase_url_json};
       const SUPABASE_ANON = {supabase_anon_key_json};
 
-      let toastContainer = document.getElementById('toast-container');
-      if (!toastContainer) {{
-        toastContainer = document.createElement('div');
-        toastContainer.id = 'toast-container';
-        document.body.appendChild(toastContainer);
+      const listener = {{
+        settings: {{}},
+        // Settings được truyền dạng chuỗi JSON để không giữ object nào của iframe
+        updateSettings(settingsJson) {{ this.settings = JSON.parse(settingsJson); }}
+      }};
+      window.__salesListener = listener;
+
+      const style = document.createElement('style');
+      style.textContent = `
+        #toast-container {{
+          position: fixed;
+          bottom: 24px;
+          right: 24px;
+          z-index: 1000000;
+          display: flex;
+          flex-direction: column-reverse;
+          gap: 12px;
+          align-items: flex-end;
+          pointer-events: none;
+        }}
+        .sale-toast {{
+          background-image: linear-gradient(145deg, #00b084, #028a68);
+          color: #fff;
+          padding: 20px 28px;
+          border-radius: 12px;
+          box-shadow: 0 12px 35px rgba(0,0,0,0.3);
+          font: 18px/1.4 system-ui, -apple-system, Segoe UI, Roboto, sans-serif;
+          pointer-events: auto;
+          border: 1px solid rgba(255, 255, 255, 0.2);
+          animation: slideInUp 300ms ease-out forwards;
+        }}
+        @keyframes slideInUp {{ from {{ transform: translateY(100%); opacity: 0; }} to {{ transform: translateY(0); opacity: 1; }} }}
+        @keyframes fadeOut {{ from {{ opacity: 1; }} to {{ opacity: 0; visibility: hidden; }} }}
+        .sale-toast strong {{ font-weight: 700; font-size: 20px; }}
+        .sale-toast span {{ display: block; font-size: 15px; opacity: 0.85; margin-top: 5px; }}
+      `;
+      document.head.appendChild(style);
+
+      const toastContainer = document.createElement('div');
+      toastContainer.id = 'toast-container';
+      document.body.appendChild(toastContainer);
+
+      function loadScript(src) {{
+        return new Promise((resolve, reject) => {{
+          const script = document.createElement('script');
+          script.src = src;
+          script.onload = resolve;
+          script.onerror = reject;
+          document.head.appendChild(script);
+        }});
       }}
 
       function playSound(url) {{
         if (url) {{
           try {{
-            const audio = new Audio(url);
+            const audio = new window.Audio(url);
             audio.play().catch(e => console.warn("Audio play was prevented by browser policy.", e));
           }} catch (e) {{
             console.error("Error creating or playing audio:", e);
@@ -338,18 +390,20 @@ def render_realtime_sales_listener(settings):
       }}
 
       function shootConfetti(durationMs, effectName) {{
-        if (!APP_SETTINGS.enable_confetti) return;
+        const settings = listener.settings;
+        if (!settings.enable_confetti || !window.confetti) return;
         
-        playSound(APP_SETTINGS.confetti_sound_url);
+        playSound(settings.confetti_sound_url);
 
+        const confetti = window.confetti;
         const animationEnd = Date.now() + durationMs;
         const defaults = {{ startVelocity: 30, spread: 360, ticks: 60, zIndex: 1000001 }};
         
         function randomInRange(min, max) {{ return Math.random() * (max - min) + min; }}
         
-        const interval = setInterval(function() {{
+        const interval = window.setInterval(function() {{
             const timeLeft = animationEnd - Date.now();
-            if (timeLeft <= 0) {{ return clearInterval(interval); }}
+            if (timeLeft <= 0) {{ return window.clearInterval(interval); }}
             const particleCount = 50 * (timeLeft / durationMs);
 
             switch(effectName) {{
@@ -363,9 +417,10 @@ def render_realtime_sales_listener(settings):
       }}
 
       function showToastAndConfetti(row) {{
-        if (!APP_SETTINGS.enable_notifications) return;
+        const settings = listener.settings;
+        if (!settings.enable_notifications) return;
         
-        playSound(APP_SETTINGS.toast_sound_url);
+        playSound(settings.toast_sound_url);
         
         const div = document.createElement("div");
         const revenue = Number(row.revenue || 0).toFixed(2);
@@ -376,40 +431,114 @@ def render_realtime_sales_listener(settings):
         div.className = "sale-toast";
         div.innerHTML = `<strong>${{symbol}} ${{storeName}}</strong> &bull; $${{revenue}}<br/><span>${{title}}</span>`;
         
-        document.getElementById('toast-container').appendChild(div);
+        toastContainer.appendChild(div);
         
-        shootConfetti(APP_SETTINGS.confetti_duration_ms, APP_SETTINGS.confetti_effect);
+        shootConfetti(settings.confetti_duration_ms, settings.confetti_effect);
         
-        setTimeout(() => {{
+        window.setTimeout(() => {{
           div.style.animation = "fadeOut 650ms ease-in forwards";
-          setTimeout(() => div.remove(), 700);
-        }}, APP_SETTINGS.toast_duration_ms);
+          window.setTimeout(() => div.remove(), 700);
+        }}, settings.toast_duration_ms);
       }}
 
+      // Dedupe trong bộ nhớ; localStorage chỉ được đọc một lần và ghi gộp sau mỗi FLUSH_DELAY_MS
       const KEY = "notified_order_ids_v2";
-      const load = () => {{ try {{ const m = JSON.parse(localStorage.getItem(KEY) || "{{}}"); const now = Date.now(); for (const k of Object.keys(m)) if (now - m[k] > 86400000) delete m[k]; localStorage.setItem(KEY, JSON.stringify(m)); return m; }} catch {{ return {{}}; }} }};
-      const seen = id => !!load()[id];
-      const mark = id => {{ const m = load(); m[id] = Date.now(); localStorage.setItem(KEY, JSON.stringify(m)); }};
+      const SEEN_TTL_MS = 86400000;
+      const FLUSH_DELAY_MS = 5000;
+      const seenIds = new Map();
+      try {{
+        const stored = JSON.parse(window.localStorage.getItem(KEY) || "{{}}");
+        const now = Date.now();
+        for (const [id, ts] of Object.entries(stored)) if (now - ts <= SEEN_TTL_MS) seenIds.set(id, ts);
+      }} catch (e) {{}}
 
-      if (SUPABASE_URL && SUPABASE_ANON) {{
+      let flushTimer = null;
+      function flushSeen() {{
+        flushTimer = null;
+        const now = Date.now();
+        const stored = {{}};
+        for (const [id, ts] of seenIds) {{
+          if (now - ts > SEEN_TTL_MS) seenIds.delete(id);
+          else stored[id] = ts;
+        }}
+        try {{ window.localStorage.setItem(KEY, JSON.stringify(stored)); }} catch (e) {{}}
+      }}
+      function markSeen(id) {{
+        seenIds.set(id, Date.now());
+        if (!flushTimer) flushTimer = window.setTimeout(flushSeen, FLUSH_DELAY_MS);
+      }}
+      window.addEventListener("pagehide", flushSeen);
+
+      Promise.all([
+        loadScript("https://cdn.jsdelivr.net/npm/@supabase/supabase-js@2"),
+        loadScript("https://cdn.jsdelivr.net/npm/canvas-confetti@1.9.2/dist/confetti.browser.min.js")
+      ]).then(() => {{
         const client = window.supabase.createClient(SUPABASE_URL, SUPABASE_ANON, {{ realtime: {{ params: {{ eventsPerSecond: 5 }} }} }});
         
         client.channel("realtime_sales_notifications")
           .on("postgres_changes", {{ event: "INSERT", schema: "public", table: "sales_events" }}, (payload) => {{
             const row = payload?.new || {{}};
             const id = String(row.order_id || "");
-            if (!id || seen(id)) return;
+            if (!id || seenIds.has(id)) return;
+            markSeen(id);
             showToastAndConfetti(row);
-            mark(id);
           }})
           .subscribe();
+      }}).catch(e => console.error("Could not load sales listener scripts:", e));
+    }})();
+    """
+
+    # Chuỗi JS nằm trong thẻ <script> của iframe nên "</" phải được escape
+    listener_js_literal = json.dumps(listener_js).replace("</", "<\\/")
+    settings_json_literal = json.dumps(settings_json).replace("</", "<\\/")
+
+    listener_html = f"""
+    <!DOCTYPE html>
+    <html>
+    <head><meta charset="utf-8" /></head>
+    <body>
+    <script>
+    (function() {{
+      // Iframe này chỉ chèn listener vào trang cha (một lần mỗi tab) và gửi settings mới sau mỗi rerun
+      let host = window;
+      try {{ if (window.parent && window.parent.document) host = window.parent; }} catch (e) {{}}
+      if (!host.__salesListener) {{
+        const script = host.document.createElement('script');
+        script.textContent = {listener_js_literal};
+        host.document.head.appendChild(script);
       }}
+      host.__salesListener.updateSettings({settings_json_literal});
+    }})();
     </script>
     </body>
     </html>
     """
     html(listener_html, height=0)
 
+register_cache_tag(CACHE_TAG_SETTINGS, "interface.app_settings", lambda scope: _load_app_settings.clear())
+register_cache_tag(CACHE_TAG_SHOPIFY, "interface.purchase_events", lambda scope: load_purchase_events_from_supabase.clear())
+
+def _add_purchase_markers(fig_trend, merged_events: pd.DataFrame):
+    """
+    Marker mua hàng trên trend chart: mỗi marketer một trace text duy nhất, màu lấy từ map
+    tính sẵn theo các đường đã vẽ (benchmarks/trend_chart_markers.py đo theo số đơn).
+    """
+    marketer_colors = {trace.name: trace.line.color for trace in fig_trend.data}
+    merged_events = merged_events[merged_events['Marketer'].isin(marketer_colors)].assign(
+        marker_text=lambda df: "<b>" + df['product_symbol'].astype(str) + df['Marketer'].astype(str) + "</b>"
+    )
+    for marketer, events in merged_events.groupby('Marketer', sort=False):
+        fig_trend.add_trace(go.Scatter(
+            x=events['created_at_local'],
+            y=events['Active Users'],
+            mode='text',
+            text=events['marker_text'],
+            textposition='top center',
+            textfont=dict(size=12, color=marketer_colors[marketer]),
+            hoverinfo='none',
+            showlegend=False
+        ))
+
 class DashboardUI:
     def __init__(self, auth, data_processor, config):
         self.auth = auth
@@ -441,6 +570,7 @@ class DashboardUI:
             if user_info['role'] == 'admin':
                 st.divider()
                 st.subheader("Admin Controls")
+                _render_settings_write_status()
                 
                 options = list(self.config.AVAILABLE_PROPERTIES.keys())
                 
@@ -452,16 +582,27 @@ class DashboardUI:
                 )
 
                 if sorted(selected_names_by_admin) != sorted(globally_selected_properties):
-                    try:
-                        self.config.supabase.table("app_settings").update({
-                            "selected_ga_properties": selected_names_by_admin
-                        }).eq("id", 1).execute()
-                        st.success("Global GA properties updated!")
-                        st.cache_data.clear()
-                        time.sleep(1)
+                    # Dữ liệu đã cache của các property không đổi vẫn đúng; chỉ đọc lại settings, làm hết hạn
+                    # realtime của các property vừa thêm/bớt (giá trị cũ có thể từ lúc chúng còn được chọn)
+                    # và báo poller lấy ngay. Poller đọc cả thay đổi đang chờ ghi nên được đánh thức ngay,
+                    # và thêm một lần khi ghi xong.
+                    poller = self.processor.poller
+                    changed_property_ids = [
+                        self.config.AVAILABLE_PROPERTIES[name]
+                        for name in set(selected_names_by_admin) ^ set(globally_selected_properties)
+                        if name in self.config.AVAILABLE_PROPERTIES
+                    ]
+                    def on_properties_saved():
+                        invalidate_cache_tags(CACHE_TAG_SETTINGS)
+                        for property_id in changed_property_ids:
+                            invalidate_cache_tags(CACHE_TAG_REALTIME_GA, scope=property_id)
+                        poller.request_refresh()
+                    if _queue_settings_update({"selected_ga_properties": selected_names_by_admin},
+                                              "Global GA properties updated.", on_success=on_properties_saved):
+                        poller.request_refresh()
                         st.rerun()
-                    except Exception as e:
-                        st.error(f"Failed to save setting: {e}")
+                    else:
+                        st.error("Failed to save setting: write queue is unavailable.")
             
             if globally_selected_properties:
                 st.info(f"Viewing data for: **{', '.join(globally_selected_properties)}**")
@@ -491,8 +632,6 @@ class DashboardUI:
         st.title("🚀 Realtime Dashboard")
         
         render_realtime_sales_listener(app_settings)
-        
-        current_property_ids = [self.config.AVAILABLE_PROPERTIES[name] for name in selected_property_names if name in self.config.AVAILABLE_PROPERTIES]
 
         with st.sidebar:
             st.divider()
@@ -500,89 +639,97 @@ class DashboardUI:
             selected_tz_name = st.selectbox("Select Timezone", options=list(self.config.TIMEZONE_MAPPINGS.keys()), key="timezone_selector")
 
         refresh_interval = app_settings.get('refresh_interval', 75)
-        
         selected_tz = pytz.timezone(self.config.TIMEZONE_MAPPINGS[selected_tz_name])
-        timer_placeholder, placeholder = st.empty(), st.empty()
 
-        with placeholder.container():
-            data = self.processor.get_processed_realtime_data(current_property_ids, selected_tz)
-            localized_fetch_time = data['fetch_time'].astimezone(selected_tz)
-            st.markdown(f"*Last update: {localized_fetch_time.strftime('%Y-%m-%d %H:%M:%S')}*")
-            
-            # --- BẮT ĐẦU THAY ĐỔI: 4 CỘT THAY VÌ 3 ---
-            top_col1, top_col2, top_col3, top_col4 = st.columns(4)
-            
-            with top_col1:
-                target_5min = self.config.TARGET_USERS_5MIN * len(current_property_ids) if current_property_ids else self.config.TARGET_USERS_5MIN
-                bg_color, text_color = get_heatmap_color_and_text(data['active_users_5min'], target_5min, self.config.COLOR_COLD, self.config.COLOR_HOT)
-                st.markdown(f"""<div style="background-color: {bg_color}; border-radius: 7px; padding: 20px; text-align: center; height: 100%;"><p style="font-size: 16px; color: {text_color}; margin-bottom: 5px;">ACTIVE USERS (5 MIN)</p><p style="font-size: 32px; font-weight: bold; color: {text_color}; margin: 0;">{data['active_users_5min']}</p></div>""", unsafe_allow_html=True)
-            
-            with top_col2:
-                target_30min = self.config.TARGET_USERS_30MIN * len(current_property_ids) if current_property_ids else self.config.TARGET_USERS_30MIN
-                bg_color, text_color = get_heatmap_color_and_text(data['active_users_30min'], target_30min, self.config.COLOR_COLD, self.config.COLOR_HOT)
-                st.markdown(f"""<div style="background-color: {bg_color}; border-radius: 7px; padding: 20px; text-align: center; height: 100%;"><p style="font-size: 16px; color: {text_color}; margin-bottom: 5px;">ACTIVE USERS (30 MIN)</p><p style="font-size: 32px; font-weight: bold; color: {text_color}; margin: 0;">{data['active_users_30min']}</p></div>""", unsafe_allow_html=True)
-            
-            with top_col3:
-                target_views = self.config.TARGET_VIEWS_30MIN * len(current_property_ids) if current_property_ids else self.config.TARGET_VIEWS_30MIN
-                bg_color, text_color = get_heatmap_color_and_text(data['total_views'], target_views, self.config.COLOR_COLD, self.config.COLOR_HOT)
-                st.markdown(f"""<div style="background-color: {bg_color}; border-radius: 7px; padding: 20px; text-align: center; height: 100%;"><p style="font-size: 16px; color: {text_color}; margin-bottom: 5px;">VIEWS (30 MIN)</p><p style="font-size: 32px; font-weight: bold; color: {text_color}; margin: 0;">{data['total_views']}</p></div>""", unsafe_allow_html=True)
-            
-            with top_col4:
-                # Thẻ mới: CHECKOUTS
-                target_checkouts = self.config.TARGET_CHECKOUTS_30MIN * len(current_property_ids) if current_property_ids else self.config.TARGET_CHECKOUTS_30MIN
-                bg_color, text_color = get_heatmap_color_and_text(data['total_checkouts'], target_checkouts, self.config.COLOR_COLD, self.config.COLOR_HOT)
-                st.markdown(f"""<div style="background-color: {bg_color}; border-radius: 7px; padding: 20px; text-align: center; height: 100%;"><p style="font-size: 16px; color: {text_color}; margin-bottom: 5px;">CHECKOUT (30 MIN)</p><p style="font-size: 32px; font-weight: bold; color: {text_color}; margin: 0;">{data['total_checkouts']}</p></div>""", unsafe_allow_html=True)
-            
-            # --- KẾT THÚC THAY ĐỔI ---
+        # Chỉ vùng dữ liệu được rerun theo chu kỳ; sidebar, admin settings và listener giữ nguyên
+        @st.fragment(run_every=refresh_interval)
+        def realtime_data_area():
+            self._render_realtime_data_area(effective_user_info, debug_mode, selected_tz, refresh_interval)
 
-            st.divider()
-            bottom_col1, bottom_col2 = st.columns(2)
-            with bottom_col1:
-                st.markdown(f"""<div style="background-color: #025402; border: 2px solid #057805; border-radius: 7px; padding: 20px; text-align: center; height: 100%;"><p style="font-size: 16px; color: #b0b0b0; margin-bottom: 5px;">PURCHASES (30 MIN)</p><p style="font-size: 32px; font-weight: bold; color: #23d123; margin: 0;">{data['purchase_count_30min']}</p></div>""", unsafe_allow_html=True)
-            with bottom_col2:
-                cr = (data['purchase_count_30min'] / data['active_users_30min'] * 100) if data['active_users_30min'] > 0 else 0
-                st.markdown(f"""<div style="background-color: #013254; border: 2px solid #0564a8; border-radius: 7px; padding: 20px; text-align: center; height: 100%;"><p style="font-size: 16px; color: #b0b0b0; margin-bottom: 5px;">CONVERSION RATE (30 MIN)</p><p style="font-size: 32px; font-weight: bold; color: #23a7d1; margin: 0;">{cr:.2f}%</p></div>""", unsafe_allow_html=True)
-            
-            self._render_realtime_trend_chart(data, localized_fetch_time, data['purchase_events'], app_settings)
-            
-            self._render_per_minute_chart(data['per_min_df'])
-            st.divider()
-            st.subheader("Page and screen in last 30 minutes")
-            self._render_realtime_dataframe(data['final_pages_df'], effective_user_info, selected_tz)
-
-            if st.session_state['user_info']['role'] == 'admin' and not (effective_user_info['role'] == 'employee'):
-                self._render_quota_monitoring(data['quota_details'])
-            if debug_mode:
-                self._render_realtime_debug_section(data['debug_data'], data['quota_details'])
-
-        seconds_left = refresh_interval
-        while seconds_left > 0:
-            timer_placeholder.markdown(f'<p style="color:green;"><b>Next refresh in: {int(seconds_left)} seconds...</b></p>', unsafe_allow_html=True)
-            sleep_duration = min(seconds_left, 5)
-            time.sleep(sleep_duration)
-            seconds_left -= sleep_duration
-        
-        timer_placeholder.markdown(f'<p style="color:blue;"><b>Refreshing now...</b></p>', unsafe_allow_html=True)
-        st.rerun()
+        realtime_data_area()
 
-    def _render_realtime_trend_chart(self, data, localized_fetch_time, purchase_events, app_settings):
-        if not data['final_pages_df'].empty:
-            marketer_summary = data['final_pages_df'].groupby('Marketer')['Active Users'].sum()
-            current_snapshot = marketer_summary.to_dict()
+    def _render_realtime_data_area(self, effective_user_info, debug_mode, selected_tz, refresh_interval):
+        # Đọc lại app_settings (cache 60s) để các lần rerun fragment thấy thay đổi của admin
+        app_settings = get_app_settings()
+        selected_property_names = app_settings.get('selected_ga_properties') or [self.config.DEFAULT_PROPERTY_NAME]
+        current_property_ids = [self.config.AVAILABLE_PROPERTIES[name] for name in selected_property_names if name in self.config.AVAILABLE_PROPERTIES]
+
+        # Các nguồn đọc trên đường render chạy song song dưới một deadline chung;
+        # nguồn chưa xong dùng giá trị tốt gần nhất và được gắn nhãn stale
+        time_window_hours = app_settings.get('time_window_hours', 3)
+        history_key, purchases_key = ("history", time_window_hours), ("purchase_events", time_window_hours)
+        # Marker đơn hàng đọc từ cửa sổ của subscriber sales_events (không tốn request);
+        # chỉ hỏi Supabase khi subscriber bị tắt hoặc chưa sẵn sàng
+        sales_subscriber = get_sales_event_subscriber()
+        if sales_subscriber is not None and sales_subscriber.ready:
+            load_purchase_events = lambda: sales_subscriber.purchase_events(time_window_hours)
         else:
-            current_snapshot = {}
+            load_purchase_events = lambda: load_purchase_events_from_supabase(time_window_hours)
+        render_sources = get_render_orchestrator().run({
+            history_key: lambda: load_history_from_supabase(time_window_hours),
+            purchases_key: load_purchase_events
+        })
+
+        data = self.processor.get_processed_realtime_data(current_property_ids, selected_tz)
+        localized_fetch_time = data['fetch_time'].astimezone(selected_tz)
+        st.markdown(f"*Last update: {localized_fetch_time.strftime('%Y-%m-%d %H:%M:%S')}* · <span style=\"color:green;\">Auto-refresh every {refresh_interval} seconds</span>", unsafe_allow_html=True)
+        render_source_badges({
+            **data.get('source_status', {}),
+            "Trend history": render_sources[history_key],
+            "Sales events": render_sources[purchases_key]
+        }, stale_after_seconds=2 * refresh_interval)
+        
+        # --- BẮT ĐẦU THAY ĐỔI: 4 CỘT THAY VÌ 3 ---
+        top_col1, top_col2, top_col3, top_col4 = st.columns(4)
+        
+        with top_col1:
+            target_5min = self.config.TARGET_USERS_5MIN * len(current_property_ids) if current_property_ids else self.config.TARGET_USERS_5MIN
+            bg_color, text_color = get_heatmap_color_and_text(data['active_users_5min'], target_5min, self.config.COLOR_COLD, self.config.COLOR_HOT)
+            st.markdown(f"""<div style="background-color: {bg_color}; border-radius: 7px; padding: 20px; text-align: center; height: 100%;"><p style="font-size: 16px; color: {text_color}; margin-bottom: 5px;">ACTIVE USERS (5 MIN)</p><p style="font-size: 32px; font-weight: bold; color: {text_color}; margin: 0;">{data['active_users_5min']}</p></div>""", unsafe_allow_html=True)
+        
+        with top_col2:
+            target_30min = self.config.TARGET_USERS_30MIN * len(current_property_ids) if current_property_ids else self.config.TARGET_USERS_30MIN
+            bg_color, text_color = get_heatmap_color_and_text(data['active_users_30min'], target_30min, self.config.COLOR_COLD, self.config.COLOR_HOT)
+            st.markdown(f"""<div style="background-color: {bg_color}; border-radius: 7px; padding: 20px; text-align: center; height: 100%;"><p style="font-size: 16px; color: {text_color}; margin-bottom: 5px;">ACTIVE USERS (30 MIN)</p><p style="font-size: 32px; font-weight: bold; color: {text_color}; margin: 0;">{data['active_users_30min']}</p></div>""", unsafe_allow_html=True)
+        
+        with top_col3:
+            target_views = self.config.TARGET_VIEWS_30MIN * len(current_property_ids) if current_property_ids else self.config.TARGET_VIEWS_30MIN
+            bg_color, text_color = get_heatmap_color_and_text(data['total_views'], target_views, self.config.COLOR_COLD, self.config.COLOR_HOT)
+            st.markdown(f"""<div style="background-color: {bg_color}; border-radius: 7px; padding: 20px; text-align: center; height: 100%;"><p style="font-size: 16px; color: {text_color}; margin-bottom: 5px;">VIEWS (30 MIN)</p><p style="font-size: 32px; font-weight: bold; color: {text_color}; margin: 0;">{data['total_views']}</p></div>""", unsafe_allow_html=True)
+        
+        with top_col4:
+            # Thẻ mới: CHECKOUTS
+            target_checkouts = self.config.TARGET_CHECKOUTS_30MIN * len(current_property_ids) if current_property_ids else self.config.TARGET_CHECKOUTS_30MIN
+            bg_color, text_color = get_heatmap_color_and_text(data['total_checkouts'], target_checkouts, self.config.COLOR_COLD, self.config.COLOR_HOT)
+            st.markdown(f"""<div style="background-color: {bg_color}; border-radius: 7px; padding: 20px; text-align: center; height: 100%;"><p style="font-size: 16px; color: {text_color}; margin-bottom: 5px;">CHECKOUT (30 MIN)</p><p style="font-size: 32px; font-weight: bold; color: {text_color}; margin: 0;">{data['total_checkouts']}</p></div>""", unsafe_allow_html=True)
+        
+        # --- KẾT THÚC THAY ĐỔI ---
 
-        if current_snapshot:
-            save_snapshot_to_supabase(current_snapshot, localized_fetch_time)
+        st.divider()
+        bottom_col1, bottom_col2 = st.columns(2)
+        with bottom_col1:
+            st.markdown(f"""<div style="background-color: #025402; border: 2px solid #057805; border-radius: 7px; padding: 20px; text-align: center; height: 100%;"><p style="font-size: 16px; color: #b0b0b0; margin-bottom: 5px;">PURCHASES (30 MIN)</p><p style="font-size: 32px; font-weight: bold; color: #23d123; margin: 0;">{data['purchase_count_30min']}</p></div>""", unsafe_allow_html=True)
+        with bottom_col2:
+            cr = (data['purchase_count_30min'] / data['active_users_30min'] * 100) if data['active_users_30min'] > 0 else 0
+            st.markdown(f"""<div style="background-color: #013254; border: 2px solid #0564a8; border-radius: 7px; padding: 20px; text-align: center; height: 100%;"><p style="font-size: 16px; color: #b0b0b0; margin-bottom: 5px;">CONVERSION RATE (30 MIN)</p><p style="font-size: 32px; font-weight: bold; color: #23a7d1; margin: 0;">{cr:.2f}%</p></div>""", unsafe_allow_html=True)
+        
+        self._render_realtime_trend_chart(localized_fetch_time, render_sources[history_key].value, render_sources[purchases_key].value, time_window_hours)
+        
+        self._render_per_minute_chart(data['per_min_df'])
+        st.divider()
+        st.subheader("Page and screen in last 30 minutes")
+        self._render_realtime_dataframe(data['final_pages_df'], effective_user_info, selected_tz)
 
-        if random.random() < 0.1:
-            cleanup_old_history_supabase()
+        if st.session_state['user_info']['role'] == 'admin' and not (effective_user_info['role'] == 'employee'):
+            self._render_quota_monitoring(data['quota_details'], current_property_ids)
+        if debug_mode:
+            self._render_realtime_debug_section(data['debug_data'], data['quota_details'])
 
-        time_window_hours = app_settings.get('time_window_hours', 3)
-        history_df_melted = load_history_from_supabase(time_window_hours)
-        
-        # Gọi hàm mới để lấy lịch sử đơn hàng bền vững từ Supabase
-        historical_purchases_df = load_purchase_events_from_supabase(time_window_hours)
+    def _render_realtime_trend_chart(self, localized_fetch_time, history_df, purchases_df, time_window_hours):
+        # Snapshot được RealtimePoller ghi và compaction, client chỉ đọc tầng phù hợp với cửa sổ.
+        # Hai DataFrame đến từ orchestrator dùng chung giữa các session nên phải copy trước khi sửa.
+        history_df_melted = history_df.copy() if history_df is not None else pd.DataFrame()
+        historical_purchases_df = purchases_df.copy() if purchases_df is not None else pd.DataFrame()
 
         st.divider()
         st.subheader(f"Active Users Trend by Marketer (Last {time_window_hours} hours)")
@@ -590,7 +737,9 @@ class DashboardUI:
         if not history_df_melted.empty:
             history_df_melted['timestamp'] = history_df_melted['timestamp'].dt.tz_convert(localized_fetch_time.tzinfo)
 
-            fig_trend = px.line(history_df_melted, x='timestamp', y='Active Users', color='Marketer', template='plotly_dark', color_discrete_sequence=px.colors.qualitative.Plotly)
+            # Chỉ vẽ bản đã giảm điểm; marker mua hàng vẫn dò vị trí Y trên chuỗi đầy đủ
+            trend_plot_df = downsample_minmax(history_df_melted, 'timestamp', 'Active Users', 'Marketer', self.config.TREND_CHART_MAX_POINTS_PER_SERIES)
+            fig_trend = px.line(trend_plot_df, x='timestamp', y='Active Users', color='Marketer', template='plotly_dark', color_discrete_sequence=px.colors.qualitative.Plotly)
             fig_trend.update_traces(line=dict(width=3))
             fig_trend.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', yaxis=dict(gridcolor='rgba(255,255,255,0.1)'), legend_title_text='', legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1), hovermode="x unified")
             
@@ -600,8 +749,10 @@ class DashboardUI:
                 # Chuyển đổi múi giờ cho created_at để khớp với biểu đồ
                 historical_purchases_df['created_at_local'] = pd.to_datetime(historical_purchases_df['created_at']).dt.tz_convert(localized_fetch_time.tzinfo)
                 
-                # Lấy tên Marketer từ Product Title, giống như logic trong processor.py
-                historical_purchases_df['Marketer'] = historical_purchases_df['product_title'].apply(self.processor.get_marketer_from_page_title)
+                # Lấy Marketer và biểu tượng sản phẩm từ Product Title qua cùng bộ attribution với processor.py
+                purchase_attribution = self.processor.classifier.classify_series(historical_purchases_df['product_title'])
+                historical_purchases_df['Marketer'] = purchase_attribution['marketer']
+                historical_purchases_df['product_symbol'] = purchase_attribution['product_symbol']
 
                 # Hợp nhất với dữ liệu trend để tìm vị trí Y (Active Users) tại thời điểm mua hàng
                 merged_events = pd.merge_asof(
@@ -613,22 +764,7 @@ class DashboardUI:
                     direction='nearest'
                 )
                 
-                for _, event in merged_events.iterrows():
-                    try:
-                        marker_color = fig_trend.data[[trace.name for trace in fig_trend.data].index(event['Marketer'])].line.color
-                        fig_trend.add_trace(go.Scatter(
-                            x=[event['created_at_local']],
-                            y=[event['Active Users']],
-                            mode='text',
-                            # Sử dụng product_symbol từ dữ liệu Supabase
-                            text=[f"<b>{event['product_symbol']}{event['Marketer']}</b>"],
-                            textposition='top center',
-                            textfont=dict(size=12, color=marker_color),
-                            hoverinfo='none',
-                            showlegend=False
-                        ))
-                    except (ValueError, IndexError):
-                        pass
+                _add_purchase_markers(fig_trend, merged_events)
             st.plotly_chart(fig_trend, use_container_width=True)
         else:
             st.write("Collecting data for trend chart... Please wait for the next refresh.")
@@ -647,21 +783,21 @@ class DashboardUI:
             marketer_id = effective_user_info['marketer_id']
             pages_to_display = pages_df_full[pages_df_full['Marketer'] == marketer_id]
         if not pages_to_display.empty:
-            styler = pages_to_display.style.format({
-                'User CR': "{:.2f}%",
-                'View CR': "{:.2f}%",
-                'Revenue': "${:,.2f}"
-            })
-            styler.apply(lambda x: x.map(highlight_metrics) if x.name in ['Purchases', 'Revenue', 'User CR', 'View CR', 'Last Purchase'] else [''] * len(x), axis=0)
-            st.dataframe(
-                styler,
-                use_container_width=True,
-                column_config={"Page Title and Screen Class": st.column_config.TextColumn("Page Title", width="large")}
+            render_fast_table(
+                pages_to_display,
+                key="realtime_pages_table",
+                column_config={
+                    "Page Title and Screen Class": st.column_config.TextColumn("Page Title", width="large"),
+                    "User CR": st.column_config.NumberColumn(format="%.2f%%"),
+                    "View CR": st.column_config.NumberColumn(format="%.2f%%"),
+                    "Revenue": st.column_config.NumberColumn(format="$%.2f")
+                },
+                highlight_columns=['Purchases', 'Revenue', 'User CR', 'View CR', 'Last Purchase']
             )
         else:
             st.write("No data available for your user.")
     
-    def _render_quota_monitoring(self, quota_details):
+    def _render_quota_monitoring(self, quota_details, property_ids):
         st.divider()
         st.subheader("📊 API Quota Monitoring")
         tokens_day_consumed = quota_details.get("tokens_per_day", {}).get("consumed", 0)
@@ -677,6 +813,8 @@ class DashboardUI:
             st.metric("Daily Tokens", f"{tokens_day_consumed} / {self.config.DAILY_TOKEN_QUOTA}")
             st.caption(f"Total used today. Resets daily at 14:00 (VN Time). Remaining: {tokens_day_remaining}")
             render_progress_bar(tokens_day_consumed, self.config.DAILY_TOKEN_QUOTA)
+        st.caption("Quota governor (per property): realtime poll interval and remaining headroom shared by all sessions and replicas.")
+        st.dataframe(get_quota_governor().status(property_ids), hide_index=True)
 
     def _render_realtime_debug_section(self, debug_data, quota_details):
         st.divider()
@@ -693,6 +831,17 @@ class DashboardUI:
             st.dataframe(debug_data['merged'])
         with st.expander("4. API Quota Details (from this request)"):
             st.json(quota_details)
+        with st.expander("5. Shopify Transport (per-store latency & pages)"):
+            st.dataframe(debug_data.get('shopify_transport_stats', pd.DataFrame()))
+        with st.expander("6. Shared Clients (GA, Supabase)"):
+            st.dataframe(get_resource_status())
+            sales_subscriber = get_sales_event_subscriber()
+            st.write("**Sales events subscriber:**")
+            st.json(sales_subscriber.status() if sales_subscriber is not None else {"Enabled": False})
+            st.write("**Marketer history ring buffer:**")
+            st.json(get_marketer_series_store().status())
+            st.write("**Supabase write queue:**")
+            st.json(get_write_queue().status())
 
     def render_historical_report(self, effective_user_info, debug_mode, selected_property_names):
         st.title("📊 Page Performance Report")
@@ -744,13 +893,15 @@ class DashboardUI:
                             total_row = pd.DataFrame([{"Page Title": "Total", "Marketer": "", "Sessions": total_sessions, "Users": total_users, "Purchases": total_purchases, "Revenue": total_revenue, "Session CR": total_session_cr, "User CR": total_user_cr}])
                             data_to_display = pd.concat([total_row, data_to_display], ignore_index=True)
 
-                        st.dataframe(
-                            data_to_display.style.format({
-                                'Revenue': "${:,.2f}",
-                                'Session CR': "{:.2f}%",
-                                'User CR': "{:.2f}%"
-                            }).apply(lambda x: x.map(highlight_metrics) if x.name in ['Purchases', 'Revenue', 'Session CR', 'User CR'] else [''] * len(x), axis=0),
-                            use_container_width=True
+                        render_fast_table(
+                            data_to_display,
+                            key=f"historical_table_{segment_option}",
+                            column_config={
+                                "Revenue": st.column_config.NumberColumn(format="$%.2f"),
+                                "Session CR": st.column_config.NumberColumn(format="%.2f%%"),
+                                "User CR": st.column_config.NumberColumn(format="%.2f%%")
+                            },
+                            highlight_columns=['Purchases', 'Revenue', 'Session CR', 'User CR']
                         )
                     else: st.write("No data found for your user/filters in the selected date range.")
                     
@@ -765,6 +916,8 @@ class DashboardUI:
                             st.dataframe(debug_data['merged']);
                         with st.expander("4. Final Data (Grouped, with Marketer, Sorted)"):
                             st.dataframe(debug_data['final']);
+                        with st.expander("5. Shopify Transport (per-store latency & pages)"):
+                            st.dataframe(debug_data['shopify_transport_stats']);
                 else: st.write("No page data found with sessions in the selected date range.")
     
     def _get_date_range_from_selection(self, selection: str):
@@ -3,8 +3,9 @@
 import streamlit as st
 import streamlit_authenticator as stauth
 from config import get_config
-from services import GoogleAnalyticsService, ShopifyService
+from services import get_ga_service, get_shopify_service
 from processor import DataProcessor
+from poller import get_realtime_poller
 from interface import DashboardUI
 
 def fetch_and_set_avatar(username: str, config):
@@ -54,9 +55,8 @@ def main():
             "avatar_url": st.session_state.get('avatar_url')
         }
         
-        ga_service = GoogleAnalyticsService(config)
-        shopify_service = ShopifyService(config)
-        data_processor = DataProcessor(ga_service, shopify_service, config)
+        # Service và client được giữ suốt vòng đời process; mỗi rerun chỉ lấy lại tham chiếu
+        data_processor = DataProcessor(get_ga_service(), get_shopify_service(), config, get_realtime_poller())
         ui = DashboardUI(authenticator, data_processor, config)
 
         # --- BẮT ĐẦU THAY ĐỔI ---
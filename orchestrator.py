@@ -0,0 +1,78 @@
+# FILE: orchestrator.py
+
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+import streamlit as st
+from config import get_config
+
+# Trạng thái một nguồn sau một chu kỳ: value là giá trị tốt gần nhất (None nếu chưa có),
+# fresh=True khi giá trị vừa được lấy xong trong chu kỳ này, error là lỗi gần nhất (nếu có).
+SourceResult = namedtuple("SourceResult", ["value", "age_seconds", "fresh", "pending", "error"])
+
+class RefreshOrchestrator:
+    """
+    Chạy đồng thời các nguồn dữ liệu của một lần refresh dưới một deadline chung.
+    Nguồn nào xong trước deadline được dùng ngay; nguồn chậm hoặc lỗi được thay bằng giá trị
+    tốt gần nhất kèm tuổi để UI gắn nhãn "stale". Kết quả về muộn vẫn được lưu lại và dùng ở
+    chu kỳ sau; trong lúc đó nguồn đang chạy không bị gửi lại lần nữa.
+    """
+    def __init__(self, name: str, deadline_seconds: float, max_workers: int = 8):
+        self.name = name
+        self.deadline_seconds = deadline_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"refresh-{name}")
+        # RLock: add_done_callback chạy callback ngay trong thread hiện tại nếu future đã xong
+        self._lock = threading.RLock()
+        self._last_good = {}
+        self._errors = {}
+        self._in_flight = {}
+
+    def _on_done(self, key, future):
+        with self._lock:
+            # Mỗi future chỉ được ghi nhận một lần (callback hoặc run(), cái nào tới trước)
+            if self._in_flight.get(key) is not future:
+                return
+            del self._in_flight[key]
+            try:
+                self._last_good[key] = (future.result(), time.monotonic())
+                self._errors.pop(key, None)
+            except Exception as e:
+                print(f"[{self.name}] Source {key!r} failed, keeping last known good value. Error: {e}")
+                self._errors[key] = e
+
+    def latest(self, key, fresh: bool = False) -> SourceResult:
+        with self._lock:
+            value, fetched_monotonic = self._last_good.get(key, (None, None))
+            age = time.monotonic() - fetched_monotonic if fetched_monotonic is not None else None
+            return SourceResult(value, age, fresh, key in self._in_flight, self._errors.get(key))
+
+    def run(self, tasks: dict, deadline_seconds: float = None) -> dict:
+        """
+        `tasks` là {key: hàm không tham số}. Trả về {key: SourceResult} sau tối đa `deadline_seconds`.
+        """
+        deadline = self.deadline_seconds if deadline_seconds is None else deadline_seconds
+        futures = {}
+        with self._lock:
+            for key, task in tasks.items():
+                future = self._in_flight.get(key)
+                if future is None:
+                    future = self._executor.submit(task)
+                    self._in_flight[key] = future
+                    future.add_done_callback(lambda f, key=key: self._on_done(key, f))
+                futures[key] = future
+        wait(futures.values(), timeout=deadline)
+        results = {}
+        for key, future in futures.items():
+            # Callback có thể chưa kịp chạy dù future đã xong
+            if future.done():
+                self._on_done(key, future)
+            results[key] = self.latest(key, fresh=future.done() and not future.cancelled() and future.exception() is None)
+        return results
+
+@st.cache_resource
+def get_render_orchestrator():
+    """
+    Orchestrator dùng chung cho các nguồn đọc trên đường render của dashboard realtime.
+    """
+    return RefreshOrchestrator("render", get_config().REFRESH_DEADLINE_SECONDS)
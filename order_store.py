@@ -0,0 +1,101 @@
+# FILE: order_store.py
+
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+import pandas as pd
+import streamlit as st
+from config import get_config
+
+def _to_utc_iso(value: datetime) -> str:
+    # Định dạng cố định để so sánh chuỗi trong SQLite đúng theo thứ tự thời gian
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+
+class ShopifyOrderStore:
+    """
+    Kho đơn hàng Shopify cục bộ (SQLite) chứa các dòng sản phẩm đã chuẩn hoá.
+    Báo cáo lịch sử được tổng hợp tại chỗ; chỉ phần chưa đồng bộ mới phải tải từ Shopify.
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS line_items (
+                store_id TEXT NOT NULL,
+                order_id INTEGER NOT NULL,
+                line_index INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                quantity INTEGER NOT NULL,
+                revenue REAL NOT NULL,
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (store_id, order_id, line_index)
+            );
+            CREATE INDEX IF NOT EXISTS idx_line_items_created_at ON line_items (created_at);
+            CREATE TABLE IF NOT EXISTS sync_state (
+                store_id TEXT PRIMARY KEY,
+                synced_from TEXT NOT NULL,
+                updated_at_watermark TEXT NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    def get_sync_state(self, store_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT synced_from, updated_at_watermark FROM sync_state WHERE store_id = ?", (store_id,)
+            ).fetchone()
+        if not row:
+            return None
+        return {"synced_from": row[0], "updated_at_watermark": row[1]}
+
+    def set_sync_state(self, store_id: str, synced_from: datetime, updated_at_watermark: datetime):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state (store_id, synced_from, updated_at_watermark) VALUES (?, ?, ?)",
+                (store_id, _to_utc_iso(synced_from), _to_utc_iso(updated_at_watermark))
+            )
+            self._conn.commit()
+
+    def upsert_orders(self, store_id: str, orders: list):
+        """
+        Ghi đè các đơn hàng (kèm dòng sản phẩm đã phân bổ) vào kho.
+        `orders` là list (order_id, created_at, [(title, quantity, revenue), ...]).
+        """
+        if not orders:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM line_items WHERE store_id = ? AND order_id = ?",
+                [(store_id, order_id) for order_id, _, _ in orders]
+            )
+            self._conn.executemany(
+                "INSERT INTO line_items (store_id, order_id, line_index, title, quantity, revenue, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (store_id, order_id, line_index, title, quantity, revenue, _to_utc_iso(created_at))
+                    for order_id, created_at, line_items in orders
+                    for line_index, (title, quantity, revenue) in enumerate(line_items)
+                ]
+            )
+            self._conn.commit()
+
+    def load_line_items(self, start_time: datetime, end_time: datetime) -> pd.DataFrame:
+        """Các dòng sản phẩm có created_at trong [start_time, end_time) của mọi store."""
+        with self._lock:
+            return pd.read_sql_query(
+                "SELECT store_id, title, quantity, revenue, created_at FROM line_items WHERE created_at >= ? AND created_at < ?",
+                self._conn,
+                params=(_to_utc_iso(start_time), _to_utc_iso(end_time))
+            )
+
+@st.cache_resource
+def get_order_store():
+    """
+    Trả về kho đơn hàng dùng chung cho toàn bộ process.
+    """
+    return ShopifyOrderStore(get_config().ORDER_STORE_PATH)
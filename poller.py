@@ -0,0 +1,287 @@
+# FILE: poller.py
+
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+import pandas as pd
+import streamlit as st
+from config import get_config
+from services import GoogleAnalyticsService, ShopifyService, get_ga_service, get_shopify_service
+from attribution import TitleClassifier, get_title_classifier
+from history_store import save_snapshot_to_supabase, compact_history_supabase, get_marketer_series_store, warm_start_marketer_series
+from orchestrator import RefreshOrchestrator
+from timeseries import MarketerSeriesStore
+from write_queue import get_write_queue
+from sales_subscriber import SalesEventSubscriber, get_sales_event_subscriber
+
+# Snapshot bất biến được chia sẻ cho mọi session. Các DataFrame bên trong
+# chỉ được đọc, session nào cần sửa thì phải .copy() trước.
+RealtimeSnapshot = namedtuple("RealtimeSnapshot", [
+    "property_ids", "ga_df", "quota_details", "fetch_time",
+    "active_users_5min", "active_users_30min", "checkouts_30min",
+    "shopify_df", "status_message", "published_at", "source_status"
+])
+
+class RealtimePoller:
+    """
+    Một poller nền duy nhất cho mỗi process: lấy dữ liệu GA và Shopify
+    một lần mỗi chu kỳ cho các property được chọn toàn cục
+    (app_settings['selected_ga_properties']) rồi publish snapshot.
+    Các session chỉ đọc snapshot nên số lần gọi API không tăng theo số người xem.
+    Mỗi property GA có chu kỳ poll riêng do GAQuotaGovernor quyết định theo quota còn lại.
+    """
+
+    def __init__(self, ga_service: GoogleAnalyticsService, shopify_service: ShopifyService, config, classifier: TitleClassifier, sales_subscriber: SalesEventSubscriber = None, series_store: MarketerSeriesStore = None):
+        self.ga_service = ga_service
+        self.shopify_service = shopify_service
+        self.sales_subscriber = sales_subscriber
+        self.series_store = series_store
+        self.config = config
+        self.classifier = classifier
+        self._snapshot = None
+        self._property_ids = ()
+        self.quota_governor = ga_service.quota_governor
+        # Report realtime gần nhất và thời điểm poll gần nhất của từng property
+        self._ga_reports = {}
+        self._last_ga_fetch_monotonic = {}
+        self._last_compaction_monotonic = None
+        self.orchestrator = RefreshOrchestrator("poller", config.POLL_DEADLINE_SECONDS)
+        self._lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._first_snapshot_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="realtime-poller", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+
+    def request_refresh(self):
+        """Đánh thức poller sớm (vd: admin vừa đổi property)."""
+        self._wake_event.set()
+
+    def get_snapshot(self, wait_timeout: float = 0):
+        if self._snapshot is None and wait_timeout:
+            self._first_snapshot_event.wait(wait_timeout)
+        return self._snapshot
+
+    def _load_selected_property_ids(self):
+        names = [self.config.DEFAULT_PROPERTY_NAME]
+        try:
+            response = self.config.supabase.table("app_settings").select("selected_ga_properties").eq("id", 1).single().execute()
+            if response.data and response.data.get("selected_ga_properties"):
+                names = response.data["selected_ga_properties"]
+            self.config.record_supabase_result()
+            # Lựa chọn admin vừa lưu có thể còn nằm trong hàng đợi ghi
+            names = get_write_queue().pending_update("app_settings", {"id": 1}).get("selected_ga_properties") or names
+        except Exception as e:
+            self.config.record_supabase_result(e)
+            print(f"[poller] Could not load selected GA properties, keeping previous selection. Error: {e}")
+            if self._property_ids:
+                return self._property_ids
+        return tuple(self.config.AVAILABLE_PROPERTIES[name] for name in names if name in self.config.AVAILABLE_PROPERTIES)
+
+    def _due_property_ids(self, property_ids):
+        """Các property đã tới hạn poll theo chu kỳ governor (property mới chọn luôn tới hạn)."""
+        now = time.monotonic()
+        return tuple(
+            pid for pid in property_ids
+            if pid not in self._last_ga_fetch_monotonic
+            or now - self._last_ga_fetch_monotonic[pid] >= self.quota_governor.poll_interval(pid)
+        )
+
+    def _seconds_until_next_poll(self, property_ids):
+        if not property_ids:
+            return self.config.GA_POLL_MIN_INTERVAL_SECONDS
+        now = time.monotonic()
+        waits = [
+            self.quota_governor.poll_interval(pid) - (now - self._last_ga_fetch_monotonic.get(pid, now))
+            for pid in property_ids
+        ]
+        return max(1, min(waits))
+
+    def _fetch_ga(self, property_ids, due_ids):
+        """Chỉ gọi GA cho các property tới hạn; property khác dùng report gần nhất của nó."""
+        if due_ids:
+            # Các property tới hạn được lấy song song trong một lần gọi
+            self._ga_reports.update(self.ga_service.fetch_realtime_reports(tuple(due_ids)))
+
+        all_ga_dfs = []
+        total_active_5min = 0
+        total_active_30min = 0
+        total_checkouts_30min = 0
+        fetch_times = []
+        final_quota_details = {"tokens_per_hour": {"consumed": 0, "remaining": float('inf')}, "tokens_per_day": {"consumed": 0, "remaining": float('inf')}}
+
+        for prop_id in property_ids:
+            if prop_id not in self._ga_reports:
+                continue
+            ga_raw_df, quota_details, fetch_time, active_users_5min, active_users_30min, checkouts_30min = self._ga_reports[prop_id]
+            fetch_times.append(fetch_time)
+
+            total_active_5min += active_users_5min
+            total_active_30min += active_users_30min
+            total_checkouts_30min += checkouts_30min
+
+            if not ga_raw_df.empty:
+                prop_name = next((name for name, pid in self.config.AVAILABLE_PROPERTIES.items() if pid == prop_id), prop_id)
+                # DataFrame thuộc cache dùng chung nên không sửa tại chỗ
+                all_ga_dfs.append(ga_raw_df.assign(Property=prop_name))
+
+            # Tổng hợp chỉ để hiển thị; governor quản lý quota theo từng property
+            if quota_details:
+                final_quota_details["tokens_per_hour"]["consumed"] += quota_details.get("tokens_per_hour", {}).get("consumed", 0)
+                final_quota_details["tokens_per_day"]["consumed"] += quota_details.get("tokens_per_day", {}).get("consumed", 0)
+                rem_hr = quota_details.get("tokens_per_hour", {}).get("remaining")
+                if isinstance(rem_hr, int):
+                    final_quota_details["tokens_per_hour"]["remaining"] = min(final_quota_details["tokens_per_hour"]["remaining"], rem_hr)
+                rem_day = quota_details.get("tokens_per_day", {}).get("remaining")
+                if isinstance(rem_day, int):
+                    final_quota_details["tokens_per_day"]["remaining"] = min(final_quota_details["tokens_per_day"]["remaining"], rem_day)
+
+        ga_combined_df = pd.concat(all_ga_dfs, ignore_index=True) if all_ga_dfs else pd.DataFrame()
+        # Thời điểm của report cũ nhất, để nhãn "Last update" không đẹp hơn thực tế
+        fetch_time = min(fetch_times) if fetch_times else datetime.now(timezone.utc)
+        return ga_combined_df, final_quota_details, fetch_time, (total_active_5min, total_active_30min, total_checkouts_30min)
+
+    def _fetch_and_record_ga(self, property_ids, due_ids):
+        """GA cho một chu kỳ, kèm ghi snapshot theo marketer khi có dữ liệu mới (cả khi kết quả về sau deadline)."""
+        ga_df, quota_details, fetch_time, kpis = self._fetch_ga(property_ids, due_ids)
+        if due_ids:
+            self._save_marketer_snapshot(ga_df, fetch_time)
+        return ga_df, quota_details, fetch_time, kpis
+
+    def _save_marketer_snapshot(self, ga_df, fetch_time):
+        """
+        Tổng Active Users theo marketer cho trend chart; chỉ ghi khi có dữ liệu GA mới.
+        Ghi vào ring buffer trong bộ nhớ trước, rồi lưu xuống Supabase cho các process khác và lần khởi động sau.
+        """
+        if ga_df.empty:
+            return
+        marketers = self.classifier.classify_series(ga_df['Page Title and Screen Class'])['marketer']
+        marketer_summary = ga_df['Active Users'].groupby(marketers.values).sum()
+        snapshot_data = {marketer: int(users) for marketer, users in marketer_summary.items()}
+        if self.series_store is not None:
+            self.series_store.record(snapshot_data, fetch_time)
+        save_snapshot_to_supabase(snapshot_data, fetch_time)
+
+    def _maybe_warm_start_series(self):
+        """Nạp ring buffer từ realtime_history; lỗi thì thử lại ở chu kỳ sau, trend chart tạm đọc từ Supabase."""
+        if self.series_store is not None and not self.series_store.warm:
+            warm_start_marketer_series(self.series_store)
+
+    def _use_sales_subscriber(self) -> bool:
+        return not self.config.SHOPIFY_REALTIME_POLLING_ENABLED and self.sales_subscriber is not None and self.sales_subscriber.ready
+
+    def _fetch_purchases(self):
+        """
+        Đơn hàng 30 phút gần nhất: từ subscriber sales_events khi nó đã sẵn sàng và polling Shopify bị tắt,
+        ngược lại (subscriber chưa kết nối, đang nạp lại...) thì vẫn poll Shopify REST.
+        """
+        if self._use_sales_subscriber():
+            return self.sales_subscriber.realtime_purchases(self.shopify_service.REALTIME_WINDOW_MINUTES)
+        return self.shopify_service.fetch_realtime_purchases()
+
+    def _staleness_notes(self, property_ids):
+        """Ghi chú cho các nguồn mà lần refresh gần nhất bị lỗi và đang hiển thị dữ liệu cũ."""
+        notes = []
+        statuses = [(f"GA {pid}", self.ga_service.last_realtime_status.get(pid)) for pid in property_ids]
+        if not self._use_sales_subscriber():
+            statuses.append(("Shopify", self.shopify_service.last_realtime_status))
+        for source, status in statuses:
+            if status is None or status.error is None:
+                continue
+            if status.age_seconds is None:
+                notes.append(f"{source}: refresh failed, no data yet.")
+            else:
+                notes.append(f"{source}: refresh failed, showing data from {int(status.age_seconds)}s ago.")
+        return notes
+
+    def _maybe_compact_history(self):
+        """Compaction lịch sử chạy trên thread của poller, tối đa một lần mỗi HISTORY_COMPACTION_INTERVAL_SECONDS."""
+        now = time.monotonic()
+        if self._last_compaction_monotonic is not None and now - self._last_compaction_monotonic < self.config.HISTORY_COMPACTION_INTERVAL_SECONDS:
+            return
+        self._last_compaction_monotonic = now
+        compact_history_supabase()
+
+    def _poll_once(self):
+        previous = self._snapshot
+        property_ids = self._load_selected_property_ids()
+        self._property_ids = property_ids
+
+        status_message = ""
+        due_ids = self._due_property_ids(property_ids)
+        for pid in due_ids:
+            self._last_ga_fetch_monotonic[pid] = time.monotonic()
+
+        ga_key = ("ga", property_ids)
+        tasks = {"shopify": self._fetch_purchases}
+        if property_ids:
+            tasks[ga_key] = lambda: self._fetch_and_record_ga(property_ids, due_ids)
+        # GA và Shopify chạy song song dưới một deadline chung; nguồn về muộn được dùng ở chu kỳ sau
+        results = self.orchestrator.run(tasks)
+        ga_result = results.get(ga_key) or self.orchestrator.latest(ga_key)
+        shopify_result = results["shopify"]
+
+        if ga_result.value is not None and property_ids:
+            ga_df, quota_details, fetch_time, kpis = ga_result.value
+            # Tuổi thật của dữ liệu GA là tuổi của report cũ nhất, không phải lần tổng hợp vừa chạy
+            ga_result = ga_result._replace(age_seconds=max(ga_result.age_seconds or 0, (datetime.now(timezone.utc) - fetch_time).total_seconds()))
+        elif previous is not None and property_ids:
+            ga_df, quota_details, fetch_time = previous.ga_df, previous.quota_details, previous.fetch_time
+            kpis = (previous.active_users_5min, previous.active_users_30min, previous.checkouts_30min)
+        else:
+            ga_df, quota_details, fetch_time, kpis = pd.DataFrame(), {}, datetime.now(timezone.utc), (0, 0, 0)
+
+        intervals = {name: self.quota_governor.poll_interval(pid) for name, pid in self.config.AVAILABLE_PROPERTIES.items() if pid in property_ids}
+        throttled = [(name, interval) for name, interval in intervals.items() if interval > self.config.GA_POLL_MIN_INTERVAL_SECONDS]
+        if throttled:
+            status_message = "GA quota governor: " + ", ".join(f"{name} refreshes every {interval}s" for name, interval in throttled) + " to stay within quota."
+
+        if shopify_result.value is not None:
+            shopify_df = shopify_result.value
+        else:
+            shopify_df = previous.shopify_df if previous is not None else pd.DataFrame()
+        status_message = " ".join([status_message, *self._staleness_notes(property_ids)]).strip()
+
+        self._snapshot = RealtimeSnapshot(
+            property_ids=property_ids, ga_df=ga_df, quota_details=quota_details, fetch_time=fetch_time,
+            active_users_5min=kpis[0], active_users_30min=kpis[1], checkouts_30min=kpis[2],
+            shopify_df=shopify_df, status_message=status_message, published_at=datetime.now(timezone.utc),
+            source_status={"GA": ga_result._replace(value=None), "Shopify": shopify_result._replace(value=None)}
+        )
+        self._first_snapshot_event.set()
+        self._maybe_compact_history()
+        return self._seconds_until_next_poll(property_ids)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            interval = self.config.GA_POLL_MIN_INTERVAL_SECONDS
+            try:
+                self._maybe_warm_start_series()
+                interval = self._poll_once()
+            except Exception as e:
+                print(f"[poller] Realtime poll failed: {e}")
+            self._wake_event.wait(interval)
+            self._wake_event.clear()
+
+@st.cache_resource
+def get_realtime_poller():
+    """
+    Tạo và khởi động poller realtime dùng chung cho toàn bộ process.
+    """
+    print("--- Starting shared RealtimePoller ---")
+    config = get_config()
+    poller = RealtimePoller(get_ga_service(), get_shopify_service(), config, get_title_classifier(), get_sales_event_subscriber(), get_marketer_series_store())
+    poller.start()
+    return poller
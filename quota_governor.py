@@ -0,0 +1,230 @@
+# FILE: quota_governor.py
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+import pandas as pd
+import pytz
+import streamlit as st
+from config import get_config
+
+REALTIME = "realtime"
+HISTORICAL = "historical"
+
+def quota_details_from_responses(*responses) -> dict:
+    """
+    Gộp property_quota của các response GA (request gửi kèm return_property_quota=True):
+    `consumed` là tổng token các request vừa tiêu, `remaining` là giá trị nhỏ nhất GA báo về.
+    """
+    quota_details = {"tokens_per_hour": {"consumed": 0, "remaining": "N/A"}, "tokens_per_day": {"consumed": 0, "remaining": "N/A"}}
+    for response in responses:
+        property_quota = getattr(response, "property_quota", None)
+        if not property_quota:
+            continue
+        for key, status in (("tokens_per_hour", property_quota.tokens_per_hour), ("tokens_per_day", property_quota.tokens_per_day)):
+            if not status:
+                continue
+            quota_details[key]["consumed"] += status.consumed
+            current = quota_details[key]["remaining"]
+            quota_details[key]["remaining"] = status.remaining if current == "N/A" else min(current, status.remaining)
+    return quota_details
+
+class GAQuotaGovernor:
+    """
+    Điều phối quota GA Data API theo từng property cho cả process và mọi replica cùng máy.
+    Mỗi lời gọi GA (realtime/historical) ghi số token đã tiêu vào một sổ SQLite dùng chung;
+    số token còn lại do GA trả về (tính cho toàn property, gồm cả replica ở máy khác) được
+    lưu làm trạng thái. Từ đó governor:
+    - dự báo tốc độ tiêu token của realtime (token mỗi lần poll x số replica đang poll),
+    - chọn chu kỳ poll realtime riêng cho từng property sao cho quota giờ/ngày không cạn,
+      luôn chừa `historical_reserve_ratio` quota cho báo cáo lịch sử,
+    - chỉ cho báo cáo lịch sử chạy khi phần dư còn đủ cho ước lượng token của nó.
+    """
+    HOUR_SECONDS = 3600
+    USAGE_RETENTION_SECONDS = 2 * 86400
+
+    def __init__(self, db_path: str, hourly_quota: int, daily_quota: int, min_interval_seconds: int,
+                 max_interval_seconds: int, historical_reserve_ratio: float, realtime_tokens_estimate: int,
+                 historical_tokens_estimate: int, quota_day_timezone: str, replica_id: str = None):
+        self.db_path = db_path
+        self.hourly_quota = hourly_quota
+        self.daily_quota = daily_quota
+        self.min_interval_seconds = min_interval_seconds
+        self.max_interval_seconds = max_interval_seconds
+        self.historical_reserve_ratio = historical_reserve_ratio
+        self.realtime_tokens_estimate = realtime_tokens_estimate
+        self.historical_tokens_estimate = historical_tokens_estimate
+        self.quota_day_timezone = pytz.timezone(quota_day_timezone)
+        self.replica_id = replica_id or f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        # timeout: các replica cùng ghi một file, chờ lock thay vì lỗi "database is locked"
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS quota_usage (
+                property_id TEXT NOT NULL,
+                replica_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                observed_at REAL NOT NULL,
+                tokens_hour INTEGER NOT NULL,
+                tokens_day INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_quota_usage_property ON quota_usage (property_id, observed_at);
+            CREATE TABLE IF NOT EXISTS quota_state (
+                property_id TEXT PRIMARY KEY,
+                hour_remaining INTEGER,
+                day_remaining INTEGER,
+                observed_at REAL NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    # --- ghi nhận ---
+    def record(self, property_id: str, kind: str, quota_details: dict, observed_at: float = None):
+        """Ghi token một lần gọi GA đã tiêu và số token còn lại GA báo về (nếu có)."""
+        observed_at = time.time() if observed_at is None else observed_at
+        hour = (quota_details or {}).get("tokens_per_hour", {})
+        day = (quota_details or {}).get("tokens_per_day", {})
+        hour_remaining = hour.get("remaining") if isinstance(hour.get("remaining"), int) else None
+        day_remaining = day.get("remaining") if isinstance(day.get("remaining"), int) else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO quota_usage (property_id, replica_id, kind, observed_at, tokens_hour, tokens_day) VALUES (?, ?, ?, ?, ?, ?)",
+                (property_id, self.replica_id, kind, observed_at, int(hour.get("consumed", 0) or 0), int(day.get("consumed", 0) or 0))
+            )
+            if hour_remaining is not None or day_remaining is not None:
+                # Chỉ nhận trạng thái mới hơn trạng thái đang có (replica khác có thể vừa ghi)
+                self._conn.execute(
+                    "INSERT INTO quota_state (property_id, hour_remaining, day_remaining, observed_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (property_id) DO UPDATE SET hour_remaining = excluded.hour_remaining, "
+                    "day_remaining = excluded.day_remaining, observed_at = excluded.observed_at "
+                    "WHERE excluded.observed_at >= quota_state.observed_at",
+                    (property_id, hour_remaining, day_remaining, observed_at)
+                )
+            if observed_at - self._last_prune > self.HOUR_SECONDS:
+                self._conn.execute("DELETE FROM quota_usage WHERE observed_at < ?", (observed_at - self.USAGE_RETENTION_SECONDS,))
+                self._last_prune = observed_at
+            self._conn.commit()
+
+    # --- dự báo ---
+    def _seconds_until_day_reset(self, now: float) -> float:
+        local_now = datetime.fromtimestamp(now, self.quota_day_timezone)
+        next_midnight = self.quota_day_timezone.localize(datetime.combine(local_now.date() + timedelta(days=1), datetime.min.time()))
+        return max((next_midnight - local_now).total_seconds(), 1.0)
+
+    def forecast(self, property_id: str, now: float = None) -> dict:
+        now = time.time() if now is None else now
+        day_start = now - (86400 - self._seconds_until_day_reset(now))
+        with self._lock:
+            usage = self._conn.execute(
+                "SELECT "
+                "COALESCE(SUM(CASE WHEN observed_at >= ? THEN tokens_hour END), 0), "
+                "COALESCE(SUM(CASE WHEN observed_at >= ? THEN tokens_day END), 0), "
+                "AVG(CASE WHEN kind = ? AND observed_at >= ? THEN tokens_hour END), "
+                "COUNT(DISTINCT CASE WHEN kind = ? AND observed_at >= ? THEN replica_id END), "
+                "AVG(CASE WHEN kind = ? THEN tokens_hour END) "
+                "FROM quota_usage WHERE property_id = ?",
+                (now - self.HOUR_SECONDS, day_start, REALTIME, now - self.HOUR_SECONDS,
+                 REALTIME, now - 2 * self.max_interval_seconds, HISTORICAL, property_id)
+            ).fetchone()
+            state = self._conn.execute(
+                "SELECT hour_remaining, day_remaining, observed_at FROM quota_state WHERE property_id = ?", (property_id,)
+            ).fetchone()
+        hour_consumed, day_consumed, realtime_cost, replicas, historical_cost = usage
+        hour_remaining = self.hourly_quota - hour_consumed
+        day_remaining = self.daily_quota - day_consumed
+        if state is not None:
+            # Số GA báo về là chuẩn (tính cả consumer ngoài sổ này); trừ tiếp phần tiêu sau thời điểm đó
+            hour_state, day_state, observed_at = state
+            with self._lock:
+                consumed_since = self._conn.execute(
+                    "SELECT COALESCE(SUM(tokens_hour), 0), COALESCE(SUM(tokens_day), 0) FROM quota_usage WHERE property_id = ? AND observed_at > ?",
+                    (property_id, observed_at)
+                ).fetchone()
+            if hour_state is not None and now - observed_at < self.HOUR_SECONDS:
+                hour_remaining = min(hour_remaining, hour_state - consumed_since[0])
+            if day_state is not None and observed_at >= day_start:
+                day_remaining = min(day_remaining, day_state - consumed_since[1])
+        return {
+            "hour_consumed": int(hour_consumed),
+            "hour_remaining": int(hour_remaining),
+            "day_consumed": int(day_consumed),
+            "day_remaining": int(day_remaining),
+            "realtime_tokens_per_poll": float(realtime_cost or self.realtime_tokens_estimate),
+            "historical_tokens_per_call": float(historical_cost or self.historical_tokens_estimate),
+            # Replica này luôn được tính, kể cả khi chưa kịp poll lần nào
+            "active_replicas": max(int(replicas), 1),
+            "seconds_until_day_reset": self._seconds_until_day_reset(now)
+        }
+
+    def poll_interval(self, property_id: str, now: float = None) -> int:
+        """
+        Chu kỳ poll realtime (giây) của property cho replica này: chia phần quota giờ/ngày còn lại
+        (sau khi chừa phần cho báo cáo lịch sử) cho số lần poll của mọi replica đến khi quota hồi lại.
+        """
+        forecast = self.forecast(property_id, now)
+        cost = forecast["realtime_tokens_per_poll"] * forecast["active_replicas"]
+        hour_budget = forecast["hour_remaining"] - self.hourly_quota * self.historical_reserve_ratio
+        day_budget = forecast["day_remaining"] - self.daily_quota * self.historical_reserve_ratio
+        if hour_budget <= 0 or day_budget <= 0:
+            return self.max_interval_seconds
+        interval = max(
+            self.min_interval_seconds,
+            self.HOUR_SECONDS * cost / hour_budget,
+            forecast["seconds_until_day_reset"] * cost / day_budget
+        )
+        return int(min(interval, self.max_interval_seconds))
+
+    def allow_historical(self, property_id: str, now: float = None):
+        """
+        Báo cáo lịch sử chỉ được gọi khi phần quota giờ/ngày còn lại, sau khi trừ lượng realtime
+        dự kiến tiêu trong giờ tới / đến lúc quota ngày hồi lại, vẫn đủ cho ước lượng token của một lần gọi.
+        Trả về (allowed, lý do nếu bị hoãn).
+        """
+        forecast = self.forecast(property_id, now)
+        interval = self.poll_interval(property_id, now)
+        realtime_tokens_per_second = forecast["realtime_tokens_per_poll"] * forecast["active_replicas"] / interval
+        needed = forecast["historical_tokens_per_call"]
+        hour_headroom = forecast["hour_remaining"] - realtime_tokens_per_second * self.HOUR_SECONDS
+        day_headroom = forecast["day_remaining"] - realtime_tokens_per_second * forecast["seconds_until_day_reset"]
+        if hour_headroom < needed:
+            return False, f"hourly GA quota headroom is {int(max(hour_headroom, 0))} tokens, a historical call needs ~{int(needed)}"
+        if day_headroom < needed:
+            return False, f"daily GA quota headroom is {int(max(day_headroom, 0))} tokens, a historical call needs ~{int(needed)}"
+        return True, ""
+
+    def status(self, property_ids) -> pd.DataFrame:
+        rows = []
+        for property_id in property_ids:
+            forecast = self.forecast(property_id)
+            rows.append({
+                "Property": property_id,
+                "Poll Interval (s)": self.poll_interval(property_id),
+                "Hourly Remaining": forecast["hour_remaining"],
+                "Daily Remaining": forecast["day_remaining"],
+                "Tokens / Poll": round(forecast["realtime_tokens_per_poll"], 1),
+                "Tokens / Historical Call": round(forecast["historical_tokens_per_call"], 1),
+                "Active Replicas": forecast["active_replicas"],
+                "Historical Allowed": self.allow_historical(property_id)[0]
+            })
+        return pd.DataFrame(rows)
+
+@st.cache_resource
+def get_quota_governor():
+    """
+    Governor quota GA dùng chung cho toàn bộ process; sổ SQLite được chia sẻ với các replica cùng máy.
+    """
+    config = get_config()
+    return GAQuotaGovernor(
+        config.GA_QUOTA_STORE_PATH, config.HOURLY_TOKEN_QUOTA, config.DAILY_TOKEN_QUOTA,
+        config.GA_POLL_MIN_INTERVAL_SECONDS, config.GA_POLL_MAX_INTERVAL_SECONDS,
+        config.GA_HISTORICAL_RESERVE_RATIO, config.GA_REALTIME_TOKENS_PER_POLL_ESTIMATE,
+        config.GA_HISTORICAL_TOKENS_PER_CALL_ESTIMATE, config.GA_QUOTA_DAY_TIMEZONE
+    )
@@ -0,0 +1,116 @@
+# FILE: resources.py
+
+import atexit
+import threading
+import time
+import pandas as pd
+
+class ManagedResource:
+    """
+    Tài nguyên dài hạn dùng chung cho cả process (GA client, Supabase client...).
+    Được tạo lười ở lần get() đầu tiên và tái sử dụng qua mọi rerun/session.
+    Caller báo kết quả qua record_success()/record_failure(); sau `failure_threshold` lỗi
+    liên tiếp, lần get() kế tiếp chạy `health_check` (nếu có) và tạo lại tài nguyên khi
+    kiểm tra thất bại. Mọi tài nguyên được đóng khi process kết thúc.
+    Registry giữ một tài nguyên cho mỗi `name`: tài nguyên mới cùng tên thay thế tài nguyên
+    cũ, và close() gỡ tài nguyên khỏi registry.
+    """
+    def __init__(self, name: str, factory, health_check=None, closer=None, failure_threshold: int = 3):
+        self.name = name
+        self._factory = factory
+        self._health_check = health_check
+        self._closer = closer
+        self.failure_threshold = failure_threshold
+        self._resource = None
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._created_at = None
+        self._recreations = 0
+        self._last_error = ""
+        _register(self)
+
+    def _close_current(self):
+        resource, self._resource = self._resource, None
+        if resource is not None and self._closer is not None:
+            try:
+                self._closer(resource)
+            except Exception as e:
+                print(f"[resources] Error closing {self.name}: {e}")
+
+    def _create(self):
+        self._resource = self._factory()
+        self._created_at = time.time()
+        self._consecutive_failures = 0
+
+    def _is_healthy(self) -> bool:
+        if self._health_check is None:
+            return False
+        try:
+            return bool(self._health_check(self._resource))
+        except Exception as e:
+            self._last_error = str(e)
+            return False
+
+    def get(self):
+        with self._lock:
+            if self._resource is None:
+                self._create()
+            elif self._consecutive_failures >= self.failure_threshold:
+                if self._is_healthy():
+                    self._consecutive_failures = 0
+                else:
+                    print(f"[resources] {self.name} unhealthy after {self._consecutive_failures} failures, recreating.")
+                    self._close_current()
+                    self._create()
+                    self._recreations += 1
+            return self._resource
+
+    def peek(self):
+        """Tài nguyên hiện tại (có thể None), không tạo mới và không health check."""
+        return self._resource
+
+    def record_success(self):
+        self._consecutive_failures = 0
+
+    def record_failure(self, error=None):
+        self._consecutive_failures += 1
+        if error is not None:
+            self._last_error = str(error)
+
+    def close(self):
+        with self._lock:
+            self._close_current()
+        _unregister(self)
+
+    def status(self) -> dict:
+        return {
+            "Resource": self.name,
+            "Alive": self._resource is not None,
+            "Age (s)": round(time.time() - self._created_at, 1) if self._created_at and self._resource is not None else 0.0,
+            "Consecutive Failures": self._consecutive_failures,
+            "Recreations": self._recreations,
+            "Last Error": self._last_error
+        }
+
+_RESOURCES = {}
+_RESOURCES_LOCK = threading.Lock()
+
+def _register(resource: ManagedResource):
+    with _RESOURCES_LOCK:
+        _RESOURCES[resource.name] = resource
+
+def _unregister(resource: ManagedResource):
+    with _RESOURCES_LOCK:
+        if _RESOURCES.get(resource.name) is resource:
+            del _RESOURCES[resource.name]
+
+def get_resource_status() -> pd.DataFrame:
+    with _RESOURCES_LOCK:
+        return pd.DataFrame([resource.status() for resource in _RESOURCES.values()])
+
+@atexit.register
+def close_all_resources():
+    with _RESOURCES_LOCK:
+        resources = list(_RESOURCES.values())
+    for resource in resources:
+        resource.close()
@@ -0,0 +1,247 @@
+# FILE: sales_subscriber.py
+
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlencode
+import pandas as pd
+import streamlit as st
+from websockets.sync.client import connect
+from config import get_config
+
+SALES_EVENT_COLUMNS = ["order_id", "store_id", "store_name", "product_title", "product_symbol", "revenue", "created_at", "line_items"]
+
+def _parse_created_at(value) -> datetime:
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+class SalesEventSubscriber:
+    """
+    Subscriber phía server (một cho mỗi process) cho các INSERT vào sales_events qua
+    Supabase Realtime (giao thức Phoenix trên websocket). Giữ một cửa sổ trượt các đơn
+    hàng trong bộ nhớ; khi khởi động hoặc kết nối lại thì nạp bù phần còn thiếu qua REST.
+    Mỗi dòng sales_events là một đơn hàng; cột line_items (do edge function ghi, đã phân bổ
+    phí ship giống _allocate_line_items) được tách thành các dòng sản phẩm để số purchase và
+    revenue khớp với polling Shopify. Dòng cũ chưa có line_items được tính là 1 purchase = subtotal.
+    """
+    HEARTBEAT_INTERVAL_SECONDS = 25
+    # PostgREST giới hạn số dòng mỗi response (max-rows), nên backfill đi theo từng trang
+    BACKFILL_PAGE_SIZE = 1000
+    # created_at là giờ tạo đơn, không phải giờ ghi vào sales_events: đơn ghi trễ (webhook thử lại,
+    # hàng đợi ghi) có created_at cũ hơn đơn cuối đã thấy. Nạp bù lùi lại một khoảng để bắt các
+    # đơn đó; đơn đã có bị ghi đè theo (store_id, order_id) nên phần chồng lên không bị đếm đôi.
+    BACKFILL_OVERLAP = timedelta(minutes=15)
+    MAX_RECONNECT_DELAY_SECONDS = 60
+    TOPIC = "realtime:python-sales-events"
+
+    def __init__(self, supabase_url: str, api_key: str, window_hours: int):
+        self.supabase_url = supabase_url.rstrip("/")
+        self.api_key = api_key
+        self.window_hours = window_hours
+        self._events = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._ref = 0
+        self._join_ref = None
+        self._last_created_at = None
+        self.connected = False
+        self.warm = False
+        self.last_event_at = None
+        self.reconnects = 0
+
+    # --- vòng đời ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="sales-events-subscriber", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    @property
+    def ready(self) -> bool:
+        """True khi cửa sổ đã được nạp và websocket đang kết nối, tức có thể thay cho polling."""
+        return self.warm and self.connected
+
+    # --- cửa sổ đơn hàng ---
+    def _add_event(self, record: dict):
+        if not record.get("order_id") or not record.get("created_at"):
+            return
+        created_at = _parse_created_at(record["created_at"])
+        key = (str(record.get("store_id", "")), str(record["order_id"]))
+        with self._lock:
+            self._events[key] = {**{column: record.get(column) for column in SALES_EVENT_COLUMNS}, "created_at": created_at}
+            if self._last_created_at is None or created_at > self._last_created_at:
+                self._last_created_at = created_at
+
+    def _evict_expired(self):
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=self.window_hours)
+        with self._lock:
+            expired = [key for key, event in self._events.items() if event["created_at"] < cutoff]
+            for key in expired:
+                del self._events[key]
+
+    def _backfill(self):
+        """
+        Nạp sales_events qua REST: cả cửa sổ ở lần đầu, sau đó chỉ phần kể từ đơn cuối cùng
+        đã thấy trừ đi BACKFILL_OVERLAP.
+        """
+        config = get_config()
+        if not config.supabase:
+            return
+        window_start = datetime.now(timezone.utc) - timedelta(hours=self.window_hours)
+        since = max(self._last_created_at - self.BACKFILL_OVERLAP, window_start) if self._last_created_at else window_start
+        start = 0
+        while True:
+            response = config.supabase.table("sales_events") \
+                .select(",".join(SALES_EVENT_COLUMNS)) \
+                .gte("created_at", since.isoformat()) \
+                .order("created_at", desc=False) \
+                .range(start, start + self.BACKFILL_PAGE_SIZE - 1) \
+                .execute()
+            records = response.data or []
+            for record in records:
+                self._add_event(record)
+            # Trang thiếu nghĩa là đã đọc hết
+            if len(records) < self.BACKFILL_PAGE_SIZE:
+                break
+            start += self.BACKFILL_PAGE_SIZE
+        self._evict_expired()
+        self.warm = True
+
+    def events_since(self, hours: float) -> pd.DataFrame:
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=hours)
+        with self._lock:
+            rows = [event for event in self._events.values() if event["created_at"] >= cutoff]
+        if not rows:
+            return pd.DataFrame(columns=SALES_EVENT_COLUMNS)
+        return pd.DataFrame(rows, columns=SALES_EVENT_COLUMNS).sort_values("created_at", ignore_index=True)
+
+    def purchase_events(self, time_window_hours: float) -> pd.DataFrame:
+        """Cùng dạng với load_purchase_events_from_supabase (marker trên trend chart)."""
+        return self.events_since(time_window_hours)[["created_at", "product_title", "product_symbol"]]
+
+    def realtime_purchases(self, window_minutes: int = 30) -> pd.DataFrame:
+        """Cùng dạng với ShopifyService.fetch_realtime_purchases, để thay thế polling Shopify REST."""
+        events_df = self.events_since(window_minutes / 60)
+        rows = []
+        for event in events_df.itertuples(index=False):
+            created_at = event.created_at.isoformat()
+            line_items = json.loads(event.line_items) if isinstance(event.line_items, str) else event.line_items
+            if line_items:
+                rows.extend({
+                    'Product Title': item.get('title'),
+                    'Purchases': int(item.get('quantity', 0)),
+                    'Revenue': float(item.get('revenue', 0.0)),
+                    'created_at': created_at
+                } for item in line_items)
+            else:
+                rows.append({'Product Title': event.product_title, 'Purchases': 1, 'Revenue': float(event.revenue or 0.0), 'created_at': created_at})
+        return pd.DataFrame(rows, columns=['Product Title', 'Purchases', 'Revenue', 'created_at'])
+
+    # --- giao thức Phoenix ---
+    def _socket_url(self) -> str:
+        base = self.supabase_url.replace("https://", "wss://").replace("http://", "ws://")
+        return f"{base}/realtime/v1/websocket?{urlencode({'apikey': self.api_key, 'vsn': '1.0.0'})}"
+
+    def _next_ref(self) -> str:
+        self._ref += 1
+        return str(self._ref)
+
+    def _send(self, ws, topic: str, event: str, payload: dict, join_ref: str = None):
+        ws.send(json.dumps({"topic": topic, "event": event, "payload": payload, "ref": self._next_ref(), "join_ref": join_ref}))
+
+    def _join(self, ws):
+        self._join_ref = self._next_ref()
+        ws.send(json.dumps({
+            "topic": self.TOPIC,
+            "event": "phx_join",
+            "payload": {
+                "config": {
+                    "broadcast": {"self": False},
+                    "presence": {"key": ""},
+                    "postgres_changes": [{"event": "INSERT", "schema": "public", "table": "sales_events"}]
+                },
+                "access_token": self.api_key
+            },
+            "ref": self._join_ref,
+            "join_ref": self._join_ref
+        }))
+
+    def _handle_message(self, message: dict):
+        event = message.get("event")
+        payload = message.get("payload") or {}
+        if event == "phx_reply" and message.get("ref") == self._join_ref:
+            if payload.get("status") != "ok":
+                raise ConnectionError(f"Channel join rejected: {payload.get('response')}")
+            self.connected = True
+        elif event == "postgres_changes":
+            data = payload.get("data") or {}
+            if data.get("type") == "INSERT":
+                self._add_event(data.get("record") or {})
+                self.last_event_at = datetime.now(timezone.utc)
+        elif event in ("phx_error", "phx_close") and message.get("topic") == self.TOPIC:
+            raise ConnectionError(f"Channel closed by server ({event}).")
+
+    def _listen(self, ws):
+        self._join(ws)
+        next_heartbeat = time.monotonic() + self.HEARTBEAT_INTERVAL_SECONDS
+        next_eviction = time.monotonic() + 60
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            if now >= next_heartbeat:
+                self._send(ws, "phoenix", "heartbeat", {})
+                next_heartbeat = now + self.HEARTBEAT_INTERVAL_SECONDS
+            if now >= next_eviction:
+                self._evict_expired()
+                next_eviction = now + 60
+            try:
+                raw = ws.recv(timeout=max(0.1, min(next_heartbeat, next_eviction) - time.monotonic()))
+            except TimeoutError:
+                continue
+            self._handle_message(json.loads(raw))
+
+    def _run(self):
+        delay = 1
+        while not self._stop_event.is_set():
+            try:
+                # Nạp bù trước khi nghe để không hụt các đơn đến trong lúc mất kết nối
+                self._backfill()
+                with connect(self._socket_url(), open_timeout=10, close_timeout=2) as ws:
+                    delay = 1
+                    self._listen(ws)
+            except Exception as e:
+                print(f"[sales_subscriber] Connection lost, reconnecting in {delay}s. Error: {e}")
+            finally:
+                self.connected = False
+            if self._stop_event.wait(delay):
+                break
+            self.reconnects += 1
+            delay = min(delay * 2, self.MAX_RECONNECT_DELAY_SECONDS)
+
+    def status(self) -> dict:
+        with self._lock:
+            window_size = len(self._events)
+        return {
+            "Connected": self.connected,
+            "Warm": self.warm,
+            "Events In Window": window_size,
+            "Last Event": self.last_event_at.isoformat() if self.last_event_at else "",
+            "Reconnects": self.reconnects
+        }
+
+@st.cache_resource
+def get_sales_event_subscriber():
+    """
+    Subscriber sales_events dùng chung cho toàn bộ process; None nếu bị tắt hoặc thiếu cấu hình Supabase.
+    """
+    config = get_config()
+    if not config.SALES_EVENTS_SUBSCRIBER_ENABLED or not config.supabase_url or not config.supabase_anon_key:
+        return None
+    subscriber = SalesEventSubscriber(config.supabase_url, config.supabase_anon_key, config.HISTORY_MAX_WINDOW_HOURS)
+    subscriber.start()
+    return subscriber
@@ -5,214 +5,587 @@ import pandas as pd
 import requests
 from datetime import datetime, timedelta, timezone
 import pytz
+import threading
+import time
+import atexit
+from concurrent.futures import ThreadPoolExecutor, wait
+from order_store import get_order_store
+from ga_cache import get_ga_daily_cache
+from cache import get_upstream_cache
+from resources import ManagedResource
+from quota_governor import get_quota_governor, quota_details_from_responses, REALTIME, HISTORICAL
+from config import get_config
 from google.analytics.data_v1beta import BetaAnalyticsDataClient
 from google.analytics.data_v1beta.types import (
     RunRealtimeReportRequest, RunReportRequest, Dimension, Metric, MinuteRange,
     DateRange
 )
 
+# Pool dùng chung cho các request GA chạy song song (property x loại report)
+_GA_EXECUTOR = ThreadPoolExecutor(max_workers=12, thread_name_prefix="ga-realtime")
+
+@st.cache_resource
+def get_ga_client_resource():
+    """
+    GA Data API client (một gRPC channel) dùng chung cho toàn bộ process.
+    Được tạo lại khi có nhiều lỗi liên tiếp và đóng channel khi process kết thúc.
+    """
+    config = get_config()
+    return ManagedResource(
+        "ga_data_api",
+        lambda: BetaAnalyticsDataClient(credentials=config.ga_credentials),
+        closer=lambda client: client.transport.close()
+    )
+
 class GoogleAnalyticsService:
     def __init__(self, config):
-        self.client = BetaAnalyticsDataClient(credentials=config.ga_credentials)
+        self.client_resource = get_ga_client_resource()
+        self.request_timeout = config.GA_REQUEST_TIMEOUT
+        self.history_cache = get_ga_daily_cache()
+        self.quota_governor = get_quota_governor()
+        self.default_property_timezone = config.GA_DEFAULT_PROPERTY_TIMEZONE
+        self.realtime_cache = get_upstream_cache()
+        self.realtime_cache_ttl = config.REALTIME_CACHE_TTL_SECONDS
+        # {property_id: CacheResult không kèm value} của lần đọc realtime gần nhất
+        self.last_realtime_status = {}
 
-    @st.cache_data(ttl=60)
-    def fetch_realtime_report(_self, property_id: str):
-        try:
-            # 1. KPI Request: Active Users
-            kpi_request = RunRealtimeReportRequest(
-                property=f"properties/{property_id}",
-                metrics=[Metric(name="activeUsers")],
-                minute_ranges=[
-                    MinuteRange(start_minutes_ago=29, end_minutes_ago=0),
-                    MinuteRange(start_minutes_ago=4, end_minutes_ago=0)
-                ]
-            )
-            
-            # 2. Pages Request: Active Users & Views by Page
-            pages_request = RunRealtimeReportRequest(
-                property=f"properties/{property_id}",
-                dimensions=[Dimension(name="unifiedScreenName"), Dimension(name="minutesAgo")],
-                metrics=[Metric(name="activeUsers"), Metric(name="screenPageViews")],
-                minute_ranges=[MinuteRange(start_minutes_ago=29, end_minutes_ago=0)],
-                return_property_quota=True
-            )
+    @property
+    def client(self) -> BetaAnalyticsDataClient:
+        return self.client_resource.get()
 
-            # 3. Events Request: Lấy dữ liệu Checkout (begin_checkout)
-            events_request = RunRealtimeReportRequest(
-                property=f"properties/{property_id}",
-                dimensions=[Dimension(name="eventName")],
-                metrics=[Metric(name="eventCount")],
-                minute_ranges=[MinuteRange(start_minutes_ago=29, end_minutes_ago=0)]
-            )
+    def _build_realtime_requests(self, property_id: str):
+        # 1. KPI Request: Active Users
+        kpi_request = RunRealtimeReportRequest(
+            property=f"properties/{property_id}",
+            metrics=[Metric(name="activeUsers")],
+            minute_ranges=[
+                MinuteRange(start_minutes_ago=29, end_minutes_ago=0),
+                MinuteRange(start_minutes_ago=4, end_minutes_ago=0)
+            ],
+            return_property_quota=True
+        )
 
-            # Execute requests
-            kpi_response = _self.client.run_realtime_report(kpi_request)
-            pages_response = _self.client.run_realtime_report(pages_request)
-            events_response = _self.client.run_realtime_report(events_request)
-            
-            # Process KPI
-            active_users_30min = (int(kpi_response.rows[0].metric_values[0].value) if kpi_response.rows else 0)
-            active_users_5min = (int(kpi_response.rows[1].metric_values[0].value) if len(kpi_response.rows) > 1 else 0)
-            
-            # Process Checkouts
-            checkouts_30min = 0
-            if events_response.rows:
-                for row in events_response.rows:
-                    event_name = row.dimension_values[0].value
-                    if event_name == "begin_checkout":
-                        checkouts_30min = int(row.metric_values[0].value)
-                        break
+        # 2. Pages Request: Active Users & Views by Page
+        pages_request = RunRealtimeReportRequest(
+            property=f"properties/{property_id}",
+            dimensions=[Dimension(name="unifiedScreenName"), Dimension(name="minutesAgo")],
+            metrics=[Metric(name="activeUsers"), Metric(name="screenPageViews")],
+            minute_ranges=[MinuteRange(start_minutes_ago=29, end_minutes_ago=0)],
+            return_property_quota=True
+        )
 
-            # Process Quota
-            pq = getattr(pages_response, "property_quota", None)
-            quota_details = {
-                "tokens_per_hour": {"consumed": pq.tokens_per_hour.consumed if pq and pq.tokens_per_hour else 0, "remaining": pq.tokens_per_hour.remaining if pq and pq.tokens_per_hour else "N/A"},
-                "tokens_per_day": {"consumed": pq.tokens_per_day.consumed if pq and pq.tokens_per_day else 0, "remaining": pq.tokens_per_day.remaining if pq and pq.tokens_per_day else "N/A"}
-            }
-            
-            # Process Pages Rows
-            rows = [{"Page Title and Screen Class": row.dimension_values[0].value, "minutesAgo": int(row.dimension_values[1].value), "Active Users": int(row.metric_values[0].value), "Views": int(row.metric_values[1].value)} for row in pages_response.rows]
-            
-            return pd.DataFrame(rows), quota_details, datetime.now(pytz.utc), active_users_5min, active_users_30min, checkouts_30min
-        except Exception as e:
-            st.error(f"Lỗi khi lấy dữ liệu Realtime từ Google Analytics: {e}")
-            # Trả về thêm 0 cho checkouts_30min khi lỗi
-            return pd.DataFrame(), {}, datetime.now(pytz.utc), 0, 0, 0
+        # 3. Events Request: Lấy dữ liệu Checkout (begin_checkout)
+        events_request = RunRealtimeReportRequest(
+            property=f"properties/{property_id}",
+            dimensions=[Dimension(name="eventName")],
+            metrics=[Metric(name="eventCount")],
+            minute_ranges=[MinuteRange(start_minutes_ago=29, end_minutes_ago=0)],
+            return_property_quota=True
+        )
+        return {"kpi": kpi_request, "pages": pages_request, "events": events_request}
+
+    def _parse_realtime_responses(self, kpi_response, pages_response, events_response):
+        # Process KPI
+        active_users_30min = (int(kpi_response.rows[0].metric_values[0].value) if kpi_response.rows else 0)
+        active_users_5min = (int(kpi_response.rows[1].metric_values[0].value) if len(kpi_response.rows) > 1 else 0)
+
+        # Process Checkouts
+        checkouts_30min = 0
+        if events_response.rows:
+            for row in events_response.rows:
+                event_name = row.dimension_values[0].value
+                if event_name == "begin_checkout":
+                    checkouts_30min = int(row.metric_values[0].value)
+                    break
 
-    @st.cache_data
-    def fetch_historical_report(_self, property_id: str, start_date: str, end_date: str, segment: str):
+        # Process Quota: cả 3 report đều tiêu token của property
+        quota_details = quota_details_from_responses(kpi_response, pages_response, events_response)
+
+        # Process Pages Rows
+        rows = [{"Page Title and Screen Class": row.dimension_values[0].value, "minutesAgo": int(row.dimension_values[1].value), "Active Users": int(row.metric_values[0].value), "Views": int(row.metric_values[1].value)} for row in pages_response.rows]
+
+        return pd.DataFrame(rows), quota_details, datetime.now(pytz.utc), active_users_5min, active_users_30min, checkouts_30min
+
+    def _fetch_realtime_property(self, property_id: str):
+        """Gửi đồng thời 3 report realtime của một property; lỗi được raise để cache giữ giá trị cũ."""
+        futures = {
+            report_name: _GA_EXECUTOR.submit(self.client.run_realtime_report, request, timeout=self.request_timeout)
+            for report_name, request in self._build_realtime_requests(property_id).items()
+        }
+        # Mỗi request đã có timeout riêng; thêm một khoảng nhỏ để các future kịp trả lỗi.
+        wait(futures.values(), timeout=self.request_timeout + 2)
         try:
-            dimensions = [Dimension(name="pageTitle")]
-            if segment == 'By Day': dimensions.append(Dimension(name="date"))
-            elif segment == 'By Week': dimensions.append(Dimension(name="week"))
+            responses = [futures[name].result(timeout=0) for name in ("kpi", "pages", "events")]
+        except Exception as e:
+            self.client_resource.record_failure(e)
+            raise
+        self.client_resource.record_success()
+        parsed = self._parse_realtime_responses(*responses)
+        self.quota_governor.record(property_id, REALTIME, parsed[1])
+        return parsed
+
+    def fetch_realtime_reports(_self, property_ids: tuple):
+        """
+        Lấy report realtime của các property qua cache stale-while-revalidate dùng chung:
+        các property hết hạn được refresh song song (mỗi property chỉ một request đang chạy),
+        refresh lỗi thì giữ kết quả tốt gần nhất (fetch_time trong tuple cho biết tuổi dữ liệu).
+        Property đã có giá trị thì trả ngay giá trị cũ trong lúc refresh chạy nền; chỉ property
+        chưa từng lấy được mới chờ request.
+        Trả về dict {property_id: (df, quota_details, fetch_time, users_5min, users_30min, checkouts_30min)}.
+        """
+        cached = _self.realtime_cache.get_many(
+            {("ga_realtime", property_id): (lambda pid=property_id: _self._fetch_realtime_property(pid)) for property_id in property_ids},
+            ttl_seconds=_self.realtime_cache_ttl,
+            wait_timeout=0,
+            miss_timeout=_self.request_timeout + 2
+        )
+
+        results = {}
+        for property_id in property_ids:
+            entry = cached[("ga_realtime", property_id)]
+            _self.last_realtime_status[property_id] = entry._replace(value=None)
+            if entry.error is not None:
+                print(f"Lỗi khi lấy dữ liệu Realtime từ Google Analytics (property {property_id}): {entry.error}")
+            if entry.value is not None:
+                results[property_id] = entry.value
+            else:
+                # Chưa từng lấy được: trả về 0 cho mọi chỉ số
+                results[property_id] = (pd.DataFrame(), {}, datetime.now(pytz.utc), 0, 0, 0)
+        return results
+
+    def _fetch_daily_pages(self, property_id: str, start_date: str, end_date: str) -> pd.DataFrame:
+        """
+        Lấy pageTitle x date trong [start_date, end_date], phân trang theo offset.
+        Token của mọi trang được ghi vào governor như một lần gọi lịch sử.
+        """
+        rows = []
+        responses = []
+        offset = 0
+        page_size = 50000
+        while True:
             request = RunReportRequest(
                 property=f"properties/{property_id}",
-                dimensions=dimensions,
+                dimensions=[Dimension(name="pageTitle"), Dimension(name="date")],
                 metrics=[Metric(name="sessions"), Metric(name="totalUsers")],
                 date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-                limit=50000
+                limit=page_size,
+                offset=offset,
+                return_property_quota=True
             )
-            response = _self.client.run_report(request)
-            rows = []
+            response = self.client.run_report(request, timeout=self.request_timeout)
+            responses.append(response)
+            if response.metadata.time_zone:
+                self.history_cache.set_time_zone(property_id, response.metadata.time_zone)
             for row in response.rows:
-                item_data = {"Page Title": row.dimension_values[0].value, "Sessions": int(row.metric_values[0].value), "Users": int(row.metric_values[1].value)}
-                if segment == 'By Day':
-                    item_data['Date'] = datetime.strptime(row.dimension_values[1].value, '%Y%m%d').strftime('%Y-%m-%d')
-                elif segment == 'By Week':
-                    item_data['Week'] = row.dimension_values[1].value
-                rows.append(item_data)
-            return pd.DataFrame(rows)
+                rows.append({
+                    "Page Title": row.dimension_values[0].value,
+                    "Date": datetime.strptime(row.dimension_values[1].value, '%Y%m%d').strftime('%Y-%m-%d'),
+                    "Sessions": int(row.metric_values[0].value),
+                    "Users": int(row.metric_values[1].value)
+                })
+            offset += len(response.rows)
+            if not response.rows or offset >= response.row_count:
+                break
+        self.quota_governor.record(property_id, HISTORICAL, quota_details_from_responses(*responses))
+        return pd.DataFrame(rows, columns=["Page Title", "Date", "Sessions", "Users"])
+
+    def fetch_historical_daily_report(_self, property_id: str, start_date: str, end_date: str):
+        """
+        Báo cáo lịch sử (pageTitle x date) ghép từ cache theo ngày. Ngày đã chốt (quá thời gian xử lý của GA)
+        không bao giờ gọi lại GA; các ngày còn thiếu hoặc chưa chốt được lấy trong tối đa một lần gọi GA.
+        """
+        # Ranh giới ngày theo múi giờ của property (GA chia ngày theo múi giờ đó)
+        tz = pytz.timezone(_self.history_cache.get_time_zone(property_id) or _self.default_property_timezone)
+        start_day = datetime.strptime(start_date, "%Y-%m-%d").date()
+        end_day = datetime.strptime(end_date, "%Y-%m-%d").date()
+        days = [start_day + timedelta(days=i) for i in range((end_day - start_day).days + 1)]
+        dates = [day.strftime('%Y-%m-%d') for day in days]
+        day_end_times = {
+            day.strftime('%Y-%m-%d'): tz.localize(datetime.combine(day + timedelta(days=1), datetime.min.time())).astimezone(timezone.utc)
+            for day in days
+        }
+
+        try:
+            now = datetime.now(timezone.utc)
+            stale_dates = _self.history_cache.stale_dates(property_id, dates, day_end_times, now)
+            # Báo cáo lịch sử chỉ chạy trong phần quota dư mà governor chừa ra sau realtime
+            allowed, reason = _self.quota_governor.allow_historical(property_id) if stale_dates else (False, "")
+            if stale_dates and not allowed:
+                st.info(f"Historical refresh deferred: {reason}. Showing cached data; it will refresh once quota frees up.")
+            if allowed:
+                fetch_start, fetch_end = min(stale_dates), max(stale_dates)
+                print(f"Fetching GA history for {property_id}: {fetch_start} -> {fetch_end} ({len(stale_dates)} stale days)")
+                try:
+                    daily_df = _self._fetch_daily_pages(property_id, fetch_start, fetch_end)
+                except Exception as e:
+                    _self.client_resource.record_failure(e)
+                    raise
+                _self.client_resource.record_success()
+                _self.history_cache.replace_partitions(property_id, [date for date in dates if fetch_start <= date <= fetch_end], daily_df, now)
         except Exception as e:
+            # Vẫn trả về phần đã có trong cache
             st.error(f"Lỗi khi lấy dữ liệu Lịch sử từ Google Analytics: {e}")
-            return pd.DataFrame()
+
+        return _self.history_cache.load(property_id, start_date, end_date)
+
+def _allocate_line_items(order: dict):
+    """Tách đơn hàng thành các dòng sản phẩm, phân bổ phí ship theo tỷ lệ giá trị."""
+    subtotal = float(order.get('subtotal_price', 0.0))
+    shipping_fee = float(order.get('total_shipping_price_set', {}).get('shop_money', {}).get('amount', 0.0))
+    line_items = []
+    for item in order.get('line_items', []):
+        item_price = float(item.get('price', 0.0))
+        item_quantity = int(item.get('quantity', 0))
+        item_total_value = item_price * item_quantity
+        shipping_allocation = (shipping_fee * (item_total_value / subtotal)) if subtotal > 0 else 0
+        line_items.append((item['title'], item_quantity, item_total_value + shipping_allocation))
+    return line_items
+
+def _parse_shopify_datetime(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+# Pool dùng chung để gọi đồng thời nhiều store Shopify
+_SHOPIFY_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="shopify")
+
+class ShopifyTransport:
+    """
+    Lớp truyền tải HTTP cho Shopify: mỗi store một requests.Session (keep-alive,
+    connection pool), tự giãn nhịp theo header X-Shopify-Shop-Api-Call-Limit
+    và ghi lại thống kê latency / số trang cho debug mode.
+    """
+    # Shopify REST dùng leaky bucket, bucket tiêu chuẩn rò 2 request/giây
+    LEAK_RATE_PER_SECOND = 2.0
+    THROTTLE_RATIO = 0.8
+    MAX_RETRIES_ON_429 = 3
+
+    def __init__(self):
+        self._sessions = {}
+        self._call_limits = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        # Các luồng đồng bộ của nhiều store cùng cập nhật thống kê và call limit
+        self._stats_lock = threading.Lock()
+
+    def _session_for(self, store_creds: dict) -> requests.Session:
+        store_id = store_creds.get("store_id", "unknown_store")
+        with self._lock:
+            session = self._sessions.get(store_id)
+            if session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+                session.mount("https://", adapter)
+                session.headers.update({"X-Shopify-Access-Token": store_creds['access_token']})
+                self._sessions[store_id] = session
+        with self._stats_lock:
+            # Giữ thống kê cũ khi session được mở lại sau lỗi kết nối
+            self._stats.setdefault(store_id, {"requests": 0, "pages": 0, "errors": 0, "total_latency_s": 0.0, "last_latency_s": 0.0, "throttled_s": 0.0, "call_limit": ""})
+        return session
+
+    def _drop_session(self, store_id: str):
+        with self._lock:
+            session = self._sessions.pop(store_id, None)
+        if session is not None:
+            session.close()
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            session.close()
+
+    def _add_stat(self, store_id: str, field: str, amount=1):
+        with self._stats_lock:
+            self._stats[store_id][field] += amount
+
+    def _wait_for_bucket(self, store_id: str):
+        with self._stats_lock:
+            used, limit = self._call_limits.get(store_id, (0, 0))
+        if limit and used >= limit * self.THROTTLE_RATIO:
+            # Chờ cho bucket rò xuống còn một nửa trước khi gọi tiếp
+            delay = (used - limit / 2) / self.LEAK_RATE_PER_SECOND
+            self._add_stat(store_id, "throttled_s", delay)
+            time.sleep(delay)
+
+    def _record_response(self, store_id: str, response: requests.Response, latency_s: float):
+        call_limit = response.headers.get("X-Shopify-Shop-Api-Call-Limit")
+        with self._stats_lock:
+            stats = self._stats[store_id]
+            stats["requests"] += 1
+            stats["total_latency_s"] += latency_s
+            stats["last_latency_s"] = latency_s
+            if call_limit:
+                stats["call_limit"] = call_limit
+                try:
+                    used, limit = (int(part) for part in call_limit.split("/"))
+                    self._call_limits[store_id] = (used, limit)
+                except ValueError:
+                    pass
+
+    def get(self, store_creds: dict, url: str, params: dict, timeout: int) -> requests.Response:
+        store_id = store_creds.get("store_id", "unknown_store")
+        session = self._session_for(store_creds)
+        for attempt in range(self.MAX_RETRIES_ON_429 + 1):
+            self._wait_for_bucket(store_id)
+            started = time.monotonic()
+            try:
+                response = session.get(url, params=params, timeout=timeout)
+            except requests.ConnectionError:
+                # Kết nối hỏng: bỏ session của store này, lần gọi sau sẽ mở session mới
+                self._add_stat(store_id, "errors")
+                self._drop_session(store_id)
+                raise
+            except Exception:
+                self._add_stat(store_id, "errors")
+                raise
+            self._record_response(store_id, response, time.monotonic() - started)
+            if response.status_code == 429 and attempt < self.MAX_RETRIES_ON_429:
+                retry_after = float(response.headers.get("Retry-After", 2.0))
+                self._add_stat(store_id, "throttled_s", retry_after)
+                time.sleep(retry_after)
+                continue
+            if not response.ok:
+                self._add_stat(store_id, "errors")
+            response.raise_for_status()
+            return response
+
+    def iter_order_pages(self, store_creds: dict, url: str, params: dict, timeout: int):
+        """Duyệt qua mọi trang orders.json theo header Link (cursor pagination của Shopify)."""
+        store_id = store_creds.get("store_id", "unknown_store")
+        while url:
+            response = self.get(store_creds, url, params, timeout)
+            self._add_stat(store_id, "pages")
+            yield response.json().get('orders', [])
+
+            url = None
+            if 'Link' in response.headers:
+                links = requests.utils.parse_header_links(response.headers['Link'])
+                for link in links:
+                    if link.get('rel') == 'next':
+                        url = link.get('url')
+                        # URL trang kế đã chứa page_info, Shopify không cho gửi thêm filter
+                        params = None
+                        break
+
+    def get_stats(self) -> pd.DataFrame:
+        with self._stats_lock:
+            snapshot = {store_id: dict(stats) for store_id, stats in self._stats.items()}
+        rows = []
+        for store_id, stats in snapshot.items():
+            rows.append({
+                "Store": store_id,
+                "Requests": stats["requests"],
+                "Pages": stats["pages"],
+                "Errors": stats["errors"],
+                "Avg Latency (ms)": round(stats["total_latency_s"] / stats["requests"] * 1000, 1) if stats["requests"] else 0.0,
+                "Last Latency (ms)": round(stats["last_latency_s"] * 1000, 1),
+                "Throttled (s)": round(stats["throttled_s"], 1),
+                "Call Limit": stats["call_limit"]
+            })
+        return pd.DataFrame(rows)
+
+@st.cache_resource
+def get_shopify_transport():
+    """
+    Transport Shopify dùng chung cho toàn bộ process để tái sử dụng kết nối.
+    """
+    transport = ShopifyTransport()
+    atexit.register(transport.close)
+    return transport
 
 class ShopifyService:
+    REALTIME_WINDOW_MINUTES = 30
+    HISTORY_SYNC_INTERVAL_SECONDS = 60
+
     def __init__(self, config):
         self.stores_config = config.shopify_stores_config
+        # Cửa sổ trượt 30 phút cho từng store: {store_id: {"orders": {order_id: (created_at, rows)}, "since_id": int}}
+        self._realtime_windows = {}
+        self._realtime_lock = threading.Lock()
+        self.transport = get_shopify_transport()
+        # Kho đơn hàng cục bộ cho báo cáo lịch sử
+        self.order_store = get_order_store()
+        self._last_history_sync = {}
+        # Mỗi store một lock: hai lần refresh cùng lúc không đồng bộ cùng một store hai lần
+        self._store_sync_locks = {}
+        self._store_sync_locks_lock = threading.Lock()
+        self.realtime_cache = get_upstream_cache()
+        self.realtime_cache_ttl = config.REALTIME_CACHE_TTL_SECONDS
+        # CacheResult (không kèm value) của lần đọc realtime gần nhất, dùng để báo tuổi/lỗi dữ liệu
+        self.last_realtime_status = None
 
-    @st.cache_data(ttl=60)
-    def fetch_realtime_purchases(_self):
+    def _ingest_realtime_store(self, store_creds: dict, window_start: datetime):
+        store_id = store_creds.get("store_id", "unknown_store")
+        window = self._realtime_windows.setdefault(store_id, {"orders": {}, "since_id": None})
+
+        base_url = f"https://{store_creds['store_url']}/admin/api/{store_creds['api_version']}/orders.json"
+        params = {"status": "any", "limit": 250, "fields": "id,line_items,total_shipping_price_set,subtotal_price,created_at"}
+        if window["since_id"] is None:
+            # Lần đầu: nạp toàn bộ cửa sổ 30 phút
+            params["created_at_min"] = window_start.strftime('%Y-%m-%dT%H:%M:%SZ')
+        else:
+            # Các lần sau: chỉ lấy đơn mới hơn đơn cuối cùng đã thấy
+            params["since_id"] = window["since_id"]
+
+        new_orders = 0
+        # Chỉ cập nhật since_id khi đã duyệt hết các trang, tránh bỏ sót đơn nếu lỗi giữa chừng
+        next_since_id = window["since_id"]
+        for orders in self.transport.iter_order_pages(store_creds, base_url, params, timeout=10):
+            for order in orders:
+                order_id = order['id']
+                next_since_id = max(next_since_id or 0, order_id)
+                if order_id in window["orders"]:
+                    continue
+                order_created_at = order.get('created_at')
+                rows = [{
+                    'Product Title': title,
+                    'Purchases': quantity,
+                    'Revenue': revenue,
+                    'created_at': order_created_at
+                } for title, quantity, revenue in _allocate_line_items(order)]
+                window["orders"][order_id] = (_parse_shopify_datetime(order_created_at), rows)
+                new_orders += 1
+        window["since_id"] = next_since_id
+
+        # Loại các đơn đã trôi ra khỏi cửa sổ 30 phút
+        expired_ids = [order_id for order_id, (created_at, _) in window["orders"].items() if created_at < window_start]
+        for order_id in expired_ids:
+            del window["orders"][order_id]
+        print(f"Shopify store '{store_id}': {new_orders} new orders, {len(window['orders'])} in window")
+
+    def _refresh_realtime_purchases(self):
+        """
+        Tải đơn mới của mọi store vào cửa sổ 30 phút rồi trả về các dòng sản phẩm trong cửa sổ.
+        Store lỗi giữ nguyên cửa sổ cũ; chỉ raise khi mọi store đều lỗi.
+        """
+        window_start = datetime.now(timezone.utc) - timedelta(minutes=self.REALTIME_WINDOW_MINUTES)
         all_stores_purchase_data = []
-        
-        for store_creds in _self.stores_config:
-            store_id = store_creds.get("store_id", "unknown_store")
-            try:
-                base_url = f"https://{store_creds['store_url']}/admin/api/{store_creds['api_version']}/orders.json"
-                headers = {"X-Shopify-Access-Token": store_creds['access_token']}
-                
-                thirty_minutes_ago = (datetime.now(timezone.utc) - timedelta(minutes=30)).strftime('%Y-%m-%dT%H:%M:%SZ')
-                params = {"created_at_min": thirty_minutes_ago, "status": "any", "fields": "line_items,total_shipping_price_set,subtotal_price,created_at"}
-                
-                print(f"Fetching Shopify data for store: {store_id}")
-                response = requests.get(base_url, headers=headers, params=params, timeout=10)
-                response.raise_for_status()
-                orders = response.json().get('orders', [])
-                
-                for order in orders:
-                    subtotal = float(order.get('subtotal_price', 0.0))
-                    shipping_fee = float(order.get('total_shipping_price_set', {}).get('shop_money', {}).get('amount', 0.0))
-                    order_created_at = order.get('created_at')
-                    for item in order.get('line_items', []):
-                        item_price = float(item['price'])
-                        item_quantity = item['quantity']
-                        item_total_value = item_price * item_quantity
-                        shipping_allocation = (shipping_fee * (item_total_value / subtotal)) if subtotal > 0 else 0
-                        all_stores_purchase_data.append({
-                            'Product Title': item['title'], 
-                            'Purchases': item_quantity, 
-                            'Revenue': item_total_value + shipping_allocation,
-                            'created_at': order_created_at 
-                        })
-            except Exception as e:
-                print(f"Lỗi khi lấy dữ liệu Realtime từ Shopify store '{store_id}': {e}")
-                continue
-                
+        errors = []
+
+        with self._realtime_lock:
+            # Các store được tải song song, một store chậm không chặn các store khác
+            futures = {
+                store_creds.get("store_id", "unknown_store"): _SHOPIFY_EXECUTOR.submit(self._ingest_realtime_store, store_creds, window_start)
+                for store_creds in self.stores_config
+            }
+            for store_id, future in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    # Giữ nguyên dữ liệu đã có trong cửa sổ, lần poll sau sẽ lấy tiếp từ since_id
+                    print(f"Lỗi khi lấy dữ liệu Realtime từ Shopify store '{store_id}': {e}")
+                    errors.append(e)
+                window = self._realtime_windows.get(store_id, {"orders": {}})
+                for created_at, rows in window["orders"].values():
+                    if created_at >= window_start:
+                        all_stores_purchase_data.extend(rows)
+
+        if futures and len(errors) == len(futures):
+            raise errors[0]
         return pd.DataFrame(all_stores_purchase_data)
 
-    @st.cache_data
-    def fetch_historical_purchases(_self, start_date: str, end_date: str, segment: str):
-        all_stores_purchase_data = []
+    def fetch_realtime_purchases(_self):
+        """
+        Trả về các dòng sản phẩm trong 30 phút gần nhất của mọi store.
+        Mỗi lần refresh chỉ tải các đơn mới (since_id) nên chi phí tỷ lệ với số đơn mới,
+        không phải kích thước cửa sổ. Đi qua cache stale-while-revalidate dùng chung:
+        chỉ một refresh chạy tại một thời điểm và lỗi thì giữ kết quả tốt gần nhất.
+        Khi đã có giá trị thì trả ngay giá trị cũ trong lúc refresh chạy nền; chỉ lần đầu mới chờ.
+        """
+        entry = _self.realtime_cache.get(
+            ("shopify_realtime",), _self._refresh_realtime_purchases,
+            ttl_seconds=_self.realtime_cache_ttl, wait_timeout=0, miss_timeout=30
+        )
+        _self.last_realtime_status = entry._replace(value=None)
+        return entry.value if entry.value is not None else pd.DataFrame()
+
+    def _store_sync_lock(self, store_id: str) -> threading.Lock:
+        with self._store_sync_locks_lock:
+            return self._store_sync_locks.setdefault(store_id, threading.Lock())
+
+    def _sync_store_orders(self, store_creds: dict, start_time: datetime):
+        """
+        Đồng bộ kho cục bộ cho một store: backfill phần trước `synced_from` nếu
+        báo cáo cần xa hơn, sau đó chỉ tải các đơn có updated_at sau watermark.
+        Các lần gọi cho cùng store chạy lần lượt; lần đến sau đọc lại trạng thái
+        nên thường bỏ qua luôn vì store vừa được đồng bộ.
+        """
+        store_id = store_creds.get("store_id", "unknown_store")
+        with self._store_sync_lock(store_id):
+            self._sync_store_orders_locked(store_id, store_creds, start_time)
+
+    def _sync_store_orders_locked(self, store_id: str, store_creds: dict, start_time: datetime):
+        now_monotonic = time.monotonic()
+        state = self.order_store.get_sync_state(store_id)
+        needs_backfill = state is None or _parse_shopify_datetime(state["synced_from"]) > start_time
+        last_sync = self._last_history_sync.get(store_id)
+        if not needs_backfill and last_sync is not None and now_monotonic - last_sync < self.HISTORY_SYNC_INTERVAL_SECONDS:
+            return
+
+        base_url = f"https://{store_creds['store_url']}/admin/api/{store_creds['api_version']}/orders.json"
+        fields = "id,line_items,subtotal_price,total_shipping_price_set,created_at,updated_at"
+        sync_started_at = datetime.now(timezone.utc)
+
+        def ingest(params):
+            for orders in self.transport.iter_order_pages(store_creds, base_url, params, timeout=15):
+                self.order_store.upsert_orders(store_id, [
+                    (order['id'], _parse_shopify_datetime(order['created_at']), _allocate_line_items(order))
+                    for order in orders
+                ])
+
+        if needs_backfill:
+            print(f"Backfilling historical Shopify orders for store: {store_id}")
+            params = {"status": "any", "created_at_min": start_time.isoformat(), "limit": 250, "fields": fields}
+            if state is not None:
+                params["created_at_max"] = state["synced_from"]
+            ingest(params)
+        if state is not None:
+            # Đơn mới hoặc đơn cũ vừa được sửa (hoàn tiền, đổi line item...) kể từ lần đồng bộ trước
+            print(f"Syncing updated Shopify orders for store: {store_id}")
+            ingest({"status": "any", "updated_at_min": state["updated_at_watermark"], "limit": 250, "fields": fields})
+
+        synced_from = start_time if needs_backfill else _parse_shopify_datetime(state["synced_from"])
+        self.order_store.set_sync_state(store_id, synced_from, sync_started_at)
+        self._last_history_sync[store_id] = now_monotonic
+
+    def fetch_historical_purchases(_self, start_date: str, end_date: str):
+        """Số lượng mua và doanh thu theo (Page Title, Date) trong khoảng ngày, tổng hợp từ kho cục bộ."""
         tz = pytz.timezone('Asia/Ho_Chi_Minh')
         start_dt_obj = datetime.strptime(start_date, "%Y-%m-%d")
         end_dt_obj = datetime.strptime(end_date, "%Y-%m-%d")
         start_time_aware = tz.localize(start_dt_obj)
         end_time_aware = tz.localize(end_dt_obj + timedelta(days=1))
-        
-        for store_creds in _self.stores_config:
-            store_id = store_creds.get("store_id", "unknown_store")
+
+        futures = {
+            store_creds.get("store_id", "unknown_store"): _SHOPIFY_EXECUTOR.submit(_self._sync_store_orders, store_creds, start_time_aware)
+            for store_creds in _self.stores_config
+        }
+        for store_id, future in futures.items():
             try:
-                base_url = f"https://{store_creds['store_url']}/admin/api/{store_creds['api_version']}/orders.json"
-                headers = {"X-Shopify-Access-Token": store_creds['access_token']}
-                
-                url = base_url
-                params = {
-                    "status": "any", 
-                    "created_at_min": start_time_aware.isoformat(), 
-                    "created_at_max": end_time_aware.isoformat(), 
-                    "limit": 250, 
-                    "fields": "id,line_items,subtotal_price,total_shipping_price_set,created_at"
-                }
-                
-                print(f"Fetching historical Shopify data for store: {store_id}")
-                while url:
-                    response = requests.get(url, headers=headers, params=params, timeout=15)
-                    response.raise_for_status()
-                    data = response.json()
-                    orders = data.get('orders', [])
-                    for order in orders:
-                        subtotal = float(order.get('subtotal_price', 0.0))
-                        shipping_fee = float(order.get('total_shipping_price_set', {}).get('shop_money', {}).get('amount', 0.0))
-                        created_at_utc = datetime.fromisoformat(order['created_at'].replace('Z', '+00:00'))
-                        created_at_local = created_at_utc.astimezone(tz)
-                        for item in order.get('line_items', []):
-                            item_price = float(item.get('price', 0.0))
-                            item_quantity = int(item.get('quantity', 0))
-                            item_total_value = item_price * item_quantity
-                            shipping_allocation = (shipping_fee * (item_total_value / subtotal)) if subtotal > 0 else 0
-                            item_data = {'Page Title': item['title'], 'Purchases': item_quantity, 'Revenue': item_total_value + shipping_allocation}
-                            if segment == 'By Day':
-                                item_data['Date'] = created_at_local.strftime('%Y-%m-%d')
-                            elif segment == 'By Week':
-                                item_data['Week'] = created_at_local.strftime('%Y-%U')
-                            all_stores_purchase_data.append(item_data)
-                    
-                    url = None
-                    if 'Link' in response.headers:
-                        links = requests.utils.parse_header_links(response.headers['Link'])
-                        for link in links:
-                            if link.get('rel') == 'next':
-                                url = link.get('url')
-                                params = None
-                                break
+                future.result()
             except Exception as e:
                 st.error(f"Lỗi khi lấy dữ liệu Lịch sử từ Shopify store '{store_id}': {e}")
-                continue
 
-        if not all_stores_purchase_data: return pd.DataFrame()
-        
-        purchases_df = pd.DataFrame(all_stores_purchase_data)
-        group_by_cols = ['Page Title']
-        if segment == 'By Day': group_by_cols.append('Date')
-        elif segment == 'By Week': group_by_cols.append('Week')
-        
-        return purchases_df.groupby(group_by_cols).agg({'Purchases': 'sum', 'Revenue': 'sum'}).reset_index()
+        line_items_df = _self.order_store.load_line_items(start_time_aware, end_time_aware)
+        if line_items_df.empty: return pd.DataFrame()
+
+        purchases_df = pd.DataFrame({
+            'Page Title': line_items_df['title'],
+            'Date': pd.to_datetime(line_items_df['created_at'], utc=True).dt.tz_convert(tz).dt.strftime('%Y-%m-%d'),
+            'Purchases': line_items_df['quantity'],
+            'Revenue': line_items_df['revenue']
+        })
+        return purchases_df.groupby(['Page Title', 'Date']).agg({'Purchases': 'sum', 'Revenue': 'sum'}).reset_index()
+
+@st.cache_resource
+def get_ga_service():
+    """
+    GoogleAnalyticsService dùng chung cho mọi session và poller; không tạo lại theo từng rerun.
+    """
+    return GoogleAnalyticsService(get_config())
+
+@st.cache_resource
+def get_shopify_service():
+    """
+    ShopifyService dùng chung (cửa sổ realtime, kho đơn hàng, transport) cho mọi session và poller.
+    """
+    return ShopifyService(get_config())
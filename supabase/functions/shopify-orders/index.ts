@@ -25,22 +25,41 @@ async function verifyHmac(rawBody: string, hmacHeader: string | null, secret: st
   return base64Signature === hmacHeader;
 }
 
-// Bảng map tên sản phẩm sang biểu tượng (tạm thời, bạn có thể mở rộng sau)
+// Bảng map tên sản phẩm sang biểu tượng, giữ đồng bộ với
+// "product_to_symbol_mapping" trong marketer_mapping.json (dashboard dùng bảng đó)
 const PRODUCT_SYMBOL_MAPPING: { [key: string]: string } = {
   "128 Hz Healing Instrument": "🌱",
   "Hidden Camera Detector": "📹",
+  "Simulated Awesome Product": "🧪",
   "Resistance Breathing Necklace": "🌿"
 };
 
+// Chuẩn hoá keyword về chữ thường một lần khi function khởi động
+const PRODUCT_SYMBOL_INDEX: [string, string][] = Object.entries(PRODUCT_SYMBOL_MAPPING)
+  .map(([keyword, symbol]) => [keyword.toLowerCase(), symbol]);
+
 function getProductSymbol(productTitle: string): string {
-  for (const keyword in PRODUCT_SYMBOL_MAPPING) {
-    if (productTitle.toLowerCase().includes(keyword.toLowerCase())) {
-      return PRODUCT_SYMBOL_MAPPING[keyword];
+  const normalizedTitle = productTitle.toLowerCase();
+  for (const [keyword, symbol] of PRODUCT_SYMBOL_INDEX) {
+    if (normalizedTitle.includes(keyword)) {
+      return symbol;
     }
   }
   return "🛒"; // Biểu tượng mặc định
 }
 
+// Tách đơn thành các dòng sản phẩm, phân bổ phí ship theo tỷ lệ giá trị;
+// giữ đồng bộ với _allocate_line_items trong services.py (dashboard poll Shopify theo cách đó)
+function allocateLineItems(order: any, subtotal: number) {
+  const shippingFee = parseFloat(order.total_shipping_price_set?.shop_money?.amount || "0.0");
+  return (order.line_items ?? []).map((item: any) => {
+    const quantity = parseInt(item.quantity ?? 0, 10);
+    const itemTotalValue = parseFloat(item.price || "0.0") * quantity;
+    const shippingAllocation = subtotal > 0 ? shippingFee * (itemTotalValue / subtotal) : 0;
+    return { title: item.title, quantity, revenue: itemTotalValue + shippingAllocation };
+  });
+}
+
 // Hàm chính xử lý request đến
 Deno.serve(async (req) => {
   const url = new URL(req.url);
@@ -87,6 +106,7 @@ Deno.serve(async (req) => {
     const subtotal = parseFloat(order.subtotal_price || "0.0");
     const productTitle = order.line_items?.[0]?.title ?? "Shopify Order";
     const productSymbol = getProductSymbol(productTitle);
+    const lineItems = allocateLineItems(order, subtotal);
     
     // Khi insert, thêm cả store_id, store_name và product_symbol
     const { error: insertError } = await supabase.from("sales_events").insert({
@@ -96,7 +116,8 @@ Deno.serve(async (req) => {
       created_at: createdAt,
       store_id: storeId, // <-- Dữ liệu mới
       store_name: storeName, // <-- Dữ liệu mới
-      product_symbol: productSymbol // <-- Dữ liệu mới
+      product_symbol: productSymbol, // <-- Dữ liệu mới
+      line_items: lineItems
     });
 
     if (insertError) {
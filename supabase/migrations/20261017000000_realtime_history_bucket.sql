@@ -0,0 +1,20 @@
+-- Mỗi bucket (1 phút) của realtime_history chỉ giữ đúng một snapshot.
+-- Dashboard ghi bằng upsert ... on conflict (bucket) do nothing.
+alter table public.realtime_history
+  add column if not exists bucket timestamptz;
+
+update public.realtime_history
+  set bucket = date_trunc('minute', "timestamp")
+  where bucket is null;
+
+-- Giữ lại snapshot đầu tiên của mỗi bucket, bỏ các bản ghi trùng do nhiều session cùng ghi
+delete from public.realtime_history a
+  using public.realtime_history b
+  where a.bucket = b.bucket
+    and a.ctid > b.ctid;
+
+alter table public.realtime_history
+  alter column bucket set not null;
+
+create unique index if not exists realtime_history_bucket_key
+  on public.realtime_history (bucket);
@@ -0,0 +1,29 @@
+-- Lịch sử active users dạng chuẩn hoá: mỗi (bucket, marketer) một dòng.
+create table if not exists public.realtime_history_points (
+  bucket timestamptz not null,
+  marketer text not null,
+  active_users integer not null,
+  primary key (bucket, marketer)
+);
+
+-- Chuyển dữ liệu cũ từ snapshot_data (JSON) sang bảng mới
+insert into public.realtime_history_points (bucket, marketer, active_users)
+select h.bucket, s.key, (s.value)::integer
+from public.realtime_history h
+cross join lateral jsonb_each_text(h.snapshot_data::jsonb) as s(key, value)
+on conflict (bucket, marketer) do nothing;
+
+-- Trả về các điểm mới hơn `since` dưới dạng mảng theo cột (một dòng duy nhất),
+-- nên không bị giới hạn số dòng của PostgREST cắt cụt khi cửa sổ 24h.
+create or replace function public.get_realtime_history_columns(since timestamptz)
+returns table (buckets timestamptz[], marketers text[], active_users integer[])
+language sql
+stable
+as $$
+  select
+    coalesce(array_agg(p.bucket order by p.bucket, p.marketer), '{}'),
+    coalesce(array_agg(p.marketer order by p.bucket, p.marketer), '{}'),
+    coalesce(array_agg(p.active_users order by p.bucket, p.marketer), '{}')
+  from public.realtime_history_points p
+  where p.bucket > since;
+$$;
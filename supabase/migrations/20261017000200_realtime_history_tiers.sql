@@ -0,0 +1,126 @@
+-- Các tầng lịch sử đã gộp: 5 phút và 1 giờ, lưu lâu hơn dữ liệu thô.
+create table if not exists public.realtime_history_5m (
+  bucket timestamptz not null,
+  marketer text not null,
+  active_users integer not null,
+  peak_active_users integer not null,
+  primary key (bucket, marketer)
+);
+
+create table if not exists public.realtime_history_1h (
+  bucket timestamptz not null,
+  marketer text not null,
+  active_users integer not null,
+  peak_active_users integer not null,
+  primary key (bucket, marketer)
+);
+
+-- Gộp lần đầu toàn bộ dữ liệu thô đang có
+insert into public.realtime_history_5m (bucket, marketer, active_users, peak_active_users)
+select date_bin(interval '5 minutes', bucket, timestamptz '2000-01-01'), marketer,
+       round(avg(active_users))::integer, max(active_users)
+from public.realtime_history_points
+group by 1, 2
+on conflict (bucket, marketer) do nothing;
+
+insert into public.realtime_history_1h (bucket, marketer, active_users, peak_active_users)
+select date_trunc('hour', bucket), marketer, round(avg(active_users))::integer, max(peak_active_users)
+from public.realtime_history_5m
+group by 1, 2
+on conflict (bucket, marketer) do nothing;
+
+-- Gộp các bucket gần đây (kể cả bucket đang diễn ra) lên tầng 5 phút và 1 giờ,
+-- sau đó xoá dữ liệu hết hạn của từng tầng, mỗi tầng tối đa `batch_size` dòng mỗi lần chạy.
+create or replace function public.compact_realtime_history(
+  raw_retention interval default interval '26 hours',
+  five_minute_retention interval default interval '14 days',
+  hourly_retention interval default interval '180 days',
+  batch_size integer default 5000
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+  rolled_5m integer;
+  rolled_1h integer;
+  deleted_raw integer;
+  deleted_5m integer;
+  deleted_1h integer;
+begin
+  insert into public.realtime_history_5m (bucket, marketer, active_users, peak_active_users)
+  select date_bin(interval '5 minutes', p.bucket, timestamptz '2000-01-01'), p.marketer,
+         round(avg(p.active_users))::integer, max(p.active_users)
+  from public.realtime_history_points p
+  where p.bucket >= date_bin(interval '5 minutes', now() - interval '1 hour', timestamptz '2000-01-01')
+  group by 1, 2
+  on conflict (bucket, marketer) do update
+    set active_users = excluded.active_users, peak_active_users = excluded.peak_active_users;
+  get diagnostics rolled_5m = row_count;
+
+  insert into public.realtime_history_1h (bucket, marketer, active_users, peak_active_users)
+  select date_trunc('hour', f.bucket), f.marketer, round(avg(f.active_users))::integer, max(f.peak_active_users)
+  from public.realtime_history_5m f
+  where f.bucket >= date_trunc('hour', now() - interval '2 hours')
+  group by 1, 2
+  on conflict (bucket, marketer) do update
+    set active_users = excluded.active_users, peak_active_users = excluded.peak_active_users;
+  get diagnostics rolled_1h = row_count;
+
+  delete from public.realtime_history_points
+  where ctid = any(array(
+    select ctid from public.realtime_history_points where bucket < now() - raw_retention limit batch_size
+  ));
+  get diagnostics deleted_raw = row_count;
+
+  delete from public.realtime_history_5m
+  where ctid = any(array(
+    select ctid from public.realtime_history_5m where bucket < now() - five_minute_retention limit batch_size
+  ));
+  get diagnostics deleted_5m = row_count;
+
+  delete from public.realtime_history_1h
+  where ctid = any(array(
+    select ctid from public.realtime_history_1h where bucket < now() - hourly_retention limit batch_size
+  ));
+  get diagnostics deleted_1h = row_count;
+
+  return jsonb_build_object(
+    'rolled_5m', rolled_5m, 'rolled_1h', rolled_1h,
+    'deleted_raw', deleted_raw, 'deleted_5m', deleted_5m, 'deleted_1h', deleted_1h
+  );
+end;
+$$;
+
+-- Đọc theo tầng: thay hàm một tham số bằng phiên bản có tham số `tier`
+drop function if exists public.get_realtime_history_columns(timestamptz);
+
+create or replace function public.get_realtime_history_columns(since timestamptz, tier text default 'raw')
+returns table (buckets timestamptz[], marketers text[], active_users integer[])
+language plpgsql
+stable
+as $$
+begin
+  if tier = '5m' then
+    return query
+      select coalesce(array_agg(t.bucket order by t.bucket, t.marketer), '{}'),
+             coalesce(array_agg(t.marketer order by t.bucket, t.marketer), '{}'),
+             coalesce(array_agg(t.active_users order by t.bucket, t.marketer), '{}')
+      from public.realtime_history_5m t
+      where t.bucket > since;
+  elsif tier = '1h' then
+    return query
+      select coalesce(array_agg(t.bucket order by t.bucket, t.marketer), '{}'),
+             coalesce(array_agg(t.marketer order by t.bucket, t.marketer), '{}'),
+             coalesce(array_agg(t.active_users order by t.bucket, t.marketer), '{}')
+      from public.realtime_history_1h t
+      where t.bucket > since;
+  else
+    return query
+      select coalesce(array_agg(t.bucket order by t.bucket, t.marketer), '{}'),
+             coalesce(array_agg(t.marketer order by t.bucket, t.marketer), '{}'),
+             coalesce(array_agg(t.active_users order by t.bucket, t.marketer), '{}')
+      from public.realtime_history_points t
+      where t.bucket > since;
+  end if;
+end;
+$$;
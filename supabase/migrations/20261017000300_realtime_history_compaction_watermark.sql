@@ -0,0 +1,114 @@
+-- Watermark compaction cho từng tầng: bucket đầu tiên của tầng đích có thể chưa đầy đủ.
+-- Mỗi lần chạy gộp mọi dữ liệu nguồn từ watermark trở đi (không chỉ 1-2 giờ gần nhất), nên dù
+-- không có poller nào chạy trong nhiều giờ, lần chạy sau vẫn gộp đủ trước khi dữ liệu thô hết hạn.
+create table if not exists public.realtime_history_compaction_state (
+  tier text primary key,
+  watermark timestamptz not null
+);
+
+-- Watermark ban đầu: bucket đầy đủ đầu tiên còn dữ liệu nguồn, để lần chạy đầu gộp lại toàn bộ
+-- (lấp các lỗ do phiên bản trước chỉ nhìn lại 1-2 giờ).
+insert into public.realtime_history_compaction_state (tier, watermark)
+values
+  ('5m', coalesce(
+    (select date_bin(interval '5 minutes', min(bucket), timestamptz '2000-01-01') + interval '5 minutes' from public.realtime_history_points),
+    date_bin(interval '5 minutes', now(), timestamptz '2000-01-01'))),
+  ('1h', coalesce(
+    (select date_trunc('hour', min(bucket)) + interval '1 hour' from public.realtime_history_5m),
+    date_trunc('hour', now())))
+on conflict (tier) do nothing;
+
+create or replace function public.compact_realtime_history(
+  raw_retention interval default interval '26 hours',
+  five_minute_retention interval default interval '14 days',
+  hourly_retention interval default interval '180 days',
+  batch_size integer default 5000
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+  -- Gộp lại thêm một ít trước watermark để các điểm ghi trễ (hàng đợi ghi đang thử lại) không bị bỏ sót
+  late_write_grace constant interval := interval '10 minutes';
+  watermark_5m timestamptz;
+  watermark_1h timestamptz;
+  latest_source timestamptz;
+  raw_cutoff timestamptz;
+  five_minute_cutoff timestamptz;
+  rolled_5m integer;
+  rolled_1h integer;
+  deleted_raw integer;
+  deleted_5m integer;
+  deleted_1h integer;
+begin
+  -- Thiếu trạng thái thì gộp lại từ đầu; không bao giờ để watermark NULL (least() bỏ qua NULL
+  -- nên cutoff xoá sẽ không còn bị watermark chặn)
+  insert into public.realtime_history_compaction_state (tier, watermark)
+  values ('5m', '-infinity'), ('1h', '-infinity')
+  on conflict (tier) do nothing;
+
+  -- Khoá trạng thái: nhiều replica gọi compaction cùng lúc sẽ chạy lần lượt
+  select watermark into watermark_5m from public.realtime_history_compaction_state where tier = '5m' for update;
+  select watermark into watermark_1h from public.realtime_history_compaction_state where tier = '1h' for update;
+
+  insert into public.realtime_history_5m (bucket, marketer, active_users, peak_active_users)
+  select date_bin(interval '5 minutes', p.bucket, timestamptz '2000-01-01'), p.marketer,
+         round(avg(p.active_users))::integer, max(p.active_users)
+  from public.realtime_history_points p
+  where p.bucket >= watermark_5m - late_write_grace
+  group by 1, 2
+  on conflict (bucket, marketer) do update
+    set active_users = excluded.active_users, peak_active_users = excluded.peak_active_users;
+  get diagnostics rolled_5m = row_count;
+
+  -- Bucket 5 phút mới nhất có thể vẫn đang nhận điểm nên watermark dừng ở đó
+  select date_bin(interval '5 minutes', max(bucket), timestamptz '2000-01-01') into latest_source
+  from public.realtime_history_points where bucket >= watermark_5m - late_write_grace;
+  watermark_5m := greatest(watermark_5m, coalesce(latest_source, watermark_5m));
+
+  insert into public.realtime_history_1h (bucket, marketer, active_users, peak_active_users)
+  select date_trunc('hour', f.bucket), f.marketer, round(avg(f.active_users))::integer, max(f.peak_active_users)
+  from public.realtime_history_5m f
+  where f.bucket >= date_trunc('hour', watermark_1h - late_write_grace)
+  group by 1, 2
+  on conflict (bucket, marketer) do update
+    set active_users = excluded.active_users, peak_active_users = excluded.peak_active_users;
+  get diagnostics rolled_1h = row_count;
+
+  select date_trunc('hour', max(bucket)) into latest_source
+  from public.realtime_history_5m where bucket >= date_trunc('hour', watermark_1h - late_write_grace);
+  watermark_1h := greatest(watermark_1h, coalesce(latest_source, watermark_1h));
+
+  update public.realtime_history_compaction_state set watermark = watermark_5m where tier = '5m';
+  update public.realtime_history_compaction_state set watermark = watermark_1h where tier = '1h';
+
+  -- Chỉ xoá dữ liệu đã được gộp lên tầng trên (dưới watermark) và cắt đúng ranh giới bucket
+  -- của tầng trên, để không bucket nào bị gộp lại từ dữ liệu nguồn chỉ còn một phần.
+  raw_cutoff := least(date_bin(interval '5 minutes', now() - raw_retention, timestamptz '2000-01-01'), watermark_5m - late_write_grace);
+  five_minute_cutoff := least(date_trunc('hour', now() - five_minute_retention), date_trunc('hour', watermark_1h - late_write_grace));
+
+  delete from public.realtime_history_points
+  where ctid = any(array(
+    select ctid from public.realtime_history_points where bucket < raw_cutoff limit batch_size
+  ));
+  get diagnostics deleted_raw = row_count;
+
+  delete from public.realtime_history_5m
+  where ctid = any(array(
+    select ctid from public.realtime_history_5m where bucket < five_minute_cutoff limit batch_size
+  ));
+  get diagnostics deleted_5m = row_count;
+
+  delete from public.realtime_history_1h
+  where ctid = any(array(
+    select ctid from public.realtime_history_1h where bucket < now() - hourly_retention limit batch_size
+  ));
+  get diagnostics deleted_1h = row_count;
+
+  return jsonb_build_object(
+    'rolled_5m', rolled_5m, 'rolled_1h', rolled_1h,
+    'deleted_raw', deleted_raw, 'deleted_5m', deleted_5m, 'deleted_1h', deleted_1h,
+    'watermark_5m', watermark_5m, 'watermark_1h', watermark_1h
+  );
+end;
+$$;
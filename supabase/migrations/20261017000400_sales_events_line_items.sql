@@ -0,0 +1,4 @@
+-- Các dòng sản phẩm của đơn (title, quantity, revenue đã phân bổ phí ship), để subscriber phía
+-- server tính purchase/revenue theo từng line item giống như khi poll Shopify REST.
+-- Dòng cũ để NULL: subscriber tính mỗi đơn như vậy là 1 purchase = subtotal.
+alter table public.sales_events add column if not exists line_items jsonb;
@@ -0,0 +1,7 @@
+# FILE: tests/conftest.py
+
+import os
+import sys
+
+# Các module của app nằm ở thư mục gốc repo (chạy bằng `streamlit run main.py`), không phải package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
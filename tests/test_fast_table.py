@@ -0,0 +1,34 @@
+# FILE: tests/test_fast_table.py
+
+from streamlit.testing.v1 import AppTest
+
+def fast_table_app():
+    import pandas as pd
+    import streamlit as st
+    from interface import render_fast_table
+    top_n = st.session_state.get("orders_top_n_override")
+    if top_n is not None:
+        st.session_state["orders_top_n"] = top_n
+    render_fast_table(pd.DataFrame({"Page Title": [f"Page {i}" for i in range(120)], "Sessions": range(120)}), key="orders", page_size=10)
+
+def run_app(**session_state):
+    app = AppTest.from_function(fast_table_app, default_timeout=30)
+    for name, value in session_state.items():
+        app.session_state[name] = value
+    return app.run()
+
+def test_paging_does_not_trigger_widget_value_warning():
+    app = run_app()
+    assert app.number_input(key="orders_page").value == 1
+    app.number_input(key="orders_page").set_value(3).run()
+    assert app.caption[0].value.startswith("Rows 21–30 of")
+    assert not app.warning and not app.exception
+
+def test_page_is_clamped_when_top_n_shrinks():
+    app = run_app()
+    app.number_input(key="orders_page").set_value(8).run()
+    app.session_state["orders_top_n_override"] = 50
+    app.run()
+    assert app.number_input(key="orders_page").value == 5
+    assert app.caption[0].value.startswith("Rows 41–50 of 50")
+    assert not app.warning and not app.exception
@@ -0,0 +1,39 @@
+# FILE: tests/test_ga_cache.py
+
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+import pytest
+from ga_cache import GADailyReportCache
+
+OPEN_DAY_TTL = 300
+FINALIZE_LAG = 48 * 3600
+DAY = "2026-10-15"
+# 2026-10-15 kết thúc lúc 07:00 UTC ngày 16 theo America/Los_Angeles (PDT, UTC-7)
+DAY_END = datetime(2026, 10, 16, 7, 0, tzinfo=timezone.utc)
+
+@pytest.fixture
+def cache(tmp_path):
+    return GADailyReportCache(str(tmp_path / "ga_daily_pages.sqlite"), OPEN_DAY_TTL, FINALIZE_LAG)
+
+def fetch(cache, fetched_at):
+    rows = pd.DataFrame([{"Page Title": "ABC Shirt", "Date": DAY, "Sessions": 3, "Users": 2}])
+    cache.replace_partitions("p1", [DAY], rows, fetched_at)
+
+def test_missing_day_is_stale(cache):
+    assert cache.stale_dates("p1", [DAY], {DAY: DAY_END}, DAY_END) == [DAY]
+
+def test_day_fetched_just_after_midnight_is_not_final(cache):
+    fetch(cache, DAY_END + timedelta(minutes=1))
+    assert cache.stale_dates("p1", [DAY], {DAY: DAY_END}, DAY_END + timedelta(minutes=3)) == []
+    # GA còn xử lý dữ liệu: sau TTL phải lấy lại, kể cả khi ngày đã kết thúc
+    assert cache.stale_dates("p1", [DAY], {DAY: DAY_END}, DAY_END + timedelta(hours=30)) == [DAY]
+
+def test_day_fetched_after_processing_lag_is_final(cache):
+    fetch(cache, DAY_END + timedelta(seconds=FINALIZE_LAG))
+    assert cache.stale_dates("p1", [DAY], {DAY: DAY_END}, DAY_END + timedelta(days=30)) == []
+
+def test_property_time_zone_is_persisted(cache):
+    assert cache.get_time_zone("p1") is None
+    cache.set_time_zone("p1", "America/Los_Angeles")
+    assert cache.get_time_zone("p1") == "America/Los_Angeles"
+    assert cache.get_time_zone("p2") is None
@@ -0,0 +1,85 @@
+# FILE: tests/test_quota_governor.py
+
+from datetime import datetime, timezone
+import pytest
+from quota_governor import GAQuotaGovernor, REALTIME, HISTORICAL
+
+HOURLY_QUOTA = 5000
+DAILY_QUOTA = 25000
+# Giữa ngày quota (12:00 America/Los_Angeles): phần ngày còn lại không kéo dài chu kỳ poll tối thiểu
+NOW = datetime(2026, 10, 16, 19, 0, tzinfo=timezone.utc).timestamp()
+
+def make_governor(db_path, replica_id="replica-a"):
+    return GAQuotaGovernor(
+        str(db_path), HOURLY_QUOTA, DAILY_QUOTA, min_interval_seconds=60, max_interval_seconds=900,
+        historical_reserve_ratio=0.2, realtime_tokens_estimate=15, historical_tokens_estimate=50,
+        quota_day_timezone="America/Los_Angeles", replica_id=replica_id
+    )
+
+def quota(consumed, hour_remaining, day_remaining=20000):
+    return {
+        "tokens_per_hour": {"consumed": consumed, "remaining": hour_remaining},
+        "tokens_per_day": {"consumed": consumed, "remaining": day_remaining}
+    }
+
+@pytest.fixture
+def db_path(tmp_path):
+    return tmp_path / "ga_quota.sqlite"
+
+def test_unused_property_polls_at_minimum_interval(db_path):
+    governor = make_governor(db_path)
+    assert governor.poll_interval("p1", NOW) == 60
+    assert governor.allow_historical("p1", NOW) == (True, "")
+
+def test_interval_stretches_to_fit_hourly_budget(db_path):
+    governor = make_governor(db_path)
+    now = NOW
+    governor.record("p1", REALTIME, quota(100, 1500), observed_at=now - 10)
+    # Ngân sách realtime = 1500 - 20% * 5000 = 500 token; mỗi lần poll tốn 100 => 5 lần/giờ
+    assert governor.poll_interval("p1", now) == 720
+
+def test_properties_are_governed_independently(db_path):
+    governor = make_governor(db_path)
+    now = NOW
+    governor.record("p1", REALTIME, quota(100, 1500), observed_at=now - 10)
+    governor.record("p2", REALTIME, quota(10, 4900), observed_at=now - 10)
+    assert governor.poll_interval("p1", now) == 720
+    assert governor.poll_interval("p2", now) == 60
+
+def test_replicas_share_the_ledger_and_split_the_budget(db_path):
+    replica_a = make_governor(db_path, "replica-a")
+    replica_b = make_governor(db_path, "replica-b")
+    now = NOW
+    replica_a.record("p1", REALTIME, quota(50, 2000), observed_at=now - 20)
+    single_replica_interval = replica_a.poll_interval("p1", now)
+    replica_b.record("p1", REALTIME, quota(50, 1950), observed_at=now - 10)
+    # Replica A thấy replica B đang poll cùng property và giãn chu kỳ tương ứng
+    assert replica_a.forecast("p1", now)["active_replicas"] == 2
+    assert replica_a.poll_interval("p1", now) > single_replica_interval
+    assert replica_a.poll_interval("p1", now) == replica_b.poll_interval("p1", now)
+
+def test_ga_reported_remaining_overrides_local_ledger(db_path):
+    governor = make_governor(db_path)
+    now = NOW
+    # Ledger chỉ thấy 20 token, nhưng GA báo property chỉ còn 1100 (consumer khác đã tiêu)
+    governor.record("p1", REALTIME, quota(20, 1100), observed_at=now - 30)
+    governor.record("p1", REALTIME, {"tokens_per_hour": {"consumed": 20, "remaining": "N/A"}}, observed_at=now - 5)
+    assert governor.forecast("p1", now)["hour_remaining"] == 1080
+
+def test_exhausted_budget_polls_at_maximum_interval(db_path):
+    governor = make_governor(db_path)
+    now = NOW
+    governor.record("p1", REALTIME, quota(20, 900), observed_at=now - 10)
+    assert governor.poll_interval("p1", now) == 900
+
+def test_historical_calls_only_run_in_remaining_headroom(db_path):
+    governor = make_governor(db_path)
+    now = NOW
+    governor.record("p1", HISTORICAL, quota(400, 4000), observed_at=now - 60)
+    governor.record("p1", REALTIME, quota(100, 700), observed_at=now - 10)
+    allowed, reason = governor.allow_historical("p1", now)
+    assert not allowed
+    assert "hourly" in reason
+
+    governor.record("p2", HISTORICAL, quota(40, 4900), observed_at=now - 60)
+    assert governor.allow_historical("p2", now) == (True, "")
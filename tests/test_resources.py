@@ -0,0 +1,28 @@
+# FILE: tests/test_resources.py
+
+import resources
+from resources import ManagedResource, get_resource_status
+
+def names_in_status():
+    status = get_resource_status()
+    return int((status["Resource"] == "test.client").sum()) if not status.empty else 0
+
+def test_closed_resource_leaves_the_registry():
+    closed = []
+    resource = ManagedResource("test.client", lambda: object(), closer=closed.append)
+    resource.get()
+    assert names_in_status() == 1
+    resource.close()
+    assert len(closed) == 1
+    assert names_in_status() == 0
+
+def test_recreated_resource_replaces_the_old_one_by_name():
+    first = ManagedResource("test.client", lambda: "first")
+    second = ManagedResource("test.client", lambda: "second")
+    assert names_in_status() == 1
+    assert resources._RESOURCES["test.client"] is second
+    # Đóng tài nguyên cũ không gỡ tài nguyên mới cùng tên
+    first.close()
+    assert resources._RESOURCES["test.client"] is second
+    second.close()
+    assert names_in_status() == 0
@@ -0,0 +1,194 @@
+# FILE: tests/test_sales_subscriber.py
+
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import pytest
+from websockets.sync.server import serve
+import sales_subscriber
+from poller import RealtimePoller
+from sales_subscriber import SalesEventSubscriber
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+def make_record(order_id, minutes_ago=1, line_items=None, revenue=10.0):
+    created_at = datetime.now(timezone.utc) - timedelta(minutes=minutes_ago)
+    return {
+        "order_id": str(order_id), "store_id": "store-1", "store_name": "Store 1", "product_title": "ABC Shirt",
+        "product_symbol": "🛒", "revenue": revenue, "created_at": created_at.isoformat(), "line_items": line_items
+    }
+
+class FakeSalesEventsTable:
+    """Bảng sales_events giả: hỗ trợ chuỗi select/gte/order/range/execute mà subscriber dùng."""
+    def __init__(self, records):
+        self.records = records
+        self.ranges = []
+        self._filters = {}
+
+    def select(self, columns):
+        self._filters = {}
+        return self
+
+    def gte(self, column, value):
+        self._filters["gte"] = (column, datetime.fromisoformat(value))
+        return self
+
+    def order(self, column, desc=False):
+        return self
+
+    def range(self, start, end):
+        self._filters["range"] = (start, end)
+        self.ranges.append((start, end))
+        return self
+
+    def execute(self):
+        column, since = self._filters["gte"]
+        rows = sorted(
+            (record for record in self.records if datetime.fromisoformat(record[column]) >= since),
+            key=lambda record: record["created_at"]
+        )
+        start, end = self._filters.get("range", (0, len(rows)))
+        return SimpleNamespace(data=rows[start:end + 1])
+
+@pytest.fixture
+def sales_events(monkeypatch):
+    table = FakeSalesEventsTable([])
+    supabase = SimpleNamespace(table=lambda name: table)
+    monkeypatch.setattr(sales_subscriber, "get_config", lambda: SimpleNamespace(supabase=supabase))
+    return table
+
+class FakeRealtimeServer:
+    """Máy chủ Supabase Realtime tối giản (giao thức Phoenix) chạy trên cổng cục bộ."""
+    def __init__(self):
+        self.joins = []
+        self.inserts_on_join = []
+        self.error_after_first_join = False
+        self.connections = []
+        self._server = serve(self._handle, "127.0.0.1", 0)
+        self.url = f"http://127.0.0.1:{self._server.socket.getsockname()[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def _handle(self, ws):
+        self.connections.append(ws)
+        for raw in ws:
+            message = json.loads(raw)
+            if message["event"] != "phx_join":
+                continue
+            self.joins.append(message)
+            ws.send(json.dumps({"topic": message["topic"], "event": "phx_reply", "payload": {"status": "ok", "response": {}}, "ref": message["ref"]}))
+            for record in self.inserts_on_join:
+                ws.send(json.dumps({"topic": message["topic"], "event": "postgres_changes", "payload": {"data": {"type": "INSERT", "record": record}}, "ref": None}))
+            if self.error_after_first_join and len(self.joins) == 1:
+                ws.send(json.dumps({"topic": message["topic"], "event": "phx_error", "payload": {}, "ref": None}))
+
+    def shutdown(self):
+        self._server.shutdown()
+        for ws in self.connections:
+            ws.close()
+
+@pytest.fixture
+def realtime_server():
+    server = FakeRealtimeServer()
+    yield server
+    server.shutdown()
+
+@pytest.fixture
+def subscriber_factory():
+    subscribers = []
+    def factory(url):
+        subscriber = SalesEventSubscriber(url, "anon-key", window_hours=24)
+        subscribers.append(subscriber)
+        return subscriber
+    yield factory
+    for subscriber in subscribers:
+        subscriber.stop()
+
+def test_join_subscribes_to_sales_event_inserts(sales_events, realtime_server, subscriber_factory):
+    subscriber = subscriber_factory(realtime_server.url)
+    subscriber.start()
+    assert wait_until(lambda: subscriber.ready)
+    join = realtime_server.joins[0]
+    assert join["topic"] == SalesEventSubscriber.TOPIC
+    assert join["payload"]["access_token"] == "anon-key"
+    assert join["payload"]["config"]["postgres_changes"] == [{"event": "INSERT", "schema": "public", "table": "sales_events"}]
+
+def test_insert_is_delivered_as_line_items(sales_events, realtime_server, subscriber_factory):
+    realtime_server.inserts_on_join = [make_record(1, line_items=[
+        {"title": "ABC Shirt", "quantity": 2, "revenue": 42.0},
+        {"title": "XYZ Hat", "quantity": 1, "revenue": 9.5}
+    ], revenue=48.0)]
+    subscriber = subscriber_factory(realtime_server.url)
+    subscriber.start()
+    assert wait_until(lambda: subscriber.status()["Events In Window"] == 1)
+    purchases = subscriber.realtime_purchases(30)
+    assert purchases[["Product Title", "Purchases", "Revenue"]].values.tolist() == [["ABC Shirt", 2, 42.0], ["XYZ Hat", 1, 9.5]]
+    assert subscriber.last_event_at is not None
+
+def test_row_without_line_items_counts_as_one_purchase(sales_events, subscriber_factory):
+    subscriber = subscriber_factory("http://127.0.0.1:1")
+    subscriber._add_event(make_record(1, revenue=25.0))
+    purchases = subscriber.realtime_purchases(30)
+    assert purchases[["Product Title", "Purchases", "Revenue"]].values.tolist() == [["ABC Shirt", 1, 25.0]]
+
+def test_backfill_pages_until_short_page(sales_events, subscriber_factory):
+    sales_events.records = [make_record(order_id, minutes_ago=60 - order_id) for order_id in range(5)]
+    subscriber = subscriber_factory("http://127.0.0.1:1")
+    subscriber.BACKFILL_PAGE_SIZE = 2
+    subscriber._backfill()
+    assert sales_events.ranges == [(0, 1), (2, 3), (4, 5)]
+    assert subscriber.status()["Events In Window"] == 5
+    assert subscriber.warm
+
+def test_reconnect_backfills_orders_missed_while_disconnected(sales_events, realtime_server, subscriber_factory):
+    sales_events.records = [make_record(1, minutes_ago=10)]
+    realtime_server.error_after_first_join = True
+    subscriber = subscriber_factory(realtime_server.url)
+    subscriber.start()
+    assert wait_until(lambda: len(realtime_server.joins) == 1)
+    # Đơn đến trong lúc mất kết nối: không có INSERT nào, chỉ nạp bù qua REST mới thấy
+    sales_events.records.append(make_record(2, minutes_ago=1))
+    assert wait_until(lambda: len(realtime_server.joins) == 2 and subscriber.ready)
+    assert subscriber.reconnects == 1
+    assert sorted(subscriber.events_since(1)["order_id"]) == ["1", "2"]
+
+def test_backfill_overlaps_to_catch_late_inserted_orders(sales_events, subscriber_factory):
+    sales_events.records = [make_record(1, minutes_ago=10), make_record(2, minutes_ago=2)]
+    subscriber = subscriber_factory("http://127.0.0.1:1")
+    subscriber._backfill()
+    # Đơn tạo trước đơn cuối đã thấy nhưng được ghi vào sales_events sau khi mất kết nối
+    sales_events.records.append(make_record(3, minutes_ago=5))
+    subscriber._backfill()
+    assert sorted(subscriber.events_since(1)["order_id"]) == ["1", "2", "3"]
+    assert subscriber.status()["Events In Window"] == 3
+
+def make_poller(subscriber, polling_enabled=False):
+    shopify_service = SimpleNamespace(REALTIME_WINDOW_MINUTES=30, fetch_realtime_purchases=lambda: "polled")
+    config = SimpleNamespace(SHOPIFY_REALTIME_POLLING_ENABLED=polling_enabled, POLL_DEADLINE_SECONDS=10)
+    ga_service = SimpleNamespace(quota_governor=None)
+    return RealtimePoller(ga_service, shopify_service, config, classifier=None, sales_subscriber=subscriber)
+
+def test_poller_falls_back_to_polling_until_subscriber_is_ready(sales_events, realtime_server, subscriber_factory):
+    realtime_server.inserts_on_join = [make_record(1)]
+    subscriber = subscriber_factory(realtime_server.url)
+    poller = make_poller(subscriber)
+    assert poller._fetch_purchases() == "polled"
+    subscriber.start()
+    assert wait_until(lambda: subscriber.ready and subscriber.status()["Events In Window"] == 1)
+    assert poller._fetch_purchases()["Purchases"].tolist() == [1]
+    # Mất kết nối thì quay lại poll Shopify cho tới khi kết nối lại
+    realtime_server.shutdown()
+    assert wait_until(lambda: not subscriber.ready)
+    assert poller._fetch_purchases() == "polled"
+
+def test_poller_keeps_polling_when_enabled(sales_events, subscriber_factory):
+    subscriber = subscriber_factory("http://127.0.0.1:1")
+    subscriber.warm = subscriber.connected = True
+    assert make_poller(subscriber, polling_enabled=True)._fetch_purchases() == "polled"
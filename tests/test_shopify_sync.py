@@ -0,0 +1,245 @@
+# FILE: tests/test_shopify_sync.py
+
+import json
+import shutil
+import ssl
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+import pandas as pd
+import pytest
+import services
+from order_store import ShopifyOrderStore
+from services import ShopifyService, ShopifyTransport
+
+# services.py luôn gọi https://{store_url}, nên máy chủ giả chạy TLS với chứng chỉ tự ký
+pytestmark = pytest.mark.skipif(shutil.which("openssl") is None, reason="cần openssl để tạo chứng chỉ tự ký")
+
+def order(order_id, created_at, updated_at=None, line_items=(("ABC Shirt", 1, "20.00"),), shipping="0.00"):
+    items = [{"title": title, "quantity": quantity, "price": price} for title, quantity, price in line_items]
+    return {
+        "id": order_id,
+        "created_at": created_at,
+        "updated_at": updated_at or created_at,
+        "subtotal_price": f"{sum(quantity * float(price) for _, quantity, price in line_items):.2f}",
+        "total_shipping_price_set": {"shop_money": {"amount": shipping}},
+        "line_items": items
+    }
+
+class FakeShopify:
+    """
+    Máy chủ orders.json giả: lọc theo created_at_min/max và updated_at_min, phân trang bằng
+    header Link (page_info) giống Shopify và ghi lại mọi request để kiểm tra.
+    """
+    def __init__(self, cert_path, key_path, page_size=250, delay_seconds=0.0):
+        self.orders = {}
+        self.requests = []
+        self.page_size = page_size
+        self.delay_seconds = delay_seconds
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._cursors = {}
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_path, key_path)
+        self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        self.host = f"127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def put(self, *orders):
+        for item in orders:
+            self.orders[item["id"]] = item
+
+    def _filtered(self, params):
+        def at(value):
+            return datetime.fromisoformat(value.replace("Z", "+00:00"))
+        rows = sorted(self.orders.values(), key=lambda item: item["id"])
+        if "created_at_min" in params:
+            rows = [item for item in rows if at(item["created_at"]) >= at(params["created_at_min"])]
+        if "created_at_max" in params:
+            rows = [item for item in rows if at(item["created_at"]) <= at(params["created_at_max"])]
+        if "updated_at_min" in params:
+            rows = [item for item in rows if at(item["updated_at"]) >= at(params["updated_at_min"])]
+        return rows
+
+    def _handle(self, handler):
+        params = {key: values[0] for key, values in parse_qs(urlparse(handler.path).query).items()}
+        with self._lock:
+            self.requests.append(params)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay_seconds)
+            with self._lock:
+                if "page_info" in params:
+                    rows, offset = self._cursors.pop(params["page_info"])
+                else:
+                    rows, offset = self._filtered(params), 0
+                page = rows[offset:offset + self.page_size]
+                next_link = None
+                if offset + self.page_size < len(rows):
+                    cursor = f"cursor{len(self.requests)}"
+                    self._cursors[cursor] = (rows, offset + self.page_size)
+                    next_link = f'<https://{self.host}/admin/api/2024-01/orders.json?limit={self.page_size}&page_info={cursor}>; rel="next"'
+            body = json.dumps({"orders": page}).encode()
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/json")
+            handler.send_header("Content-Length", str(len(body)))
+            handler.send_header("X-Shopify-Shop-Api-Call-Limit", "1/40")
+            if next_link:
+                handler.send_header("Link", next_link)
+            handler.end_headers()
+            handler.wfile.write(body)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+@pytest.fixture(scope="module")
+def certificate(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("tls")
+    cert_path, key_path = str(directory / "cert.pem"), str(directory / "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+         "-addext", "subjectAltName=IP:127.0.0.1", "-keyout", key_path, "-out", cert_path],
+        check=True, capture_output=True
+    )
+    return cert_path, key_path
+
+@pytest.fixture
+def shopify(certificate):
+    server = FakeShopify(*certificate)
+    yield server
+    server.shutdown()
+
+@pytest.fixture
+def service(shopify, certificate, tmp_path, monkeypatch):
+    store_creds = {"store_id": "store-1", "store_url": shopify.host, "api_version": "2024-01", "access_token": "token"}
+    # requests ưu tiên CA bundle trong biến môi trường hơn session.verify
+    monkeypatch.delenv("REQUESTS_CA_BUNDLE", raising=False)
+    monkeypatch.delenv("CURL_CA_BUNDLE", raising=False)
+    transport = ShopifyTransport()
+    transport._session_for(store_creds).verify = certificate[0]
+    monkeypatch.setattr(services, "get_shopify_transport", lambda: transport)
+    monkeypatch.setattr(services, "get_order_store", lambda: ShopifyOrderStore(str(tmp_path / "orders.sqlite")))
+    monkeypatch.setattr(services, "get_upstream_cache", lambda: None)
+    shopify_service = ShopifyService(SimpleNamespace(shopify_stores_config=[store_creds], REALTIME_CACHE_TTL_SECONDS=30))
+    shopify_service.store_creds = store_creds
+    yield shopify_service
+    transport.close()
+
+START = datetime(2026, 10, 1, tzinfo=timezone.utc)
+END = datetime(2026, 10, 20, tzinfo=timezone.utc)
+
+def stored_orders(service):
+    line_items = service.order_store.load_line_items(START, END)
+    return sorted(zip(line_items["title"], line_items["quantity"], line_items["revenue"]))
+
+def sync(service):
+    # Bỏ qua khoảng nghỉ HISTORY_SYNC_INTERVAL_SECONDS giữa hai lần đồng bộ
+    service._last_history_sync.clear()
+    service._sync_store_orders(service.store_creds, START)
+
+def test_initial_backfill_loads_orders_since_start(shopify, service):
+    shopify.put(
+        order(1, "2026-09-30T23:00:00Z"),
+        order(2, "2026-10-02T10:00:00Z", line_items=(("ABC Shirt", 2, "20.00"), ("XYZ Hat", 1, "10.00")), shipping="5.00")
+    )
+    sync(service)
+    assert shopify.requests[0]["created_at_min"] == START.isoformat()
+    assert "updated_at_min" not in shopify.requests[0]
+    # Phí ship 5.00 phân bổ theo giá trị: 40/50 và 10/50
+    assert stored_orders(service) == [("ABC Shirt", 2, 44.0), ("XYZ Hat", 1, 11.0)]
+    state = service.order_store.get_sync_state("store-1")
+    assert state["synced_from"] == "2026-10-01T00:00:00+00:00"
+
+def test_backfill_follows_link_pagination(shopify, service):
+    shopify.page_size = 2
+    shopify.put(*[order(order_id, f"2026-10-0{order_id}T10:00:00Z") for order_id in range(1, 6)])
+    sync(service)
+    assert len(shopify.requests) == 3
+    # Trang sau chỉ gửi page_info (và limit trong URL), không lặp lại filter
+    assert all(set(params) == {"limit", "page_info"} for params in shopify.requests[1:])
+    assert len(stored_orders(service)) == 5
+
+def test_resync_only_fetches_orders_updated_since_watermark(shopify, service):
+    shopify.put(order(1, "2026-10-02T10:00:00Z"))
+    sync(service)
+    watermark = service.order_store.get_sync_state("store-1")["updated_at_watermark"]
+    shopify.put(order(2, "2026-10-03T10:00:00Z", updated_at=datetime.now(timezone.utc).isoformat(), line_items=(("XYZ Hat", 1, "10.00"),)))
+    shopify.requests.clear()
+    sync(service)
+    assert shopify.requests == [{"status": "any", "updated_at_min": watermark, "limit": "250", "fields": shopify.requests[0]["fields"]}]
+    assert stored_orders(service) == [("ABC Shirt", 1, 20.0), ("XYZ Hat", 1, 10.0)]
+
+def test_edited_order_replaces_its_line_items(shopify, service):
+    shopify.put(order(1, "2026-10-02T10:00:00Z", line_items=(("ABC Shirt", 1, "20.00"), ("XYZ Hat", 2, "10.00"))))
+    sync(service)
+    assert len(stored_orders(service)) == 2
+    # Đơn bị sửa: bỏ một line item, đổi số lượng
+    shopify.put(order(1, "2026-10-02T10:00:00Z", updated_at=datetime.now(timezone.utc).isoformat(), line_items=(("ABC Shirt", 3, "20.00"),)))
+    sync(service)
+    assert stored_orders(service) == [("ABC Shirt", 3, 60.0)]
+
+def test_historical_purchases_aggregate_from_local_store(shopify, service):
+    shopify.put(
+        order(1, "2026-10-02T10:00:00Z", line_items=(("ABC Shirt", 1, "20.00"),)),
+        order(2, "2026-10-02T12:00:00Z", line_items=(("ABC Shirt", 2, "20.00"), ("XYZ Hat", 1, "10.00"))),
+        # 18:00 UTC ngày 2 là ngày 3 theo giờ Việt Nam (UTC+7)
+        order(3, "2026-10-02T18:00:00Z", line_items=(("ABC Shirt", 1, "20.00"),))
+    )
+    result = service.fetch_historical_purchases("2026-10-02", "2026-10-03")
+    expected = pd.DataFrame({
+        "Page Title": ["ABC Shirt", "ABC Shirt", "XYZ Hat"],
+        "Date": ["2026-10-02", "2026-10-03", "2026-10-02"],
+        "Purchases": [3, 1, 1],
+        "Revenue": [60.0, 20.0, 10.0]
+    })
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    # Lần đọc thứ hai trong HISTORY_SYNC_INTERVAL_SECONDS dùng kho cục bộ, không gọi Shopify
+    request_count = len(shopify.requests)
+    service.fetch_historical_purchases("2026-10-02", "2026-10-03")
+    assert len(shopify.requests) == request_count
+
+def test_concurrent_refreshes_sync_a_store_once(shopify, service):
+    shopify.delay_seconds = 0.3
+    shopify.put(order(1, "2026-10-02T10:00:00Z"))
+    threads = [threading.Thread(target=service._sync_store_orders, args=(service.store_creds, START)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert shopify.max_in_flight == 1
+    assert len(shopify.requests) == 1
+    assert stored_orders(service) == [("ABC Shirt", 1, 20.0)]
+
+def test_transport_stats_count_concurrent_requests(shopify, service):
+    transport = services.get_shopify_transport()
+    url = f"https://{shopify.host}/admin/api/2024-01/orders.json"
+    def fetch_pages():
+        for _ in range(10):
+            list(transport.iter_order_pages(service.store_creds, url, {"limit": 250}, timeout=5))
+    threads = [threading.Thread(target=fetch_pages) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = transport.get_stats().set_index("Store").loc["store-1"]
+    assert (stats["Requests"], stats["Pages"], stats["Errors"]) == (40, 40, 0)
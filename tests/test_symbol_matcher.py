@@ -0,0 +1,30 @@
+# FILE: tests/test_symbol_matcher.py
+
+import json
+import random
+from config import SymbolMatcher
+
+def make_matcher(page_title_map):
+    return SymbolMatcher(sorted(page_title_map, key=len, reverse=True), page_title_map)
+
+def linear_find_symbol(symbols, title):
+    # Cách quét tuyến tính trước đây: symbol đầu tiên (dài nhất) có trong tiêu đề
+    return next((symbol for symbol in symbols if symbol in title), "")
+
+def test_overlapping_symbols_prefer_the_longest():
+    matcher = make_matcher({"ab": "MKT1", "bcd": "MKT2"})
+    assert matcher.find_symbol("abcd") == "bcd"
+    assert matcher.find_marketer("abcd") == "MKT2"
+    assert matcher.find_symbol("xab") == "ab"
+    assert matcher.find_symbol("xyz") == ""
+
+def test_matches_linear_scan_on_random_titles():
+    with open("marketer_mapping.json", encoding="utf-8") as f:
+        page_title_map = json.load(f)["page_title_mapping"]
+    page_title_map = {**page_title_map, "ab": "MKTA", "bcd": "MKTB", "cdef": "MKTC"}
+    matcher = make_matcher(page_title_map)
+    pieces = list(page_title_map) + ["a", "b", "c", "d", "e", "f", " Shirt ", " - ", "MKT"]
+    rng = random.Random(7)
+    for _ in range(2000):
+        title = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 6)))
+        assert matcher.find_symbol(title) == linear_find_symbol(matcher.symbols, title), title
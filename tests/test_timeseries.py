@@ -0,0 +1,82 @@
+# FILE: tests/test_timeseries.py
+
+import time
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from timeseries import MarketerSeriesStore, RingBuffer, downsample_minmax
+
+def filled_ring(capacity=5, count=8):
+    ring = RingBuffer(capacity)
+    for i in range(1, count + 1):
+        ring.append(i * 10, i)
+    return ring
+
+def test_ring_buffer_wraps_around_keeping_newest_points():
+    ring = filled_ring()
+    timestamps, values = ring.to_arrays()
+    assert timestamps.tolist() == [40, 50, 60, 70, 80]
+    assert values.tolist() == [4, 5, 6, 7, 8]
+    assert len(ring) == 5
+    assert ring.last_timestamp == 80
+
+def test_ring_buffer_overwrites_same_timestamp_and_ignores_older():
+    ring = filled_ring()
+    ring.append(80, 99)
+    ring.append(50, 0)
+    timestamps, values = ring.to_arrays()
+    assert timestamps.tolist() == [40, 50, 60, 70, 80]
+    assert values.tolist() == [4, 5, 6, 7, 99]
+
+def test_window_slices_across_the_wrap():
+    ring = filled_ring()
+    # Sau khi quay vòng, dữ liệu nằm ở hai đoạn [3:5] = 40, 50 và [0:3] = 60, 70, 80
+    assert ring._start == 3
+    for since, expected in ((None, [40, 50, 60, 70, 80]), (45, [50, 60, 70, 80]), (50, [50, 60, 70, 80]),
+                            (55, [60, 70, 80]), (75, [80]), (1000, [])):
+        timestamps, values = ring.window(since)
+        assert timestamps.tolist() == expected, since
+        assert values.tolist() == [timestamp // 10 for timestamp in expected], since
+
+def test_load_keeps_the_newest_capacity_points():
+    ring = filled_ring()
+    ring.load(np.arange(1, 8, dtype=np.int64), np.arange(101, 108, dtype=np.int64))
+    timestamps, values = ring.to_arrays()
+    assert timestamps.tolist() == [3, 4, 5, 6, 7]
+    assert values.tolist() == [103, 104, 105, 106, 107]
+    ring.append(8, 108)
+    assert ring.to_arrays()[0].tolist() == [4, 5, 6, 7, 8]
+
+def test_live_point_overrides_warm_start_point_in_same_bucket():
+    store = MarketerSeriesStore(max_window_hours=1, bucket_seconds=60)
+    now = int(time.time())
+    now -= now % 60
+    store.record({"A": 7}, datetime.fromtimestamp(now + 10, tz=timezone.utc))
+    history = pd.DataFrame({
+        "timestamp": pd.to_datetime([now - 120, now - 60, now, now - 7200, now - 60], unit="s", utc=True),
+        "Marketer": ["A", "A", "A", "B", "B"],
+        "Active Users": [1, 2, 3, 5, 6]
+    })
+    store.warm_start(history)
+    window = store.get_window(0.5)
+    series = {marketer: group["Active Users"].tolist() for marketer, group in window.groupby("Marketer")}
+    # Bucket `now` của A lấy điểm trực tiếp (7), không phải điểm lịch sử (3)
+    assert series == {"A": [1, 2, 7], "B": [6]}
+    assert store.warm
+    # Điểm B cũ hơn cửa sổ vẫn nằm trong buffer (giới hạn theo số điểm), chỉ bị lọc khi đọc
+    assert store.status()["Points"] == 5
+
+def test_downsample_minmax_keeps_extremes_and_endpoints():
+    timestamps = pd.date_range("2026-10-01", periods=1000, freq="min", tz="UTC")
+    values = np.zeros(1000, dtype=np.int64)
+    values[137], values[642] = 500, -500
+    df = pd.DataFrame({"timestamp": timestamps, "Marketer": "A", "Active Users": values})
+    short = pd.DataFrame({"timestamp": timestamps[:10], "Marketer": "B", "Active Users": np.arange(10)})
+    result = downsample_minmax(pd.concat([df, short], ignore_index=True), "timestamp", "Active Users", "Marketer", 100)
+    series_a = result[result["Marketer"] == "A"]
+    assert len(series_a) <= 102
+    assert {500, -500} <= set(series_a["Active Users"])
+    assert series_a["timestamp"].iloc[0] == timestamps[0] and series_a["timestamp"].iloc[-1] == timestamps[-1]
+    assert series_a["timestamp"].is_monotonic_increasing
+    # Chuỗi ngắn hơn giới hạn được giữ nguyên
+    assert result[result["Marketer"] == "B"]["Active Users"].tolist() == list(range(10))
@@ -0,0 +1,62 @@
+# FILE: tests/test_title_classifier.py
+
+import json
+import threading
+from types import SimpleNamespace
+import pandas as pd
+from attribution import TitleClassifier
+from config import AppConfig, MappingState, ProductSymbolIndex, SymbolMatcher
+
+def make_mappings(version, page_title_map):
+    symbols = sorted(page_title_map, key=len, reverse=True)
+    return MappingState(
+        version=version, page_title_map=page_title_map, landing_page_map={}, product_to_symbol_map={},
+        symbols=symbols, symbol_matcher=SymbolMatcher(symbols, page_title_map), product_symbol_index=ProductSymbolIndex({})
+    )
+
+def make_classifier(mappings):
+    config = SimpleNamespace(mappings=mappings, mapping_version=mappings.version, reload_mappings_if_changed=lambda: False)
+    return TitleClassifier(config), config
+
+def test_new_mapping_version_replaces_cached_results():
+    old = make_mappings(1, {"🌱": "MKT1"})
+    classifier, config = make_classifier(old)
+    assert classifier.classify("Shirt 🌱")[2] == "MKT1"
+    config.mappings = make_mappings(2, {"🌱": "MKT2"})
+    assert classifier.classify("Shirt 🌱")[2] == "MKT2"
+
+def test_result_from_old_snapshot_does_not_enter_new_cache():
+    old = make_mappings(1, {"🌱": "MKT1"})
+    classifier, config = make_classifier(old)
+    config.mappings = make_mappings(2, {"🌱": "MKT2"})
+    classifier.classify("Hat", config.mappings)
+    # Một luồng còn giữ snapshot cũ vẫn nhận kết quả nhất quán với snapshot đó...
+    assert classifier.classify("Shirt 🌱", old)[2] == "MKT1"
+    # ...nhưng kết quả ấy không được cache lại cho version mới
+    assert classifier.classify("Shirt 🌱")[2] == "MKT2"
+
+def test_classify_series_uses_one_snapshot():
+    classifier, config = make_classifier(make_mappings(1, {"🌱": "MKT1", "📹": "MKT2"}))
+    result = classifier.classify_series(pd.Series(["A 🌱", "B 📹", "A 🌱", "C"]))
+    assert result["marketer"].tolist() == ["MKT1", "MKT2", "MKT1", ""]
+
+def test_reload_publishes_a_complete_mapping_state(tmp_path):
+    mapping_path = tmp_path / "marketer_mapping.json"
+    mapping_path.write_text(json.dumps({"page_title_mapping": {"🌱": "MKT1"}}), encoding="utf-8")
+    config = AppConfig.__new__(AppConfig)
+    config.MARKETER_MAPPING_PATH = str(mapping_path)
+    config.mapping_mtime = None
+    config.mappings = None
+    config._mapping_lock = threading.Lock()
+    config._load_marketer_mapping()
+    first = config.mappings
+    assert (first.version, config.page_title_map) == (1, {"🌱": "MKT1"})
+
+    mapping_path.write_text(json.dumps({"page_title_mapping": {"🌱": "MKT2", "📹": "MKT3"}}), encoding="utf-8")
+    config.mapping_mtime = -1
+    assert config.reload_mappings_if_changed()
+    assert config.mapping_version == 2
+    assert config.symbol_matcher.find_marketer("A 📹") == "MKT3"
+    # Snapshot cũ vẫn nguyên vẹn cho luồng đang dùng nó
+    assert first.page_title_map == {"🌱": "MKT1"}
+    assert first.symbol_matcher.find_marketer("A 📹") == ""
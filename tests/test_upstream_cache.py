@@ -0,0 +1,40 @@
+# FILE: tests/test_upstream_cache.py
+
+import threading
+import time
+from cache import CACHE_TAG_REALTIME_GA, StaleWhileRevalidateCache, get_upstream_cache, invalidate_cache_tags
+
+def test_realtime_invalidation_is_scoped_to_one_property():
+    upstream_cache = get_upstream_cache()
+    loaders = {("ga_realtime", property_id): (lambda pid=property_id: f"users:{pid}") for property_id in ("111", "222")}
+    results = upstream_cache.get_many(loaders, ttl_seconds=600)
+    assert [result.value for result in results.values()] == ["users:111", "users:222"]
+
+    invalidate_cache_tags(CACHE_TAG_REALTIME_GA, scope="222")
+    with upstream_cache._lock:
+        expired = {key[1]: entry.expired for key, entry in upstream_cache._entries.items() if key in loaders}
+    assert expired == {"111": False, "222": True}
+
+def test_stale_value_returns_immediately_while_one_refresh_runs():
+    upstream_cache = StaleWhileRevalidateCache()
+    release = threading.Event()
+    calls = []
+    def loader():
+        calls.append(1)
+        if len(calls) > 1:
+            release.wait(5)
+        return len(calls)
+
+    # Chưa có giá trị: chờ request đầu tiên (miss_timeout)
+    assert upstream_cache.get("key", loader, ttl_seconds=0, miss_timeout=5).value == 1
+    started = time.monotonic()
+    results = [upstream_cache.get("key", loader, ttl_seconds=0, wait_timeout=0) for _ in range(3)]
+    assert time.monotonic() - started < 1
+    assert [result.value for result in results] == [1, 1, 1]
+    assert all(result.refreshing for result in results)
+    release.set()
+    # Ba lần đọc cũ chỉ khởi động đúng một refresh nền
+    deadline = time.monotonic() + 5
+    while upstream_cache.get("key", loader, ttl_seconds=600).value != 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(calls) == 2
@@ -0,0 +1,118 @@
+# FILE: tests/test_write_queue.py
+
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+import write_queue
+from write_queue import SupabaseWriteQueue
+
+SETTINGS_MATCH = {"id": 1}
+
+class FakeSupabase:
+    """Client Supabase giả: ghi lại các thao tác đã gửi; `failing` bật/tắt lỗi mạng."""
+    def __init__(self):
+        self.writes = []
+        self.failing = False
+        self.lock = threading.Lock()
+
+    def table(self, name):
+        client = self
+        operations = []
+
+        class Query:
+            def upsert(self, rows, **options):
+                operations.append(("upsert", list(rows), options))
+                return self
+
+            def update(self, values):
+                operations.append(("update", dict(values)))
+                return self
+
+            def eq(self, column, value):
+                operations.append(("eq", column, value))
+                return self
+
+            def execute(self):
+                if client.failing:
+                    raise ConnectionError("503 Service Unavailable")
+                with client.lock:
+                    client.writes.append((name, operations))
+
+        return Query()
+
+    def rpc(self, name, params):
+        client = self
+        return SimpleNamespace(execute=lambda: client.writes.append(("rpc", name, params)))
+
+@pytest.fixture
+def supabase(monkeypatch):
+    client = FakeSupabase()
+    config = SimpleNamespace(supabase=client, record_supabase_result=lambda error=None: None)
+    monkeypatch.setattr(write_queue, "get_config", lambda: config)
+    return client
+
+@pytest.fixture
+def queue():
+    write_queue_ = SupabaseWriteQueue(batch_size=2, linger_seconds=0.05, max_attempts=2, max_backoff_seconds=0.05, max_depth=100)
+    yield write_queue_
+    write_queue_.close(2)
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+def test_writes_are_batched_and_coalesced(supabase, queue):
+    for i in range(3):
+        queue.upsert("realtime_history_points", [{"i": i}], on_conflict="bucket,marketer")
+    queue.update("app_settings", {"a": 1}, SETTINGS_MATCH)
+    queue.update("app_settings", {"b": 2}, SETTINGS_MATCH)
+    assert queue.pending_update("app_settings", SETTINGS_MATCH) == {"a": 1, "b": 2}
+    assert queue.flush(5)
+    upserts = [operations for name, operations in supabase.writes if name == "realtime_history_points"]
+    assert [len(operations[0][1]) for operations in upserts] == [2, 1]
+    assert ("app_settings", [("update", {"a": 1, "b": 2}), ("eq", "id", 1)]) in supabase.writes
+    assert queue.pending_update("app_settings", SETTINGS_MATCH) == {}
+
+def test_failed_settings_update_stays_in_overlay_and_is_retried(supabase, queue):
+    saved = threading.Event()
+    supabase.failing = True
+    queue.update("app_settings", {"time_window_hours": 6}, SETTINGS_MATCH, on_success=saved.set)
+    assert wait_until(lambda: queue.update_failure("app_settings", SETTINGS_MATCH) is not None)
+    failure = queue.update_failure("app_settings", SETTINGS_MATCH)
+    assert failure["failed_attempts"] >= 2
+    assert "503" in failure["error"]
+    # Giá trị admin đã lưu không biến mất trong lúc chờ thử lại
+    assert queue.pending_update("app_settings", SETTINGS_MATCH) == {"time_window_hours": 6}
+    assert not saved.is_set()
+
+    supabase.failing = False
+    assert saved.wait(5)
+    assert queue.update_failure("app_settings", SETTINGS_MATCH) is None
+    assert queue.flush(5)
+    assert queue.pending_update("app_settings", SETTINGS_MATCH) == {}
+    assert queue.status()["Queue Depth"] == 0
+
+def test_newer_update_is_applied_over_failed_one(supabase, queue):
+    supabase.failing = True
+    queue.update("app_settings", {"a": 1, "b": 1}, SETTINGS_MATCH)
+    assert wait_until(lambda: queue.update_failure("app_settings", SETTINGS_MATCH) is not None)
+    queue.update("app_settings", {"b": 2}, SETTINGS_MATCH)
+    assert queue.pending_update("app_settings", SETTINGS_MATCH) == {"a": 1, "b": 2}
+    supabase.failing = False
+    assert queue.flush(5)
+    assert supabase.writes[-1] == ("app_settings", [("update", {"a": 1, "b": 2}), ("eq", "id", 1)])
+
+def test_close_does_not_hang_on_a_failing_update(supabase):
+    queue = SupabaseWriteQueue(batch_size=2, linger_seconds=0.05, max_attempts=2, max_backoff_seconds=0.05, max_depth=100)
+    supabase.failing = True
+    queue.update("app_settings", {"a": 1}, SETTINGS_MATCH)
+    assert wait_until(lambda: queue.update_failure("app_settings", SETTINGS_MATCH) is not None)
+    started = time.monotonic()
+    queue.close(2)
+    assert time.monotonic() - started < 2
+    assert not queue._thread.is_alive()
@@ -0,0 +1,188 @@
+# FILE: timeseries.py
+
+import threading
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+def _minmax_positions(x_values: np.ndarray, y_values: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Vị trí (đã sắp theo thời gian) của các điểm được giữ lại cho một chuỗi:
+    chia trục thời gian thành max_points // 2 bucket đều nhau, mỗi bucket giữ điểm
+    nhỏ nhất và lớn nhất, cộng thêm điểm đầu và cuối chuỗi.
+    """
+    n = len(x_values)
+    bucket_count = max(max_points // 2 - 1, 1)
+    span = x_values[-1] - x_values[0]
+    if span <= 0:
+        bucket_ids = np.zeros(n, dtype=np.int64)
+    else:
+        bucket_ids = np.minimum((x_values - x_values[0]) * bucket_count // span, bucket_count - 1)
+    # Sắp theo (bucket, y): phần tử đầu mỗi nhóm là min, phần tử cuối là max
+    order = np.lexsort((y_values, bucket_ids))
+    sorted_buckets = bucket_ids[order]
+    group_starts = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+    group_ends = np.r_[group_starts[1:], n] - 1
+    return np.unique(np.concatenate([order[group_starts], order[group_ends], [0, n - 1]]))
+
+def downsample_minmax(df: pd.DataFrame, x_col: str, y_col: str, group_col: str, max_points_per_series: int) -> pd.DataFrame:
+    """
+    Giảm số điểm của từng chuỗi (theo `group_col`) xuống khoảng `max_points_per_series`
+    mà vẫn giữ nguyên đỉnh và đáy. Chuỗi đã đủ ngắn được giữ nguyên.
+    """
+    if df.empty or max_points_per_series <= 0:
+        return df
+    parts = []
+    for _, series in df.groupby(group_col, sort=False):
+        if len(series) <= max_points_per_series:
+            parts.append(series)
+            continue
+        series = series.sort_values(x_col)
+        x_values = series[x_col].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        positions = _minmax_positions(x_values, series[y_col].to_numpy(), max_points_per_series)
+        parts.append(series.iloc[positions])
+    return pd.concat(parts, ignore_index=True)
+
+class RingBuffer:
+    """
+    Chuỗi (timestamp, value) kích thước cố định trên hai mảng numpy, timestamp là
+    epoch giây tăng dần. Điểm cùng timestamp với điểm cuối sẽ ghi đè điểm cuối; điểm
+    cũ hơn điểm cuối bị bỏ qua. Khi đầy, điểm mới đè lên điểm cũ nhất.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._timestamps = np.zeros(capacity, dtype=np.int64)
+        self._values = np.zeros(capacity, dtype=np.int64)
+        self._start = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def last_timestamp(self):
+        return int(self._timestamps[(self._start + self._size - 1) % self.capacity]) if self._size else None
+
+    def append(self, timestamp: int, value: int):
+        last = self.last_timestamp
+        if last is not None and timestamp < last:
+            return
+        if last is not None and timestamp == last:
+            self._values[(self._start + self._size - 1) % self.capacity] = value
+            return
+        end = (self._start + self._size) % self.capacity
+        self._timestamps[end] = timestamp
+        self._values[end] = value
+        if self._size < self.capacity:
+            self._size += 1
+        else:
+            self._start = (self._start + 1) % self.capacity
+
+    def to_arrays(self):
+        """Toàn bộ chuỗi theo thứ tự thời gian (bản sao)."""
+        return self.window(None)
+
+    def load(self, timestamps: np.ndarray, values: np.ndarray):
+        """Thay toàn bộ nội dung bằng chuỗi đã sắp tăng dần, giữ `capacity` điểm mới nhất."""
+        timestamps, values = timestamps[-self.capacity:], values[-self.capacity:]
+        self._size = len(timestamps)
+        self._start = 0
+        self._timestamps[:self._size] = timestamps
+        self._values[:self._size] = values
+
+    def window(self, since):
+        """
+        Các điểm có timestamp >= since (None: tất cả), theo thứ tự thời gian.
+        Buffer gồm tối đa hai đoạn liên tục đã sắp xếp nên chỉ cần tìm nhị phân rồi cắt.
+        """
+        end = self._start + self._size
+        if end <= self.capacity:
+            segments = [slice(self._start, end)]
+        else:
+            segments = [slice(self._start, self.capacity), slice(0, end - self.capacity)]
+        timestamp_parts, value_parts = [], []
+        for segment in segments:
+            segment_timestamps = self._timestamps[segment]
+            first = 0 if since is None else int(np.searchsorted(segment_timestamps, since, side='left'))
+            timestamp_parts.append(segment_timestamps[first:])
+            value_parts.append(self._values[segment][first:])
+        return np.concatenate(timestamp_parts), np.concatenate(value_parts)
+
+class MarketerSeriesStore:
+    """
+    Một RingBuffer cho mỗi marketer, bucket theo `bucket_seconds`, đủ chứa `max_window_hours`.
+    Đọc/ghi được bảo vệ bởi một lock; đọc một cửa sổ chỉ tốn O(số điểm trong cửa sổ).
+    """
+    def __init__(self, max_window_hours: int, bucket_seconds: int):
+        self.bucket_seconds = bucket_seconds
+        self.capacity = max_window_hours * 3600 // bucket_seconds
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self.warm = False
+
+    def _bucket(self, epoch_seconds: int) -> int:
+        return epoch_seconds - epoch_seconds % self.bucket_seconds
+
+    def _buffer(self, marketer: str) -> RingBuffer:
+        buffer = self._buffers.get(marketer)
+        if buffer is None:
+            buffer = self._buffers[marketer] = RingBuffer(self.capacity)
+        return buffer
+
+    def record(self, snapshot: dict, timestamp: datetime):
+        """Ghi một snapshot {marketer: active users} vào bucket chứa `timestamp`."""
+        bucket = self._bucket(int(timestamp.timestamp()))
+        with self._lock:
+            for marketer, users in snapshot.items():
+                self._buffer(marketer).append(bucket, int(users))
+
+    def warm_start(self, history_df: pd.DataFrame):
+        """
+        Nạp lịch sử (cột timestamp, Marketer, Active Users) vào các buffer. Điểm đã ghi trực tiếp
+        trong lúc đang nạp được ưu tiên hơn điểm cùng bucket từ lịch sử.
+        """
+        with self._lock:
+            if not history_df.empty:
+                epoch_seconds = history_df['timestamp'].to_numpy(dtype='datetime64[s]').view(np.int64)
+                history_buckets = epoch_seconds - epoch_seconds % self.bucket_seconds
+                history_values = history_df['Active Users'].to_numpy(dtype=np.int64)
+                marketers = history_df['Marketer'].to_numpy()
+                for marketer in pd.unique(marketers):
+                    mask = marketers == marketer
+                    live_timestamps, live_values = self._buffer(marketer).to_arrays()
+                    # Nối lịch sử trước, điểm trực tiếp sau; sắp ổn định rồi giữ điểm cuối mỗi bucket
+                    timestamps = np.concatenate([history_buckets[mask], live_timestamps])
+                    values = np.concatenate([history_values[mask], live_values])
+                    order = np.argsort(timestamps, kind='stable')
+                    timestamps, values = timestamps[order], values[order]
+                    keep = np.r_[timestamps[1:] != timestamps[:-1], True]
+                    self._buffers[marketer].load(timestamps[keep], values[keep])
+            self.warm = True
+
+    def get_window(self, time_window_hours: float) -> pd.DataFrame:
+        since = int(time.time() - time_window_hours * 3600)
+        timestamp_parts, value_parts, marketer_parts = [], [], []
+        with self._lock:
+            for marketer, buffer in self._buffers.items():
+                timestamps, values = buffer.window(since)
+                if len(timestamps):
+                    timestamp_parts.append(timestamps)
+                    value_parts.append(values)
+                    marketer_parts.append(np.full(len(timestamps), marketer, dtype=object))
+        if not timestamp_parts:
+            return pd.DataFrame(columns=['timestamp', 'Marketer', 'Active Users'])
+        return pd.DataFrame({
+            'timestamp': pd.to_datetime(np.concatenate(timestamp_parts), unit='s', utc=True),
+            'Marketer': np.concatenate(marketer_parts),
+            'Active Users': np.concatenate(value_parts)
+        })
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "Warm": self.warm,
+                "Marketers": len(self._buffers),
+                "Points": sum(len(buffer) for buffer in self._buffers.values()),
+                "Capacity Per Marketer": self.capacity
+            }
@@ -0,0 +1,257 @@
+# FILE: write_queue.py
+
+import atexit
+import threading
+import time
+from collections import deque
+import streamlit as st
+from config import get_config
+
+class _PendingWrite:
+    """
+    Một nhóm thao tác ghi cùng loại sẽ được gửi trong một request:
+    - upsert: các dòng của cùng bảng/on_conflict được nối vào nhau (chia lô theo batch_size khi gửi);
+    - update: các giá trị cho cùng bảng/điều kiện được gộp, giá trị sau ghi đè giá trị trước;
+    - rpc: chỉ giữ tham số của lần gọi cuối cùng.
+    """
+    __slots__ = ("kind", "target", "options", "payload", "callbacks", "enqueued_monotonic", "size")
+
+    def __init__(self, kind: str, target: str, options: dict, payload):
+        self.kind = kind
+        self.target = target
+        self.options = options
+        self.payload = payload
+        self.callbacks = []
+        self.enqueued_monotonic = time.monotonic()
+        self.size = 0
+
+class SupabaseWriteQueue:
+    """
+    Hàng đợi ghi Supabase chạy nền (write-behind) dùng chung cho cả process. Caller chỉ
+    xếp thao tác vào hàng đợi rồi đi tiếp; một thread riêng gom các thao tác trong
+    `linger_seconds` thành request hàng loạt, thử lại với exponential backoff và xả hết
+    hàng đợi khi process kết thúc. Các update chưa ghi xong được trả qua pending_update()
+    để người vừa lưu settings thấy ngay giá trị mới. Update thất bại sau `max_attempts` không
+    bị bỏ: nó được xếp lại hàng đợi (vẫn nằm trong overlay) và lỗi được giữ trong
+    update_failure() cho tới khi ghi thành công, để UI báo cho admin.
+    """
+    def __init__(self, batch_size: int, linger_seconds: float, max_attempts: int, max_backoff_seconds: float, max_depth: int):
+        self.batch_size = batch_size
+        self.linger_seconds = linger_seconds
+        self.max_attempts = max_attempts
+        self.max_backoff_seconds = max_backoff_seconds
+        self.max_depth = max_depth
+        self._pending = {}
+        self._in_flight = {}
+        self._failures = {}
+        self._depth = 0
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._latencies = deque(maxlen=200)
+        self._stats = {"Batches Sent": 0, "Rows Written": 0, "Retries": 0, "Failed Batches": 0, "Dropped (Queue Full)": 0}
+        self._last_error = ""
+        self._thread = threading.Thread(target=self._run, name="supabase-write-queue", daemon=True)
+        self._thread.start()
+
+    # --- phía caller: không bao giờ chờ mạng ---
+    def _enqueue(self, key, kind: str, target: str, options: dict, payload, merge, size: int, on_success=None) -> bool:
+        with self._condition:
+            if self._stop_event.is_set():
+                print(f"[write_queue] Queue is closed, dropping {kind} on '{target}'.")
+                return False
+            if self._depth + size > self.max_depth:
+                self._stats["Dropped (Queue Full)"] += size
+                print(f"[write_queue] Queue full ({self._depth} pending), dropping {kind} on '{target}'.")
+                return False
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = _PendingWrite(kind, target, options, payload)
+            else:
+                pending.payload = merge(pending.payload, payload)
+                # update/rpc gộp vào thao tác đang chờ nên không làm tăng độ sâu hàng đợi
+                size = size if kind == "upsert" else 0
+            if on_success is not None:
+                pending.callbacks.append(on_success)
+            pending.size += size
+            self._depth += size
+            self._condition.notify()
+        return True
+
+    def upsert(self, table: str, rows: list, on_conflict: str = "", ignore_duplicates: bool = False, on_success=None) -> bool:
+        if not rows:
+            return True
+        options = {"on_conflict": on_conflict, "ignore_duplicates": ignore_duplicates}
+        key = ("upsert", table, on_conflict, ignore_duplicates)
+        return self._enqueue(key, "upsert", table, options, list(rows), lambda old, new: old + new, len(rows), on_success)
+
+    def update(self, table: str, values: dict, match: dict, on_success=None) -> bool:
+        key = ("update", table, tuple(sorted(match.items())))
+        return self._enqueue(key, "update", table, {"match": dict(match)}, dict(values), lambda old, new: {**old, **new}, 1, on_success)
+
+    def rpc(self, function_name: str, params: dict, on_success=None) -> bool:
+        """Các lời gọi cùng hàm chưa được gửi sẽ gộp thành một (dùng cho tác vụ bảo trì như compaction)."""
+        return self._enqueue(("rpc", function_name), "rpc", function_name, {}, dict(params), lambda old, new: new, 1, on_success)
+
+    def pending_update(self, table: str, match: dict) -> dict:
+        """Các giá trị update đang chờ hoặc đang gửi cho một dòng, theo đúng thứ tự sẽ được ghi."""
+        key = ("update", table, tuple(sorted(match.items())))
+        with self._condition:
+            in_flight = self._in_flight.get(key)
+            pending = self._pending.get(key)
+            return {**(in_flight.payload if in_flight else {}), **(pending.payload if pending else {})}
+
+    def update_failure(self, table: str, match: dict):
+        """Lỗi của lần ghi gần nhất nếu update cho dòng này đã thất bại và đang chờ thử lại, ngược lại None."""
+        key = ("update", table, tuple(sorted(match.items())))
+        with self._condition:
+            failure = self._failures.get(key)
+            return dict(failure) if failure else None
+
+    # --- phía thread ghi ---
+    def _execute(self, client, pending: _PendingWrite):
+        if pending.kind == "upsert":
+            # upsert idempotent nên khi thử lại có thể gửi lại cả các lô đã thành công
+            for start in range(0, len(pending.payload), self.batch_size):
+                client.table(pending.target).upsert(pending.payload[start:start + self.batch_size], **pending.options).execute()
+        elif pending.kind == "update":
+            query = client.table(pending.target).update(pending.payload)
+            for column, value in pending.options["match"].items():
+                query = query.eq(column, value)
+            query.execute()
+        else:
+            client.rpc(pending.target, pending.payload).execute()
+
+    def _send_with_retry(self, pending: _PendingWrite):
+        config = get_config()
+        delay = 0.5
+        for attempt in range(1, self.max_attempts + 1):
+            client = config.supabase
+            try:
+                if client is None:
+                    raise ConnectionError("Supabase is not configured")
+                self._execute(client, pending)
+                config.record_supabase_result()
+                return True
+            except Exception as e:
+                config.record_supabase_result(e)
+                self._last_error = str(e)
+                if attempt == self.max_attempts:
+                    print(f"[write_queue] Giving up on {pending.kind} '{pending.target}' after {attempt} attempts. Error: {e}")
+                    return False
+                print(f"[write_queue] {pending.kind} '{pending.target}' failed (attempt {attempt}), retrying in {delay:.1f}s. Error: {e}")
+                self._stats["Retries"] += 1
+                # Khi đang tắt, wait() trả về ngay để xả hàng đợi trong thời gian cho phép
+                self._stop_event.wait(delay)
+                delay = min(delay * 2, self.max_backoff_seconds)
+        return False
+
+    def _take_batch(self) -> dict:
+        with self._condition:
+            while not self._pending and not self._stop_event.is_set():
+                self._condition.wait()
+            # Chờ thêm một chút để gom các thao tác đến sát nhau vào cùng request
+            linger_deadline = time.monotonic() + self.linger_seconds
+            while not self._stop_event.is_set() and time.monotonic() < linger_deadline:
+                self._condition.wait(linger_deadline - time.monotonic())
+            batch, self._pending = self._pending, {}
+            self._in_flight = batch
+            return batch
+
+    def _requeue_failed_update(self, key, failed: _PendingWrite):
+        """
+        Update (settings) đã hết lượt thử: ghi nhận lỗi và xếp lại hàng đợi, dưới các giá trị mới hơn
+        cho cùng dòng nếu có, để giá trị admin đã lưu không biến mất khỏi overlay. Gọi khi giữ _condition.
+        """
+        failure = self._failures.get(key)
+        self._failures[key] = {
+            "error": self._last_error,
+            "failed_attempts": (failure["failed_attempts"] if failure else 0) + self.max_attempts,
+            "first_failed_at": failure["first_failed_at"] if failure else time.time()
+        }
+        if self._stop_event.is_set():
+            print(f"[write_queue] Dropping failed {failed.kind} on '{failed.target}' at shutdown.")
+            self._depth -= failed.size
+            return
+        newer = self._pending.get(key)
+        if newer is None:
+            self._pending[key] = failed
+        else:
+            newer.payload = {**failed.payload, **newer.payload}
+            newer.callbacks = failed.callbacks + newer.callbacks
+            self._depth -= failed.size
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch and self._stop_event.is_set():
+                return
+            for key, pending in batch.items():
+                succeeded = self._send_with_retry(pending)
+                with self._condition:
+                    self._latencies.append(time.monotonic() - pending.enqueued_monotonic)
+                    self._stats["Batches Sent" if succeeded else "Failed Batches"] += 1
+                    if succeeded and pending.kind == "upsert":
+                        self._stats["Rows Written"] += len(pending.payload)
+                    if succeeded:
+                        self._failures.pop(key, None)
+                    if not succeeded and pending.kind == "update":
+                        self._requeue_failed_update(key, pending)
+                    else:
+                        self._depth -= pending.size
+                if succeeded:
+                    for callback in pending.callbacks:
+                        try:
+                            callback()
+                        except Exception as e:
+                            print(f"[write_queue] Callback after {pending.kind} '{pending.target}' failed: {e}")
+            with self._condition:
+                self._in_flight = {}
+                self._condition.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """Chờ tới khi mọi thao tác đã xếp hàng được gửi (hoặc hết `timeout`)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._pending or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self, timeout: float = None):
+        """Ngừng nhận thao tác mới, xả hàng đợi rồi dừng thread ghi."""
+        with self._condition:
+            self._stop_event.set()
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive() or self._depth:
+            print(f"[write_queue] Shutdown timed out with {self._depth} writes still pending.")
+
+    def status(self) -> dict:
+        with self._condition:
+            oldest = min((pending.enqueued_monotonic for pending in [*self._pending.values(), *self._in_flight.values()]), default=None)
+            latencies = sorted(self._latencies)
+            return {
+                "Queue Depth": self._depth,
+                "Oldest Pending (s)": round(time.monotonic() - oldest, 2) if oldest is not None else 0.0,
+                "Write Latency p50 (s)": round(latencies[len(latencies) // 2], 3) if latencies else 0.0,
+                "Write Latency max (s)": round(latencies[-1], 3) if latencies else 0.0,
+                **self._stats,
+                "Last Error": self._last_error
+            }
+
+@st.cache_resource
+def get_write_queue():
+    """
+    Hàng đợi ghi Supabase dùng chung cho toàn bộ process; được xả khi process kết thúc.
+    """
+    config = get_config()
+    write_queue = SupabaseWriteQueue(
+        config.WRITE_QUEUE_BATCH_SIZE, config.WRITE_QUEUE_LINGER_SECONDS, config.WRITE_QUEUE_MAX_ATTEMPTS,
+        config.WRITE_QUEUE_MAX_BACKOFF_SECONDS, config.WRITE_QUEUE_MAX_DEPTH
+    )
+    # Đăng ký sau resources.close_all_resources nên chạy trước nó (atexit theo thứ tự ngược),
+    # tức hàng đợi được xả khi Supabase client vẫn còn mở
+    atexit.register(write_queue.close, config.WRITE_QUEUE_SHUTDOWN_TIMEOUT_SECONDS)
+    return write_queue